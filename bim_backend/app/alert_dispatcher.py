@@ -0,0 +1,210 @@
+"""
+    Restock alert dispatcher.
+
+    Write paths only insert rows into the alert_outbox table, in the same
+    transaction as the stock change (see crud.record_threshold_edges). A background thread per
+    worker claims pending rows, fetches the recipient list once and sends one
+    message to all recipients over a long-lived SMTP connection. With
+    ALERT_DIGEST_WINDOW > 0, alerts are held until the oldest one is that many
+    seconds old and then go out together as a single digest. In ASYNC_MODE the
+    dispatcher runs as a task on the event loop and sends with aiosmtplib.
+"""
+import asyncio
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, or_, select, update
+
+from app import email_service, models
+from app.database import AppSession, SessionLocal
+
+ALERT_DIGEST_WINDOW = float(os.getenv("ALERT_DIGEST_WINDOW", 0))  # seconds, 0 = send immediately
+ALERT_POLL_INTERVAL = float(os.getenv("ALERT_POLL_INTERVAL", 5))
+ALERT_CLAIM_LEASE = timedelta(minutes=5)  # a crashed dispatcher's claims are retried after this
+ALERT_MAX_ATTEMPTS = 5
+
+
+class AlertDispatcher:
+    """Drains the alert outbox on a background thread."""
+
+    def __init__(self, digest_window: float = ALERT_DIGEST_WINDOW, poll_interval: float = ALERT_POLL_INTERVAL):
+        self.digest_window = timedelta(seconds=digest_window)
+        self.poll_interval = poll_interval
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._loop = self._task = self._async_wake = None
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="alert-dispatcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._wake.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+        email_service.smtp_connection.close()
+
+    def wake(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._async_wake.set)
+        else:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(timeout=self.poll_interval)
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Alert dispatch failed: {e}")
+
+    # ---------- ASYNC_MODE: runs on the event loop and sends with aiosmtplib ----------
+    async def start_async(self):
+        self._loop = asyncio.get_running_loop()
+        self._async_wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run_async())
+
+    async def stop_async(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = self._loop = None
+        await email_service.async_smtp_connection.close()
+
+    async def _run_async(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._async_wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._async_wake.clear()
+            try:
+                await self.run_once_async()
+            except Exception as e:
+                print(f"Alert dispatch failed: {e}")
+
+    def run_once(self) -> int:
+        """Send whatever is due; returns the number of outbox rows delivered"""
+        claimed = self._claim()
+        if not claimed:
+            return 0
+        rows, recipients = claimed
+        outcomes = []
+        for group in self._groups(rows):
+            try:
+                if recipients:
+                    email_service.smtp_connection.send(self._message(recipients, group), recipients)
+                outcomes.append((group, None))
+            except Exception as e:
+                outcomes.append((group, e))
+        return self._complete(outcomes, recipients)
+
+    async def run_once_async(self) -> int:
+        claimed = await asyncio.to_thread(self._claim)
+        if not claimed:
+            return 0
+        rows, recipients = claimed
+        outcomes = []
+        for group in self._groups(rows):
+            try:
+                if recipients:
+                    await email_service.async_smtp_connection.send(self._message(recipients, group), recipients)
+                outcomes.append((group, None))
+            except Exception as e:
+                outcomes.append((group, e))
+        return await asyncio.to_thread(self._complete, outcomes, recipients)
+
+    def _claim(self):
+        """Claim due outbox rows for this dispatcher; returns (rows, recipients) or None"""
+        outbox = models.AlertOutbox
+        db = SessionLocal()
+        try:
+            now = datetime.now()
+            pending = (outbox.sent_at.is_(None), outbox.attempts < ALERT_MAX_ATTEMPTS)
+            if self.digest_window:
+                oldest = db.execute(select(outbox.created_at).where(*pending).order_by(outbox.created_at).limit(1)).scalar()
+                if oldest is None or now - oldest < self.digest_window:
+                    return None
+
+            # Claim rows so several workers' dispatchers never send the same alert
+            token = uuid.uuid4().hex
+            db.execute(
+                update(outbox)
+                .where(*pending, or_(outbox.claimed_at.is_(None), outbox.claimed_at < now - ALERT_CLAIM_LEASE))
+                .values(claimed_by=token, claimed_at=now)
+            )
+            db.commit()
+            rows = db.execute(
+                select(
+                    outbox.id, outbox.product_name, outbox.quantity, outbox.threshold, outbox.quantity_to_order,
+                ).where(outbox.claimed_by == token).order_by(outbox.id)
+            ).mappings().all()
+            if not rows:
+                return None
+            return [dict(row) for row in rows], email_service.get_admin_emails(db)
+        finally:
+            db.close()
+
+    def _groups(self, rows: list[dict]) -> list[list[dict]]:
+        return [rows] if self.digest_window else [[row] for row in rows]
+
+    def _message(self, recipients: list[str], rows: list[dict]):
+        """One message to all recipients covering the given outbox rows"""
+        return email_service.build_threshold_email(recipients, rows)
+
+    def _complete(self, outcomes: list, recipients: list[str]) -> int:
+        """Mark delivered rows as sent and release failed ones for a retry"""
+        outbox = models.AlertOutbox
+        delivered = 0
+        db = SessionLocal()
+        try:
+            for group, error in outcomes:
+                ids = [row["id"] for row in group]
+                if error is None:
+                    db.execute(
+                        update(outbox).where(outbox.id.in_(ids)).values(
+                            sent_at=datetime.now(),
+                            last_error=None if recipients else "No recipients configured",
+                        )
+                    )
+                    delivered += len(ids)
+                else:
+                    print(f"Alert email failed: {error}")
+                    db.execute(
+                        update(outbox).where(outbox.id.in_(ids)).values(
+                            attempts=outbox.attempts + 1,
+                            last_error=str(error)[:500],
+                            claimed_by=None,
+                            claimed_at=None,
+                        )
+                    )
+            db.commit()
+            return delivered
+        finally:
+            db.close()
+
+
+dispatcher = AlertDispatcher()
+
+
+@event.listens_for(AppSession, "after_commit")
+def _wake_dispatcher(session):
+    if session.info.pop("alerts_queued", False):
+        dispatcher.wake()
+
+
+@event.listens_for(AppSession, "after_transaction_end")
+def _drop_flag(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("alerts_queued", None)
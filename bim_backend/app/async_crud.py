@@ -0,0 +1,74 @@
+"""
+    Async counterparts of the crud functions used on the hot request paths (ASYNC_MODE).
+
+    Plain reads are native async queries. Writes run the sync crud logic through
+    AsyncSession.run_sync, which executes it in a greenlet on the async driver,
+    so the conditional updates, version stamping and alert outbox logic exist
+    only once.
+"""
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import crud, models, schemas, scan_rollups
+
+
+# ---------- Product CRUD ----------
+async def get_product_by_barcode(db: AsyncSession, barcode: str):
+    result = await db.execute(select(models.ProductDB).where(models.ProductDB.barcode == barcode))
+    return result.scalars().first()
+
+async def get_products(db: AsyncSession):
+    result = await db.execute(select(models.ProductDB))
+    return result.scalars().all()
+
+async def decrement_product_quantity(db: AsyncSession, barcode: str, decrement_by: int):
+    return await db.run_sync(crud.decrement_product_quantity, barcode, decrement_by)
+
+async def record_threshold_edges(db: AsyncSession, product_ids) -> int:
+    return await db.run_sync(crud.record_threshold_edges, list(product_ids))
+
+async def apply_scan_batch(db: AsyncSession, scans: list[schemas.ScanBatchItem]):
+    return await db.run_sync(crud.apply_scan_batch, scans)
+
+# ---------- Email Settings CRUD ----------
+async def add_email(db: AsyncSession, email: schemas.EmailSettingsCreate):
+    db_email = models.EmailSettingsDB(email=email.email)
+    db.add(db_email)
+    await db.commit()
+    await db.refresh(db_email)
+    return db_email
+
+async def get_all_emails(db: AsyncSession):
+    result = await db.execute(select(models.EmailSettingsDB))
+    return result.scalars().all()
+
+# ---------- Scan CRUD ----------
+async def scan_product_with_log(db: AsyncSession, barcode: str, scan: schemas.ScanSubmit):
+    def scan_and_load(session):
+        db_log = crud.scan_product_with_log(session, barcode, scan)
+        if db_log:
+            db_log.product  # load while still inside the greenlet
+        return db_log
+    return await db.run_sync(scan_and_load)
+
+async def create_scan_log(db: AsyncSession, scan: schemas.ScanLogCreate, product: models.ProductDB):
+    db_log = models.ScanLog(
+        purpose=scan.purpose,
+        scanned_by=scan.scanned_by,
+        product_id=scan.product_id,
+        quantity=product.quantity,
+        threshold=product.threshold,
+        decremented_by=scan.decremented_by,
+        classification=product.classification,
+        scanned_at=datetime.now(),
+    )
+    db.add(db_log)
+    await db.run_sync(scan_rollups.record, [db_log])
+    await db.commit()
+    await db.refresh(db_log, ["product"])
+    return db_log
+
+async def get_scan_logs(db: AsyncSession, **filters):
+    return await db.run_sync(lambda session: crud.get_scan_logs(session, **filters))
@@ -0,0 +1,152 @@
+"""
+    Collision-free barcode allocation without probing the products table.
+
+    Each worker process reserves a block of sequence numbers from the
+    counters table (one atomic UPDATE ... RETURNING per block), then maps
+    every number through a keyed Feistel permutation so consecutive products
+    still get non-sequential looking codes. The permutation is a bijection on the
+    format's number space, so distinct sequence numbers can never collide.
+"""
+import hashlib
+import os
+import threading
+
+from app import crud
+from app.database import engine
+
+BARCODE_FORMAT = os.getenv("BARCODE_FORMAT", "code128")  # code128 / ean13 / upca
+BARCODE_PREFIX = os.getenv("BARCODE_PREFIX")  # defaults per format, see FORMATS
+BARCODE_BLOCK_SIZE = int(os.getenv("BARCODE_BLOCK_SIZE", 100))
+BARCODE_PERMUTATION_KEY = os.getenv("BARCODE_PERMUTATION_KEY", "bim-barcodes")
+
+# format -> (default prefix, free digits after the prefix, has check digit)
+FORMATS = {
+    "code128": ("", 8, False),
+    "ean13": ("20", 10, True),  # 20-29: in-store / restricted circulation
+    "upca": ("2", 10, True),  # number system 2: in-store
+}
+
+
+def check_digit(digits: str) -> str:
+    """GS1 mod-10 check digit (EAN-13, UPC-A, ...)"""
+    total = 0
+    for i, d in enumerate(reversed(digits)):
+        total += int(d) * (3 if i % 2 == 0 else 1)
+    return str((10 - total % 10) % 10)
+
+
+def symbology_for(value: str) -> str:
+    """python-barcode symbology for an allocated value (legacy/other values render as Code128)"""
+    if value.isdigit() and len(value) in (12, 13) and check_digit(value[:-1]) == value[-1]:
+        return "upca" if len(value) == 12 else "ean13"
+    return "code128"
+
+
+class FeistelPermutation:
+    """Keyed, reversible permutation of range(size) using cycle walking."""
+
+    ROUNDS = 4
+
+    def __init__(self, size: int, key: str):
+        self.size = size
+        bits = max(2, (size - 1).bit_length())
+        self.half_bits = (bits + 1) // 2
+        self.mask = (1 << self.half_bits) - 1
+        self.key = hashlib.sha256(key.encode()).digest()  # blake2b keys are at most 64 bytes
+
+    def _round(self, r: int, value: int) -> int:
+        digest = hashlib.blake2b(value.to_bytes(8, "big"), key=self.key, digest_size=8, person=bytes([r]) * 16)
+        return int.from_bytes(digest.digest(), "big") & self.mask
+
+    def _encrypt(self, x: int) -> int:
+        left, right = x >> self.half_bits, x & self.mask
+        for r in range(self.ROUNDS):
+            left, right = right, left ^ self._round(r, right)
+        return (left << self.half_bits) | right
+
+    def _decrypt(self, y: int) -> int:
+        left, right = y >> self.half_bits, y & self.mask
+        for r in reversed(range(self.ROUNDS)):
+            left, right = right ^ self._round(r, left), left
+        return (left << self.half_bits) | right
+
+    def forward(self, x: int) -> int:
+        y = self._encrypt(x)
+        while y >= self.size:  # cycle walk back into range
+            y = self._encrypt(y)
+        return y
+
+    def inverse(self, y: int) -> int:
+        x = self._decrypt(y)
+        while x >= self.size:
+            x = self._decrypt(x)
+        return x
+
+
+class BarcodeAllocator:
+    """Hands out unique barcodes from per-process reserved blocks of a DB sequence."""
+
+    def __init__(
+        self,
+        fmt: str = BARCODE_FORMAT,
+        prefix: str | None = BARCODE_PREFIX,
+        block_size: int = BARCODE_BLOCK_SIZE,
+        key: str = BARCODE_PERMUTATION_KEY,
+    ):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown barcode format '{fmt}', expected one of {sorted(FORMATS)}")
+        default_prefix, free_digits, self.has_check_digit = FORMATS[fmt]
+        self.format = fmt
+        self.prefix = default_prefix if prefix is None else prefix
+        self.free_digits = free_digits - (len(self.prefix) - len(default_prefix))
+        if self.free_digits < 4:
+            raise ValueError(f"Prefix '{self.prefix}' leaves too few digits for {fmt}")
+
+        if fmt == "code128" and not self.prefix:
+            # Keep the legacy 10000000-99999999 range (no leading zero)
+            self.offset, self.size = 10 ** (free_digits - 1), 9 * 10 ** (free_digits - 1)
+        else:
+            self.offset, self.size = 0, 10 ** self.free_digits
+
+        self.block_size = block_size
+        self.permutation = FeistelPermutation(self.size, f"{key}:{fmt}:{self.prefix}")
+        self._next = self._end = 0
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+
+    def encode(self, n: int) -> str:
+        """Sequence number -> barcode string"""
+        if not 0 <= n < self.size:
+            raise RuntimeError(f"Barcode space for {self.format}/{self.prefix!r} is exhausted")
+        body = self.prefix + str(self.offset + self.permutation.forward(n)).zfill(self.free_digits)
+        return body + check_digit(body) if self.has_check_digit else body
+
+    def decode(self, value: str) -> int:
+        """Barcode string -> sequence number (inverse of encode)"""
+        body = value[:-1] if self.has_check_digit else value
+        return self.permutation.inverse(int(body[len(self.prefix):]) - self.offset)
+
+    def _reserve(self, count: int) -> tuple[int, int]:
+        """Atomically take [start, end) from the shared counter, in its own transaction"""
+        with engine.begin() as conn:
+            end = crud.increment_counter(conn, f"barcode:{self.format}:{self.prefix}", count)
+        return end - count, end
+
+    def allocate(self) -> str:
+        """Next unique barcode (one counter UPDATE per block_size calls)"""
+        with self._lock:
+            if self._pid != os.getpid():  # forked child must not reuse the parent's block
+                self._pid, self._next, self._end = os.getpid(), 0, 0
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(self.block_size)
+            n = self._next
+            self._next += 1
+        return self.encode(n)
+
+    def allocate_many(self, count: int) -> list[str]:
+        """Reserve exactly `count` barcodes in one round trip (bulk imports)"""
+        start, end = self._reserve(count)
+        return [self.encode(n) for n in range(start, end)]
+
+
+allocator = BarcodeAllocator()
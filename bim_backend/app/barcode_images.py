@@ -0,0 +1,166 @@
+"""
+    Barcode image rendering, off the request path.
+
+    Images are rendered in a process pool (PIL work holds the GIL) and cached in
+    an in-memory LRU that is backed by files in BARCODE_DIR.
+"""
+import glob
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import barcode
+from barcode.writer import ImageWriter, SVGWriter
+
+from app.barcode_allocator import symbology_for
+
+BARCODE_DIR = "barcodes"
+DEFAULT_DPI = 300  # python-barcode ImageWriter default
+MIN_DPI, MAX_DPI = 150, 1200  # below ~130 dpi a 0.2mm bar is narrower than a pixel
+CACHE_SIZE = int(os.getenv("BARCODE_CACHE_SIZE", 512))
+RENDER_WORKERS = int(os.getenv("BARCODE_RENDER_WORKERS", 2))
+RENDERER_VERSION = "1"  # bump to invalidate client ETags if rendering changes
+
+MEDIA_TYPES = {"png": "image/png", "svg": "image/svg+xml"}
+
+os.makedirs(BARCODE_DIR, exist_ok=True)
+
+_pool: ProcessPoolExecutor | None = None
+_cache: "OrderedDict[tuple, bytes]" = OrderedDict()
+_inflight: dict[tuple, Future] = {}
+_lock = threading.Lock()
+
+
+def render_barcode(value: str, fmt: str = "png", dpi: int = DEFAULT_DPI) -> bytes:
+    """Render a barcode to PNG or SVG bytes (runs inside the worker processes)"""
+    if fmt == "svg":
+        writer, options = SVGWriter(), {}
+    else:
+        writer, options = ImageWriter(), {"dpi": dpi}
+    buf = io.BytesIO()
+    barcode.get(symbology_for(value), value, writer=writer).write(buf, options=options)
+    return buf.getvalue()
+
+
+def _cache_key(value: str, fmt: str, dpi: int) -> tuple:
+    # SVG is resolution independent
+    return (value, fmt, None if fmt == "svg" else dpi)
+
+
+def file_path(value: str, fmt: str = "png", dpi: int = DEFAULT_DPI) -> str:
+    """Disk location of a rendered image; the default PNG keeps the legacy '<barcode>.png' name"""
+    if fmt == "png" and dpi == DEFAULT_DPI:
+        return os.path.join(BARCODE_DIR, f"{value}.png")
+    if fmt == "svg":
+        return os.path.join(BARCODE_DIR, f"{value}.svg")
+    return os.path.join(BARCODE_DIR, f"{value}@{dpi}.{fmt}")
+
+
+def etag(value: str, fmt: str = "png", dpi: int = DEFAULT_DPI) -> str:
+    """Strong ETag derived from the render inputs, so it can be checked without rendering"""
+    key = "|".join(str(part) for part in (*_cache_key(value, fmt, dpi), symbology_for(value), RENDERER_VERSION))
+    return '"' + hashlib.sha1(key.encode()).hexdigest() + '"'
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+    return _pool
+
+
+def _render_to_disk(value: str, fmt: str, dpi: int) -> bytes:
+    """Render then write atomically, so readers never see a half-written file"""
+    data = render_barcode(value, fmt, dpi)
+    path = file_path(value, fmt, dpi)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    return data
+
+
+def load_or_render(value: str) -> bytes:
+    """Default PNG from BARCODE_DIR, rendered and saved first if missing (for worker processes: no LRU)"""
+    try:
+        with open(file_path(value), "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return _render_to_disk(value, "png", DEFAULT_DPI)
+
+
+def _remember(key: tuple, data: bytes):
+    with _lock:
+        _cache[key] = data
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def prerender(value: str) -> Future:
+    """Fire-and-forget render of the default PNG (used when a product is created)"""
+    return _submit(value, "png", DEFAULT_DPI)
+
+
+def _render_many_to_disk(values: list[str]):
+    for value in values:
+        _render_to_disk(value, "png", DEFAULT_DPI)
+
+
+def prerender_many(values: list[str]) -> Future:
+    """Render default PNGs for many barcodes as one pool task (bulk imports skip the LRU)"""
+    return _get_pool().submit(_render_many_to_disk, list(values))
+
+
+def _submit(value: str, fmt: str, dpi: int) -> Future:
+    key = _cache_key(value, fmt, dpi)
+    with _lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future
+        future = _get_pool().submit(_render_to_disk, value, fmt, dpi)
+        _inflight[key] = future
+    # Outside the lock: the callback runs inline if the render already finished
+    future.add_done_callback(lambda f: _finish(key, f))
+    return future
+
+
+def _finish(key: tuple, future: Future):
+    with _lock:
+        _inflight.pop(key, None)
+    if not future.cancelled() and future.exception() is None:
+        _remember(key, future.result())
+
+
+def get_image(value: str, fmt: str = "png", dpi: int = DEFAULT_DPI) -> bytes:
+    """Return image bytes from memory, then disk, rendering in the pool as a last resort"""
+    key = _cache_key(value, fmt, dpi)
+    with _lock:
+        data = _cache.get(key)
+        if data is not None:
+            _cache.move_to_end(key)
+            return data
+
+    path = file_path(value, fmt, dpi)
+    if os.path.isfile(path):
+        with open(path, "rb") as f:
+            data = f.read()
+        _remember(key, data)
+        return data
+
+    return _submit(value, fmt, dpi).result()
+
+
+def discard(value: str):
+    """Drop every cached and on-disk rendering of a barcode (e.g. on product delete)"""
+    with _lock:
+        for key in [k for k in _cache if k[0] == value]:
+            del _cache[key]
+    for path in glob.glob(os.path.join(BARCODE_DIR, f"{glob.escape(value)}[.@]*")):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -0,0 +1,161 @@
+"""
+    Catalog versioning for conditional GET and delta sync of the product list.
+
+    Every transaction that changes products gets one new value of the
+    "catalog" counter, stamped on the rows it touches (and on tombstones for
+    deleted rows). Versions become visible in commit order, so
+    `version > since` never skips a change. Where the stamp is taken
+    (CATALOG_STAMP):
+
+      commit        inside the writing transaction. The counter row stays locked
+                    until that commits, which is free on SQLite (one writer at a
+                    time anyway) and the default there.
+      after_commit  the write stamps its rows PENDING and commits without touching
+                    the counter; right after, a short transaction claims the
+                    committed PENDING rows, bumps the counter and stamps them.
+                    Writes to different products then never wait on each other
+                    (default on other databases). Rows left PENDING by a worker
+                    that died in between are stamped by the next write.
+"""
+import asyncio
+import os
+import threading
+import time
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+
+from app import crud, models
+from app.database import AppSession, engine
+
+CATALOG_COUNTER = "catalog"
+CATALOG_STAMP = os.getenv("CATALOG_STAMP", "auto")  # commit, after_commit or auto
+PENDING = -1  # rows changed by a committed write whose version isn't stamped yet
+# How long a worker trusts its last known version before re-reading the counter
+VERSION_TTL = float(os.getenv("CATALOG_VERSION_TTL", 1.0))
+
+_lock = threading.Lock()
+_known = {"version": None, "checked_at": 0.0}
+_list_cache = {"version": None, "body": None}  # serialized full product list
+
+
+def stamps_after_commit() -> bool:
+    if CATALOG_STAMP not in ("auto", "commit", "after_commit"):
+        raise ValueError(f"Unknown CATALOG_STAMP '{CATALOG_STAMP}', choose from ['auto', 'commit', 'after_commit']")
+    return CATALOG_STAMP == "after_commit" or (CATALOG_STAMP == "auto" and engine.dialect.name != "sqlite")
+
+
+def next_version(db: Session) -> int:
+    """Version to stamp on the products this transaction changes: the counter's next value
+    (bumped once per transaction), or PENDING when versions are stamped after commit"""
+    if stamps_after_commit():
+        db.info["catalog_pending"] = True
+        return PENDING
+    version = db.info.get("catalog_version")
+    if version is None:
+        version = crud.increment_counter(db, CATALOG_COUNTER)
+        db.info["catalog_version"] = version
+    return version
+
+
+def stamp_pending(bind=engine) -> int | None:
+    """Give the committed PENDING rows the next version; returns it (None if nothing was pending)"""
+    products, tombstones = models.ProductDB.__table__, models.ProductTombstone.__table__
+    with bind.begin() as conn:
+        # Rows a write in flight has locked are its own to stamp after it commits
+        product_ids = conn.execute(
+            select(products.c.id).where(products.c.version == PENDING).with_for_update(skip_locked=True)
+        ).scalars().all()
+        tombstone_ids = conn.execute(
+            select(tombstones.c.id).where(tombstones.c.version == PENDING).with_for_update(skip_locked=True)
+        ).scalars().all()
+        if not product_ids and not tombstone_ids:
+            return None
+        # The counter is taken last and released at commit, so stamps are short and commit in version order
+        version = crud.increment_counter(conn, CATALOG_COUNTER)
+        for i in range(0, len(product_ids), 1000):
+            conn.execute(update(products).where(products.c.id.in_(product_ids[i:i + 1000])).values(version=version))
+        for i in range(0, len(tombstone_ids), 1000):
+            conn.execute(update(tombstones).where(tombstones.c.id.in_(tombstone_ids[i:i + 1000])).values(version=version))
+    _remember(version)
+    return version
+
+
+def read_version(db: Session) -> int:
+    """Latest committed catalog version, straight from the DB"""
+    counters = models.Counter.__table__
+    version = db.execute(select(counters.c.value).where(counters.c.name == CATALOG_COUNTER)).scalar() or 0
+    _remember(version)
+    return version
+
+
+def current_version(db: Session) -> int:
+    """Latest catalog version, re-read from the DB at most every VERSION_TTL seconds"""
+    with _lock:
+        if _known["version"] is not None and time.monotonic() - _known["checked_at"] < VERSION_TTL:
+            return _known["version"]
+    return read_version(db)
+
+
+def _remember(version: int):
+    with _lock:
+        _known["version"] = max(version, _known["version"] or 0)
+        _known["checked_at"] = time.monotonic()
+
+
+def etag(version: int) -> str:
+    return f'"catalog-{version}"'
+
+
+def cached_list(version: int) -> bytes | None:
+    with _lock:
+        return _list_cache["body"] if _list_cache["version"] == version else None
+
+
+def cache_list(version: int, body: bytes):
+    with _lock:
+        _list_cache["version"], _list_cache["body"] = version, body
+
+
+@event.listens_for(AppSession, "before_flush")
+def _stamp_versions(session, flush_context, instances):
+    """Stamp ORM-level product changes; bulk/Core writes call next_version() themselves"""
+    changed = [obj for obj in session.new if isinstance(obj, models.ProductDB)]
+    changed += [
+        obj for obj in session.dirty
+        if isinstance(obj, models.ProductDB) and session.is_modified(obj, include_collections=False)
+    ]
+    deleted = [obj for obj in session.deleted if isinstance(obj, models.ProductDB)]
+    if not changed and not deleted:
+        return
+
+    version = next_version(session)
+    for product in changed:
+        product.version = version
+    for product in deleted:
+        session.add(models.ProductTombstone(product_id=product.id, barcode=product.barcode, version=version))
+
+
+# insert=True: runs ahead of change_feed's after_commit, so staged events get the stamped version
+@event.listens_for(AppSession, "after_commit", insert=True)
+def _publish_version(session):
+    version = session.info.pop("catalog_version", None)
+    if version is not None:
+        _remember(version)
+    if session.info.pop("catalog_pending", False):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            version = stamp_pending()
+            for staged in session.info.get("change_events", ()):
+                if staged.get("version") == PENDING:
+                    staged["version"] = version
+        else:  # AsyncSession: don't block the event loop on the stamp
+            asyncio.get_running_loop().run_in_executor(None, stamp_pending)
+
+
+@event.listens_for(AppSession, "after_transaction_end")
+def _drop_version(session, transaction):
+    if transaction.parent is None:  # rolled back or closed without commit
+        session.info.pop("catalog_version", None)
+        session.info.pop("catalog_pending", None)
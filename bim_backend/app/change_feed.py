@@ -0,0 +1,349 @@
+"""
+    Inventory change feed, pushed to clients over WebSocket and SSE (routes/changes.py).
+
+    Write paths stage events on the session (product.created / .updated /
+    .deleted, products.imported, scan, restock, threshold_crossed,
+    scan_log.created / .deleted). ORM changes are picked up in after_flush; Core writes call
+    stage() themselves. Staged events are published only after the transaction
+    commits, all events of a commit together and in order.
+
+    The broker numbers events and keeps the last CHANGE_FEED_HISTORY of them,
+    so a reconnecting client resumes after the last sequence it saw. If it fell
+    further behind than that, it gets a `reset` event and refetches. Brokers:
+
+      local       in-process; sequence and history belong to this worker (default)
+      redis://..  a Redis stream shared by all workers (needs the redis package)
+
+    Each worker fans events out to its subscribers on the event loop: a
+    subscriber is a bounded asyncio queue and no thread, so idle connections
+    only cost memory. A subscriber that falls CHANGE_FEED_QUEUE events behind
+    is dropped and resumes from history on reconnect.
+"""
+import asyncio
+import json
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import models
+from app.database import AppSession
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+CHANGE_FEED_BROKER = os.getenv("CHANGE_FEED_BROKER", "local")  # "local" or a redis:// URL
+CHANGE_FEED_HISTORY = int(os.getenv("CHANGE_FEED_HISTORY", 10000))  # events kept for resuming
+CHANGE_FEED_QUEUE = int(os.getenv("CHANGE_FEED_QUEUE", 1000))  # per-subscriber buffer
+CHANGE_FEED_HEARTBEAT = float(os.getenv("CHANGE_FEED_HEARTBEAT", 15))  # seconds
+REDIS_STREAM = "bim:changes"
+REDIS_SEQUENCE = "bim:changes:seq"
+
+EVENT_TYPES = (
+    "product.created", "product.updated", "product.deleted", "products.imported",
+    "scan", "restock", "threshold_crossed", "scan_log.created", "scan_log.deleted",
+)
+
+
+# ---------- Staging ----------
+def stage(db, type: str, **fields):
+    """Queue an event for publication when the session's transaction commits"""
+    db.info.setdefault("change_events", []).append({"type": type, "at": datetime.now().isoformat(), **fields})
+
+
+def product_fields(product) -> dict:
+    return {
+        "product_id": product.id,
+        "barcode": product.barcode,
+        "name": product.name,
+        "quantity": product.quantity,
+        "threshold": product.threshold,
+        "quantity_to_order": product.quantity_to_order,
+        "classification": product.classification,
+    }
+
+
+def scan_log_fields(log) -> dict:
+    get = log.get if isinstance(log, dict) else lambda name: getattr(log, name)
+    scanned_at = get("scanned_at")
+    return {
+        "scan_log_id": get("id"),
+        "product_id": get("product_id"),
+        "purpose": get("purpose"),
+        "scanned_by": get("scanned_by"),
+        "scanned_at": scanned_at.isoformat() if scanned_at else None,
+        "quantity": get("quantity"),
+        "decremented_by": get("decremented_by"),
+        "classification": get("classification"),
+    }
+
+
+@event.listens_for(AppSession, "after_flush")
+def _stage_orm_changes(session, flush_context):
+    deleted_products = set()
+    for obj in session.deleted:
+        if isinstance(obj, models.ProductDB):
+            deleted_products.add(obj.id)
+            stage(session, "product.deleted", product_id=obj.id, barcode=obj.barcode)
+    for obj in session.new:
+        if isinstance(obj, models.ProductDB):
+            stage(session, "product.created", **product_fields(obj))
+        elif isinstance(obj, models.ScanLog):
+            stage(session, "scan_log.created", **scan_log_fields(obj))
+    for obj in session.dirty:
+        if isinstance(obj, models.ProductDB) and session.is_modified(obj, include_collections=False):
+            stage(session, "product.updated", **product_fields(obj))
+    for obj in session.deleted:
+        # Logs deleted along with their product are covered by product.deleted
+        if isinstance(obj, models.ScanLog) and obj.product_id not in deleted_products:
+            stage(session, "scan_log.deleted", scan_log_id=obj.id, product_id=obj.product_id)
+
+
+@event.listens_for(AppSession, "after_commit")
+def _publish_staged(session):
+    events = session.info.pop("change_events", None)
+    if events:
+        try:
+            feed.broker.publish(events)
+        except Exception as e:  # the commit already happened; never fail the request over the feed
+            print(f"Change feed publish failed: {e}")
+
+
+@event.listens_for(AppSession, "after_transaction_end")
+def _drop_staged(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("change_events", None)
+
+
+# ---------- Brokers ----------
+class LocalBroker:
+    """In-process broker: sequence numbers and history live in this worker only."""
+
+    def __init__(self, history: int = CHANGE_FEED_HISTORY):
+        self._history = deque(maxlen=history)
+        self._seq = 0
+        self._lock = threading.Lock()
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+
+    def stop(self):
+        self._deliver = None
+
+    def publish(self, events: list[dict]):
+        with self._lock:  # delivery under the lock keeps sequence order
+            for item in events:
+                self._seq += 1
+                item["seq"] = self._seq
+                self._history.append(item)
+            if self._deliver is not None:
+                self._deliver(events)
+
+    def latest(self) -> int:
+        return self._seq
+
+    def replay(self, after: int) -> list[dict] | None:
+        """Events with seq > after, or None if some of them are no longer kept"""
+        with self._lock:
+            if after > self._seq:
+                return None  # from before a restart
+            if after == self._seq:
+                return []
+            if not self._history or self._history[0]["seq"] > after + 1:
+                return None
+            return [item for item in self._history if item["seq"] > after]
+
+
+class RedisBroker:
+    """Redis stream shared by every worker: one sequence, one history, each worker reads the stream."""
+
+    # Numbers and appends all events of a commit atomically; entry ids are "<seq>-0"
+    _APPEND = """
+        local seq
+        for i = 2, #ARGV do
+            seq = redis.call('INCR', KEYS[1])
+            redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'event', ARGV[i])
+        end
+        return seq
+    """
+
+    def __init__(self, url: str, history: int = CHANGE_FEED_HISTORY):
+        if redis is None:
+            raise RuntimeError("CHANGE_FEED_BROKER=redis://... requires the redis package")
+        self.history = history
+        self._redis = redis.Redis.from_url(url)
+        self._append = self._redis.register_script(self._APPEND)
+        self._outgoing = queue.Queue()
+        self._stopping = threading.Event()
+        self._threads = []
+        self._deliver = None
+
+    def start(self, deliver):
+        self._deliver = deliver
+        self._stopping.clear()
+        self._threads = [
+            threading.Thread(target=self._send, name="change-feed-publisher", daemon=True),
+            threading.Thread(target=self._receive, name="change-feed-reader", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._outgoing.put(None)
+        for thread in self._threads:
+            thread.join(timeout=10)
+        self._threads = []
+        self._deliver = None
+
+    def publish(self, events: list[dict]):
+        # Called from after_commit; the network round trip happens on the publisher thread
+        self._outgoing.put([json.dumps(item, default=str) for item in events])
+
+    def _send(self):
+        while True:
+            events = self._outgoing.get()
+            if events is None:
+                return
+            try:
+                self._append(keys=[REDIS_SEQUENCE, REDIS_STREAM], args=[self.history, *events])
+            except Exception as e:
+                print(f"Change feed publish to Redis failed: {e}")
+
+    def _receive(self):
+        last_id = "$"
+        while not self._stopping.is_set():
+            try:
+                response = self._redis.xread({REDIS_STREAM: last_id}, block=1000, count=1000)
+            except Exception as e:
+                print(f"Change feed read from Redis failed: {e}")
+                self._stopping.wait(1)
+                continue
+            for _, entries in response:
+                if entries:
+                    last_id = entries[-1][0]
+                    if self._deliver is not None:
+                        self._deliver([self._decode(entry) for entry in entries])
+
+    @staticmethod
+    def _decode(entry) -> dict:
+        entry_id, fields = entry
+        item = json.loads(fields[b"event"])
+        item["seq"] = int(entry_id.split(b"-")[0])
+        return item
+
+    def latest(self) -> int:
+        return int(self._redis.get(REDIS_SEQUENCE) or 0)
+
+    def replay(self, after: int) -> list[dict] | None:
+        latest = self.latest()
+        if after > latest:
+            return None
+        if after == latest:
+            return []
+        oldest = self._redis.xrange(REDIS_STREAM, count=1)
+        if not oldest or int(oldest[0][0].split(b"-")[0]) > after + 1:
+            return None
+        return [self._decode(entry) for entry in self._redis.xrange(REDIS_STREAM, min=f"{after + 1}-0")]
+
+
+def make_broker(spec: str = CHANGE_FEED_BROKER):
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(spec)
+    if spec == "local":
+        return LocalBroker()
+    raise ValueError(f"Unknown CHANGE_FEED_BROKER '{spec}' (use 'local' or a redis:// URL)")
+
+
+# ---------- Fan-out ----------
+class Subscription:
+    def __init__(self, types: set[str] | None):
+        self.types = types
+        self.queue = asyncio.Queue(maxsize=CHANGE_FEED_QUEUE)
+        self.overflowed = False
+
+    def offer(self, item: dict):
+        if self.overflowed or (self.types is not None and item["type"] not in self.types):
+            return
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            self.overflowed = True  # the queue is full, so the sender is awake and will notice
+
+
+class ChangeFeed:
+    """Owns the broker and this worker's subscribers."""
+
+    def __init__(self, broker=None):
+        self.broker = broker or make_broker()
+        self._subscribers: set[Subscription] = set()
+        self._loop = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self.broker.start(self._deliver)
+
+    async def stop(self):
+        self.broker.stop()
+        self._loop = None
+
+    def _deliver(self, events: list[dict]):
+        """Broker callback, from any thread"""
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._dispatch, events)
+
+    def _dispatch(self, events: list[dict]):
+        for subscription in list(self._subscribers):
+            for item in events:
+                subscription.offer(item)
+
+    def subscribers(self) -> int:
+        return len(self._subscribers)
+
+    async def events(self, since: int | None = None, types: set[str] | None = None):
+        """Async iterator of events after `since` (live only when None), then live ones.
+
+        Yields None every CHANGE_FEED_HEARTBEAT seconds without events, and a
+        `reset` event when `since` is too old to resume from. Ends when the
+        subscriber falls too far behind.
+        """
+        subscription = Subscription(types)
+        self._subscribers.add(subscription)  # before replaying, so nothing falls in between
+        try:
+            last = since
+            if since is not None:
+                replayed = await asyncio.to_thread(self.broker.replay, since)
+                if replayed is None:
+                    latest = await asyncio.to_thread(self.broker.latest)
+                    yield {"type": "reset", "seq": latest, "at": datetime.now().isoformat()}
+                    last = latest
+                else:
+                    for item in replayed:
+                        if types is None or item["type"] in types:
+                            yield item
+                        last = item["seq"]
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscription.queue.get(), CHANGE_FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                if subscription.overflowed:
+                    return  # the client resumes from its last seq on reconnect
+                if last is not None and item["seq"] <= last:
+                    continue  # already sent from history
+                last = item["seq"]
+                yield item
+        finally:
+            self._subscribers.discard(subscription)
+
+
+feed = ChangeFeed()
@@ -1,6 +1,47 @@
-from sqlalchemy.orm import Session
-from app import models, schemas
+from sqlalchemy import update, insert, select, bindparam, func, tuple_, true, false
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, contains_eager
+from sqlalchemy.orm.attributes import set_committed_value
+from app import models, schemas, catalog_version, change_feed, fast_json, scan_rollups, stock_ledger
 from datetime import datetime, timedelta
+import time
+
+# ---------- Counters ----------
+def increment_counter(db, name: str, by: int = 1) -> int:
+    """Atomically add `by` to a named counter and return the new value.
+
+    Runs in the caller's transaction; `db` can be a Session or a Connection.
+    """
+    counters = models.Counter.__table__
+    stmt = (
+        update(counters)
+        .where(counters.c.name == name)
+        .values(value=counters.c.value + by)
+        .returning(counters.c.value)
+    )
+    value = db.execute(stmt).scalar()
+    if value is None:
+        try:
+            with db.begin_nested():
+                db.execute(insert(counters).values(name=name, value=0))
+        except IntegrityError:
+            pass  # someone else created it first
+        value = db.execute(stmt).scalar()
+    return value
+
+def claim_periodic_run(db, name: str, interval: float) -> bool:
+    """True for exactly one caller per `interval` seconds across workers (compare-and-set on a counter
+    holding the last run's unix time). Commits."""
+    counters = models.Counter.__table__
+    now = int(time.time())
+    increment_counter(db, name, 0)  # make sure the row exists
+    claimed = db.execute(
+        update(counters)
+        .where(counters.c.name == name, counters.c.value <= now - int(interval))
+        .values(value=now)
+    ).rowcount
+    db.commit()
+    return claimed == 1
 
 # ---------- Product CRUD ----------
 def create_product(db: Session, product: schemas.ProductCreate, barcode: str, barcode_file: str):
@@ -18,12 +59,110 @@ def create_product(db: Session, product: schemas.ProductCreate, barcode: str, ba
     db.refresh(db_product)
     return db_product
 
+def bulk_create_products(db: Session, products: list[schemas.ProductCreate], barcodes: list[str], barcode_files: list[str]):
+    """Insert many products with one executemany INSERT and a single commit, with their initial stock movements"""
+    version = catalog_version.next_version(db)
+    rows = [
+        {
+            "name": product.name,
+            "threshold": product.threshold,
+            "quantity": product.quantity,
+            "quantity_to_order": product.quantity_to_order,
+            "classification": product.classification,
+            "barcode": barcode,
+            "barcode_file": barcode_file,
+            "version": version,
+        }
+        for product, barcode, barcode_file in zip(products, barcodes, barcode_files)
+    ]
+    ids = db.execute(
+        insert(models.ProductDB).returning(models.ProductDB.id, sort_by_parameter_order=True), rows
+    ).scalars().all()
+    # Core bypasses the ORM flush hook that records new products' opening stock
+    for product_id, row in zip(ids, rows):
+        if row["quantity"]:
+            stock_ledger.append(db, product_id, row["quantity"], "initial")
+    # One event for the whole chunk; subscribers catch up with GET /products?since=
+    change_feed.stage(db, "products.imported", count=len(rows), version=version)
+    db.commit()
+
 def get_product_by_barcode(db: Session, barcode: str):
     return db.query(models.ProductDB).filter(models.ProductDB.barcode == barcode).first()
 
 def get_products(db: Session):
     return db.query(models.ProductDB).all()
 
+def get_products_changed_since(db: Session, version: int):
+    return db.query(models.ProductDB).filter(models.ProductDB.version > version).all()
+
+def product_rows_query():
+    """SELECT of the ProductOut columns, status included (see fast_json.py)"""
+    p = models.ProductDB
+    return select(
+        p.name, p.threshold, p.id, p.quantity, p.quantity_to_order,
+        p.classification, p.barcode, p.barcode_file, p.status,
+    )
+
+def get_product_rows(db: Session, since: int | None = None) -> list[dict]:
+    """ProductOut-shaped dicts straight from the query"""
+    query = product_rows_query()
+    if since is not None:
+        query = query.where(models.ProductDB.version > since)
+    return fast_json.rows(db.execute(query))
+
+def get_label_products(
+    db: Session,
+    barcodes: list[str] | None = None,
+    classification: str | None = None,
+    status: str | None = None,
+    low_stock: bool = False,
+) -> list[tuple[str, str]]:
+    """(barcode, name) to print labels for: the given barcodes in that order (unknown ones left out),
+    else the products matching the filters in name order"""
+    p = models.ProductDB
+    query = select(p.barcode, p.name)
+    if classification is not None:
+        query = query.where(p.classification == classification)
+    if status is not None:
+        query = query.where(p.status == status)
+    if low_stock:
+        query = query.where(p.quantity <= p.threshold)
+    if barcodes is None:
+        return [tuple(row) for row in db.execute(query.order_by(p.name, p.id))]
+    names = {}
+    for i in range(0, len(barcodes), 500):
+        names.update(db.execute(query.where(p.barcode.in_(barcodes[i:i + 500]))).tuples().all())
+    return [(barcode, names[barcode]) for barcode in barcodes if barcode in names]
+
+def low_stock_query(classification: str | None = None, status: str | None = None):
+    """Products at or below their threshold, most urgent (furthest below) first.
+
+    The WHERE and ORDER BY are the ones of the ix_products_low_stock* partial indexes, so the query
+    reads only those and costs the number of low products, not the catalogue size. For sharded
+    products this goes by products.quantity, which trails the shards (see stock_ledger.py).
+    """
+    p = models.ProductDB
+    query = product_rows_query().where(p.quantity <= p.threshold)
+    if classification is not None:
+        query = query.where(p.classification == classification)
+    if status is not None:
+        query = query.where(p.status == status)
+    return query.order_by(p.quantity - p.threshold, p.id)
+
+def get_low_stock_rows(
+    db: Session, classification: str | None = None, status: str | None = None, limit: int = 100, offset: int = 0,
+) -> list[dict]:
+    """ProductOut-shaped dicts of the low-stock set (see low_stock_query)"""
+    query = low_stock_query(classification, status).limit(limit).offset(offset)
+    return fast_json.rows(db.execute(query))
+
+def count_low_stock(db: Session, classification: str | None = None, status: str | None = None) -> int:
+    query = low_stock_query(classification, status).order_by(None)
+    return db.execute(select(func.count()).select_from(query.subquery())).scalar()
+
+def get_tombstones_since(db: Session, version: int):
+    return db.query(models.ProductTombstone).filter(models.ProductTombstone.version > version).all()
+
 def update_product_quantity(db: Session, barcode: str, change: int):
     product = get_product_by_barcode(db, barcode)
     if product:
@@ -34,6 +173,93 @@ def update_product_quantity(db: Session, barcode: str, change: int):
         db.refresh(product)
     return product
 
+def decrement_product_quantity(db: Session, barcode: str, decrement_by: int):
+    """Subtract stock in a single conditional UPDATE so concurrent scans can't lose updates
+    (from one of its stock shards if the product is sharded, see stock_ledger.py).
+
+    Returns the updated product, or None if the barcode is unknown or there isn't
+    enough stock left. Does not commit.
+    """
+    products = models.ProductDB.__table__
+    found = db.execute(select(products.c.id, products.c.stock_shards).where(products.c.barcode == barcode)).first()
+    if found is None:
+        return None
+    if found.stock_shards:
+        # Not through the product row: it would also bump the catalog version counter for every scan
+        product = stock_ledger.take(db, found.id, found.stock_shards, decrement_by)
+    else:
+        stmt = (
+            update(models.ProductDB)
+            .where(
+                models.ProductDB.id == found.id,
+                models.ProductDB.quantity >= decrement_by,
+                models.ProductDB.stock_shards == 0,
+            )
+            .values(
+                quantity=models.ProductDB.quantity - decrement_by,
+                version=catalog_version.next_version(db),
+            )
+            .returning(models.ProductDB)
+        )
+        product = db.execute(stmt).scalars().first()
+        if product is not None:
+            stock_ledger.append(db, product.id, -decrement_by, "scan")
+    if product is not None:
+        change_feed.stage(db, "scan", **change_feed.product_fields(product), decremented_by=decrement_by)
+    return product
+
+def record_threshold_edges(db: Session, product_ids) -> int:
+    """Queue an outbox alert for products that just crossed down to their threshold.
+
+    Edge-triggered: a product fires once, then stays disarmed until its stock is
+    back above the threshold. Runs in the caller's transaction (flush ORM
+    changes first) and returns the number of alerts queued.
+    """
+    ids = list(product_ids)
+    if not ids:
+        return 0
+    products = models.ProductDB.__table__
+    fired = db.execute(
+        update(products)
+        .where(
+            products.c.id.in_(ids),
+            products.c.alert_armed == true(),
+            products.c.quantity <= products.c.threshold,
+        )
+        .values(alert_armed=False)
+        .returning(
+            products.c.id, products.c.name, products.c.quantity, products.c.threshold,
+            products.c.quantity_to_order, products.c.barcode,
+        )
+    ).all()
+    db.execute(
+        update(products)
+        .where(
+            products.c.id.in_(ids),
+            products.c.alert_armed == false(),
+            products.c.quantity > products.c.threshold,
+        )
+        .values(alert_armed=True)
+    )
+    if fired:
+        db.execute(insert(models.AlertOutbox), [
+            {
+                "product_id": row.id,
+                "product_name": row.name,
+                "quantity": row.quantity,
+                "threshold": row.threshold,
+                "quantity_to_order": row.quantity_to_order,
+            }
+            for row in fired
+        ])
+        db.info["alerts_queued"] = True  # alert_dispatcher wakes up after commit
+        for row in fired:
+            change_feed.stage(
+                db, "threshold_crossed", product_id=row.id, barcode=row.barcode, name=row.name,
+                quantity=row.quantity, threshold=row.threshold, quantity_to_order=row.quantity_to_order,
+            )
+    return len(fired)
+
 # ---------- Email Settings CRUD ----------
 def add_email(db: Session, email: schemas.EmailSettingsCreate):
     db_email = models.EmailSettingsDB(email=email.email)
@@ -66,12 +292,200 @@ def create_scan_log(db: Session, scan_log: schemas.ScanLogCreate):
     db.refresh(db_log)
     return db_log
 
-def get_scan_logs(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.ScanLog).offset(skip).limit(limit).all()
+def scan_product_with_log(db: Session, barcode: str, scan: schemas.ScanSubmit):
+    """Decrement stock and write the scan log in one transaction. Returns the log or None."""
+    product = decrement_product_quantity(db, barcode, scan.decrement_by)
+    if not product:
+        db.rollback()
+        return None
+
+    record_threshold_edges(db, [product.id])
+    db_log = models.ScanLog(
+        product_id=product.id,
+        purpose=scan.purpose,
+        scanned_by=scan.scanned_by,
+        quantity=product.quantity,  # remaining quantity after this scan
+        threshold=product.threshold,
+        decremented_by=scan.decrement_by,
+        classification=product.classification,
+        scanned_at=datetime.now(),
+    )
+    db.add(db_log)
+    scan_rollups.record(db, [db_log])
+    db.commit()
+    db.refresh(db_log)
+    if product.stock_shards:
+        # products.quantity trails the shards; the log has the exact remaining quantity
+        set_committed_value(db_log.product, "quantity", db_log.quantity)
+    return db_log
+
+def apply_scan_batch(db: Session, scans: list[schemas.ScanBatchItem]):
+    """Apply a queue of offline scans with one lookup, one bulk UPDATE and one bulk INSERT.
+
+    Scans are applied in submission order against a running per-product quantity,
+    so a scan that would take stock below zero is rejected without affecting the
+    rest of the batch. Returns (results, touched products) or None if stock moved
+    underneath us and the batch was rolled back.
+    """
+    barcodes = {scan.barcode for scan in scans}
+    products = (
+        db.query(models.ProductDB)
+        .filter(models.ProductDB.barcode.in_(barcodes))
+        .order_by(models.ProductDB.id)  # stable lock order
+        .with_for_update()
+        .all()
+    )
+    by_barcode = {p.barcode: p for p in products}
+    # Sharded products: lock their shards too and start from the exact total
+    locked_shards = {p.id: stock_ledger.lock_shards(db, p.id) for p in products if p.stock_shards}
+    remaining = {
+        p.id: sum(q for _, q in locked_shards[p.id]) if p.stock_shards else p.quantity
+        for p in products
+    }
+    totals = {}
+
+    results = []
+    log_rows = []
+    for index, scan in enumerate(scans):
+        result = schemas.ScanBatchResult(index=index, barcode=scan.barcode, status="ok")
+        results.append(result)
+        product = by_barcode.get(scan.barcode)
+        if scan.decrement_by <= 0:
+            result.status = "invalid"
+            result.detail = "Decrement must be greater than 0"
+            continue
+        if not product:
+            result.status = "not_found"
+            result.detail = "Product not found"
+            continue
+        if scan.decrement_by > remaining[product.id]:
+            result.status = "insufficient_stock"
+            result.detail = f"Cannot subtract {scan.decrement_by}. Only {remaining[product.id]} left."
+            result.quantity = remaining[product.id]
+            continue
+
+        remaining[product.id] -= scan.decrement_by
+        totals[product.id] = totals.get(product.id, 0) + scan.decrement_by
+        result.quantity = remaining[product.id]
+        log_rows.append({
+            "product_id": product.id,
+            "purpose": scan.purpose,
+            "scanned_by": scan.scanned_by,
+            "scanned_at": scan.client_timestamp or datetime.now(),
+            "quantity": remaining[product.id],
+            "threshold": product.threshold,
+            "decremented_by": scan.decrement_by,
+            "classification": product.classification,
+        })
+
+    if totals:
+        for product_id, shards in locked_shards.items():
+            if product_id in totals and stock_ledger.take_across(db, product_id, totals[product_id], shards) is None:
+                db.rollback()
+                return None
+        row_totals = {pid: total for pid, total in totals.items() if pid not in locked_shards}
+        if row_totals:
+            products_table = models.ProductDB.__table__
+            stmt = (
+                update(products_table)
+                .where(
+                    products_table.c.id == bindparam("b_id"),
+                    products_table.c.quantity >= bindparam("b_total"),
+                )
+                .values(
+                    quantity=products_table.c.quantity - bindparam("b_total"),
+                    version=catalog_version.next_version(db),
+                )
+            )
+            updated = db.execute(stmt, [{"b_id": pid, "b_total": total} for pid, total in row_totals.items()])
+            # Rows are locked FOR UPDATE where the backend supports it; this catches
+            # a concurrent writer on backends that don't (e.g. SQLite)
+            sane_rowcount = db.get_bind().dialect.supports_sane_multi_rowcount
+            if sane_rowcount and updated.rowcount != len(row_totals):
+                db.rollback()
+                return None
+
+        db.execute(insert(models.StockMovement), [
+            {"product_id": row["product_id"], "delta": -row["decremented_by"], "reason": "scan"} for row in log_rows
+        ])
+        log_ids = db.scalars(
+            insert(models.ScanLog).returning(models.ScanLog.id, sort_by_parameter_order=True),
+            log_rows,
+        ).all()
+        ok_results = [r for r in results if r.status == "ok"]
+        for result, log_id, row in zip(ok_results, log_ids, log_rows):
+            result.scan_log_id = log_id
+            product = by_barcode[result.barcode]
+            fields = {**change_feed.product_fields(product), "quantity": row["quantity"]}  # after this scan
+            change_feed.stage(db, "scan", **fields, decremented_by=row["decremented_by"])
+            change_feed.stage(db, "scan_log.created", **change_feed.scan_log_fields({**row, "id": log_id}))
+
+        scan_rollups.record(db, log_rows)
+        # Threshold alerts once per product for the whole batch
+        record_threshold_edges(db, totals.keys())
+
+    db.commit()
+
+    # One SELECT to reload the final state of every product we touched
+    touched = []
+    if totals:
+        touched = db.query(models.ProductDB).filter(models.ProductDB.id.in_(totals.keys())).all()
+    return results, touched
+
+def get_scan_logs(
+    db: Session,
+    limit: int = 100,
+    after: tuple[datetime, int] | None = None,
+    descending: bool = False,
+    product_id: int | None = None,
+    barcode: str | None = None,
+    classification: str | None = None,
+    scanned_by: str | None = None,
+    purpose: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+):
+    """Keyset-paginated scan logs ordered by (scanned_at, id), products loaded in the same query.
+
+    `after` is the (scanned_at, id) of the last row of the previous page.
+    """
+    log = models.ScanLog
+    query = db.query(log)
+    if barcode is not None:
+        query = (
+            query.join(log.product)
+            .filter(models.ProductDB.barcode == barcode)
+            .options(contains_eager(log.product))
+        )
+    else:
+        query = query.options(joinedload(log.product))
+
+    if product_id is not None:
+        query = query.filter(log.product_id == product_id)
+    if classification is not None:
+        query = query.filter(log.classification == classification)
+    if scanned_by is not None:
+        query = query.filter(log.scanned_by == scanned_by)
+    if purpose is not None:
+        query = query.filter(log.purpose == purpose)
+    if date_from is not None:
+        query = query.filter(log.scanned_at >= date_from)
+    if date_to is not None:
+        query = query.filter(log.scanned_at < date_to)
+
+    key = tuple_(log.scanned_at, log.id)
+    if after is not None:
+        query = query.filter(key < tuple_(*after) if descending else key > tuple_(*after))
+    if descending:
+        query = query.order_by(log.scanned_at.desc(), log.id.desc())
+    else:
+        query = query.order_by(log.scanned_at, log.id)
+    return query.limit(limit).all()
 
 def delete_scan_log(db: Session, scan_log_id: int):
     scan_log = db.query(models.ScanLog).filter(models.ScanLog.id == scan_log_id).first()
     if scan_log:
         db.delete(scan_log)
+        scan_rollups.record(db, [scan_log], sign=-1)
         db.commit()
     return scan_log
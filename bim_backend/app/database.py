@@ -1,25 +1,248 @@
 """
     Database connection and session management
+
+    Read replicas (READ_REPLICA_URLS, comma-separated): sessions of GET/HEAD
+    requests send their SELECTs to a replica, round robin per session.
+    Anything else they run (writes, flushes, SELECT ... FOR UPDATE, raw SQL)
+    goes to the primary, and so does every statement after it, so a session
+    always sees its own writes. A client that wrote gets a cookie that keeps
+    its reads on the primary for READ_YOUR_WRITES_SECONDS, to cover replication
+    lag. A replica that can't be reached, or drops a connection, is skipped for
+    REPLICA_RETRY_SECONDS and its sessions read from the primary instead.
 """
-from sqlalchemy import create_engine
+from sqlalchemy import CompoundSelect, Select, create_engine, event, inspect, make_url, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateColumn, CreateIndex
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
+from fastapi import Request
 from dotenv import load_dotenv
+from contextlib import contextmanager
+import itertools
 import os
+import threading
+import time
+
+from app import metrics
 
 # Load .env file
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# Async request path (AsyncSession + aiosqlite/asyncpg, aiosmtplib for alerts)
+ASYNC_MODE = os.getenv("ASYNC_MODE", "false").lower() == "true"
+
+READ_REPLICA_URLS = [url.strip() for url in os.getenv("READ_REPLICA_URLS", "").split(",") if url.strip()]
+ASYNC_READ_REPLICA_URLS = [url.strip() for url in os.getenv("ASYNC_READ_REPLICA_URLS", "").split(",") if url.strip()]
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", 5))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", 30))
+READ_PRIMARY_COOKIE = "bim_read_primary_until"
+READ_METHODS = ("GET", "HEAD")
+
+# Async driver for each sync URL scheme
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def async_url(url: str) -> str:
+    scheme, sep, rest = url.partition("://")
+    return ASYNC_DRIVERS.get(scheme, scheme) + sep + rest
+
+
+class AppSession(Session):
+    """Session class shared by sync and async sessions, so session event hooks apply to both.
+
+    Sessions with info["replicas"] (a ReplicaRouter) read from a replica until they write.
+    """
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        router = self.info.get("replicas")
+        if router is None or self.info.get("wrote") or self.info.get("primary") or clause is None:
+            return super().get_bind(mapper, clause=clause, **kw)
+        if self._flushing or not _is_read(clause):
+            self.info["wrote"] = True  # from here on everything reads from the primary
+            return super().get_bind(mapper, clause=clause, **kw)
+        if "replica" not in self.info:
+            self.info["replica"] = router.connect(self)
+        return self.info["replica"] or super().get_bind(mapper, clause=clause, **kw)
+
+
+def _is_read(clause) -> bool:
+    if isinstance(clause, Select):
+        return clause._for_update_arg is None
+    return isinstance(clause, CompoundSelect)
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+class ReplicaRouter:
+    """Round robin over the read replica engines, skipping the ones that failed recently"""
+
+    def __init__(self, engines: dict, retry_after: float = REPLICA_RETRY_SECONDS):
+        self.engines = engines  # name -> engine (sync engines, for async ones their .sync_engine)
+        self.retry_after = retry_after
+        self._names = list(engines)
+        self._turn = itertools.count()
+        self._down = {}  # name -> monotonic time to try it again
+        self._lock = threading.Lock()
+        for name, replica in engines.items():
+            event.listen(replica, "handle_error", self._on_error(name))
+
+    def _on_error(self, name):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError):
+                self.mark_down(name, context.original_exception)
+        return handle_error
+
+    def mark_down(self, name: str, error):
+        with self._lock:
+            already = self._down.get(name, 0) > time.monotonic()
+            self._down[name] = time.monotonic() + self.retry_after
+        metrics.count_replica_fallback(name)
+        if not already:
+            print(f"Read replica {name} failed ({error}), reading from the primary for {self.retry_after:g}s")
+
+    def healthy(self) -> list[str]:
+        """Replica names in this turn's order, without the ones marked down"""
+        start = next(self._turn)
+        now = time.monotonic()
+        names = self._names[start % len(self._names):] + self._names[:start % len(self._names)]
+        return [name for name in names if self._down.get(name, 0) <= now]
+
+    def connect(self, session: Session):
+        """Open `session`'s connection on the next healthy replica and return its engine, or None for the primary"""
+        for name in self.healthy():
+            try:
+                session.connection(bind_arguments={"bind": self.engines[name]})
+            except DBAPIError as e:
+                self.mark_down(name, e.orig)
+                continue
+            return self.engines[name]
+        return None
+
+
+def _pool_options(url: str) -> dict:
+    """Swap in the checkout-timing pool wherever the dialect would use a QueuePool anyway"""
+    url = make_url(url)
+    if url.get_dialect().get_pool_class(url) is QueuePool:
+        return {"poolclass": metrics.TimedQueuePool}
+    return {}
+
+
+engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL))
+metrics.instrument_engine(engine)
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=AppSession)
 Base = declarative_base()
 
+replica_engines = {}
+for i, url in enumerate(READ_REPLICA_URLS):
+    replica_engines[f"replica{i}"] = create_engine(url, **_pool_options(url))
+    metrics.instrument_engine(replica_engines[f"replica{i}"], f"replica{i}")
+replicas = ReplicaRouter(replica_engines) if replica_engines else None
+
+async_engine = None
+AsyncSessionLocal = None
+async_replicas = None
+if ASYNC_MODE:
+    from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+    async_engine = create_async_engine(os.getenv("ASYNC_DATABASE_URL") or async_url(DATABASE_URL))
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine,
+        autoflush=False,
+        expire_on_commit=False,  # no lazy loads after commit outside the greenlet
+        sync_session_class=AppSession,
+    )
+    metrics.instrument_engine(async_engine.sync_engine, "async")
+
+    async_replica_engines = {}
+    for i, url in enumerate(ASYNC_READ_REPLICA_URLS or [async_url(url) for url in READ_REPLICA_URLS]):
+        async_replica_engines[f"async_replica{i}"] = create_async_engine(url).sync_engine
+        metrics.instrument_engine(async_replica_engines[f"async_replica{i}"], f"async_replica{i}")
+    async_replicas = ReplicaRouter(async_replica_engines) if async_replica_engines else None
+
+
+def reads_from_replica(request: Request) -> bool:
+    """GET/HEAD requests, unless the client wrote within READ_YOUR_WRITES_SECONDS"""
+    if request.method not in READ_METHODS:
+        return False
+    try:
+        return float(request.cookies.get(READ_PRIMARY_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+
+def on_replica(db) -> bool:
+    """Whether `db`'s reads currently go to a read replica"""
+    return "replicas" in db.info and not db.info.get("wrote") and not db.info.get("primary")
+
+
+@contextmanager
+def use_primary(db):
+    """Read from the primary inside the block, e.g. to fill a cache shared with sessions that just wrote"""
+    previous = db.info.get("primary")
+    db.info["primary"] = True
+    try:
+        yield db
+    finally:
+        db.info["primary"] = previous
+
+
+def read_session() -> Session:
+    """Session for read-only work outside a request (exports): reads from a replica if there is one"""
+    db = SessionLocal()
+    if replicas is not None:
+        db.info["replicas"] = replicas
+    return db
+
+
 # Dependency for getting DB session in endpoints
-def get_db():
+def get_db(request: Request):
     db = SessionLocal()
+    if replicas is not None and reads_from_replica(request):
+        db.info["replicas"] = replicas
     try:
         yield db
     finally:
         db.close()
+
+# Async counterpart of get_db (ASYNC_MODE only)
+async def get_async_db(request: Request):
+    async with AsyncSessionLocal() as db:
+        if async_replicas is not None and reads_from_replica(request):
+            db.sync_session.info["replicas"] = async_replicas
+        yield db
+
+
+async def read_your_writes_middleware(request, call_next):
+    """After a successful write, keep the client's reads on the primary for READ_YOUR_WRITES_SECONDS"""
+    response = await call_next(request)
+    replicated = replicas is not None or async_replicas is not None  # ASYNC_MODE may have only async replicas
+    if replicated and request.method not in READ_METHODS and response.status_code < 400:
+        response.set_cookie(
+            READ_PRIMARY_COOKIE,
+            f"{time.time() + READ_YOUR_WRITES_SECONDS:.3f}",
+            max_age=max(int(READ_YOUR_WRITES_SECONDS), 1),
+            httponly=True,
+            samesite="lax",
+        )
+    return response
+
+
+def upgrade_schema():
+    """create_all only creates missing tables; add columns and indexes introduced since"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+        # IF NOT EXISTS rather than checkfirst: reflection doesn't report expression indexes on SQLite
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
@@ -1,4 +1,7 @@
+import asyncio
 import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
 from sqlalchemy.orm import Session
 from app.models import EmailSettingsDB
@@ -8,6 +11,9 @@ SMTP_SERVER = os.getenv("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", 587))
 SMTP_USER = os.getenv("SMTP_USER")  # sender
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")  # sender's app password
+SMTP_FROM = os.getenv("SMTP_FROM", SMTP_USER)
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() != "false"  # off for a local aiosmtpd
+SMTP_IDLE_TIMEOUT = float(os.getenv("SMTP_IDLE_TIMEOUT", 60))  # reconnect after this many idle seconds
 
 
 def get_admin_emails(db: Session) -> list[str]:
@@ -15,28 +21,143 @@ def get_admin_emails(db: Session) -> list[str]:
     return [row.email for row in db.query(EmailSettingsDB).all()]
 
 
-def send_threshold_email(recipients: list[str] | str, product_name: str, qty: int, threshold: int, qty_to_order: int):
-    """Send a professional stock threshold alert email to one or more recipients."""
-    # Ensure recipients is always a list
-    if isinstance(recipients, str):
-        recipients = [recipients]
+class SMTPConnection:
+    """A single long-lived SMTP session (STARTTLS + login once, if the server offers AUTH), reopened when it drops or idles."""
 
-    if not recipients:
-        return
+    def __init__(self):
+        self._server = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+
+    def _open(self):
+        server = smtplib.SMTP(SMTP_SERVER, SMTP_PORT, timeout=30)
+        if SMTP_STARTTLS:
+            server.starttls()
+        server.ehlo_or_helo_if_needed()
+        # Only where AUTH is offered: a local relay (aiosmtpd) has none and refuses login()
+        if SMTP_USER and SMTP_PASSWORD and server.has_extn("auth"):
+            server.login(SMTP_USER, SMTP_PASSWORD)
+        return server
+
+    def send(self, msg: MIMEText, recipients: list[str]):
+        with self._lock:
+            for attempt in range(2):
+                if self._server is None or time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+                    self._close()
+                    self._server = self._open()
+                try:
+                    self._server.sendmail(SMTP_FROM, recipients, msg.as_string())
+                    self._last_used = time.monotonic()
+                    return
+                except smtplib.SMTPServerDisconnected:
+                    self._close()
+                    if attempt:
+                        raise
+
+    def _close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._server = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+
+smtp_connection = SMTPConnection()
+
+
+class AsyncSMTPConnection:
+    """aiosmtplib counterpart of SMTPConnection, used by the alert dispatcher in ASYNC_MODE.
+    The lock and the session belong to the event loop that created them; on another loop they start over."""
+
+    def __init__(self):
+        self._client = None
+        self._last_used = 0.0
+        self._lock = None
+        self._loop = None
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A session opened on a previous (closed) loop can't be used or quit from this one
+            self._loop, self._lock, self._client = loop, asyncio.Lock(), None
+
+    async def _open(self):
+        import aiosmtplib
+
+        client = aiosmtplib.SMTP(hostname=SMTP_SERVER, port=SMTP_PORT, start_tls=SMTP_STARTTLS, timeout=30)
+        await client.connect()
+        if client.is_ehlo_or_helo_needed:
+            await client.ehlo()
+        if SMTP_USER and SMTP_PASSWORD and client.supports_extension("auth"):
+            await client.login(SMTP_USER, SMTP_PASSWORD)
+        return client
 
-    subject = f"⚠️ Restock Alert: {product_name}"
+    async def send(self, msg: MIMEText, recipients: list[str]):
+        import aiosmtplib
+
+        self._bind_loop()
+        async with self._lock:
+            for attempt in range(2):
+                if self._client is None or time.monotonic() - self._last_used > SMTP_IDLE_TIMEOUT:
+                    await self._close()
+                    self._client = await self._open()
+                try:
+                    await self._client.sendmail(SMTP_FROM, recipients, msg.as_string())
+                    self._last_used = time.monotonic()
+                    return
+                except aiosmtplib.SMTPServerDisconnected:
+                    await self._close()
+                    if attempt:
+                        raise
+
+    async def _close(self):
+        if self._client is not None:
+            try:
+                await self._client.quit()
+            except Exception:
+                pass
+            self._client = None
+
+    async def close(self):
+        self._bind_loop()
+        async with self._lock:
+            await self._close()
+
+
+async_smtp_connection = AsyncSMTPConnection()
+
+
+def build_threshold_email(recipients: list[str], alerts: list[dict]) -> MIMEText:
+    """One message for all recipients; several alerts become a digest."""
+    if len(alerts) == 1:
+        alert = alerts[0]
+        subject = f"⚠️ Restock Alert: {alert['product_name']}"
+        intro = "The stock level has reached or fallen below the defined threshold."
+    else:
+        subject = f"⚠️ Restock Alert: {len(alerts)} products"
+        intro = "The stock levels of the following products have reached or fallen below their thresholds."
+
+    details = "\n".join(
+        f"""Product: {alert['product_name']}
+Current Quantity: {alert['quantity']}
+Threshold: {alert['threshold']}
+Quantity to Order: {alert['quantity_to_order']}
+"""
+        for alert in alerts
+    )
     body = f"""
 Dear Inventory Manager,
 
 This is an automated notification regarding your product inventory.
 
-Product: {product_name}
-Current Quantity: {qty}
-Threshold: {threshold}
-Quantity to Order: {qty_to_order}
-
-The stock level has reached or fallen below the defined threshold. 
-Please take the necessary steps to restock this item promptly to avoid shortages.
+{details}
+{intro}
+Please take the necessary steps to restock promptly to avoid shortages.
 
 Best regards,
 Inventory Management System
@@ -44,10 +165,19 @@ Inventory Management System
 
     msg = MIMEText(body, "plain")
     msg["Subject"] = subject
-    msg["From"] = SMTP_USER
+    msg["From"] = SMTP_FROM
     msg["To"] = ", ".join(recipients)  # display all recipients properly
+    return msg
+
+
+def send_threshold_email(recipients: list[str] | str, product_name: str, qty: int, threshold: int, qty_to_order: int):
+    """Send a professional stock threshold alert email to one or more recipients."""
+    # Ensure recipients is always a list
+    if isinstance(recipients, str):
+        recipients = [recipients]
+
+    if not recipients:
+        return
 
-    with smtplib.SMTP(SMTP_SERVER, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.sendmail(SMTP_USER, recipients, msg.as_string())
+    alert = {"product_name": product_name, "quantity": qty, "threshold": threshold, "quantity_to_order": qty_to_order}
+    smtp_connection.send(build_threshold_email(recipients, [alert]), recipients)
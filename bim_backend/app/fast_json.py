@@ -0,0 +1,98 @@
+"""
+    JSON for the list endpoints without pydantic models in between.
+
+    GET /products builds plain dicts straight from the query rows (status is
+    computed in SQL, see ProductDB.status) and the scan log pages turn ORM
+    rows into dicts. Both are encoded with orjson or msgspec when one of them
+    is installed, else with the json module. The output matches what
+    ProductOut / ScanLogOut would produce.
+"""
+import json
+from datetime import date, datetime
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # optional dependency
+    msgspec = None
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    dumps = msgspec.json.Encoder().encode
+else:
+    BACKEND = "json"
+
+    def dumps(value) -> bytes:
+        # Same settings as fastapi.responses.JSONResponse
+        return json.dumps(value, default=_default, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(Response):
+    """JSONResponse for dicts/lists of plain values; bytes are sent as they are"""
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return content if isinstance(content, bytes) else dumps(content)
+
+
+# ---------- Rows ----------
+def rows(result) -> list[dict]:
+    """Rows of a Core/ORM result as dicts keyed by column label"""
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
+
+
+def product_dict(product) -> dict:
+    return {
+        "name": product.name,
+        "threshold": product.threshold,
+        "id": product.id,
+        "quantity": product.quantity,
+        "quantity_to_order": product.quantity_to_order,
+        "classification": product.classification,
+        "barcode": product.barcode,
+        "barcode_file": product.barcode_file,
+        "status": product.status,
+    }
+
+
+def scan_log_dicts(logs) -> list[dict]:
+    """ScanLogOut-shaped dicts for ORM scan logs or archived ones (scan_log_archive.get_scan_logs)"""
+    products = {}  # a page usually repeats a handful of products
+    out = []
+    for log in logs:
+        product = log.product
+        nested = products.get(id(product))
+        if nested is None:
+            nested = products[id(product)] = product_dict(product)
+        out.append({
+            "purpose": log.purpose,
+            "scanned_by": log.scanned_by,
+            "product_id": log.product_id,
+            "quantity": log.quantity,
+            "threshold": log.threshold,
+            "classification": log.classification,
+            "decremented_by": log.decremented_by,
+            "id": log.id,
+            "scanned_at": log.scanned_at,
+            "product": nested,
+        })
+    return out
@@ -0,0 +1,221 @@
+"""
+    Stock-out forecasting and reorder suggestions, computed for all products at once.
+
+    Daily consumption for the last FORECAST_WINDOW_DAYS comes out of the daily
+    rollups (scan_rollups.py, the per-day sums of scan_logs) in one query and
+    is scattered into a products x days NumPy matrix. Everything after that
+    is whole-array math:
+
+      rate       recency-weighted daily usage (exponential weights, FORECAST_HALF_LIFE days)
+      std        day-to-day variability since the product's first scan in the window
+      days left  quantity / rate
+      threshold  rate * lead time + z * std * sqrt(lead time)  (reorder point with safety stock)
+      to order   rate * FORECAST_COVER_DAYS
+
+    Results are written to product_forecasts in one bulk INSERT. A background
+    thread recomputes them every FORECAST_INTERVAL seconds. The last run time
+    is kept in the counters table, so only one worker runs each interval.
+    Needs numpy.
+"""
+import math
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import Integer, cast, delete, func, insert, select
+
+from app import crud, models
+from app.database import SessionLocal
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+FORECAST_WINDOW_DAYS = int(os.getenv("FORECAST_WINDOW_DAYS", 90))
+FORECAST_HALF_LIFE = float(os.getenv("FORECAST_HALF_LIFE", 14))  # days
+FORECAST_LEAD_TIME_DAYS = float(os.getenv("FORECAST_LEAD_TIME_DAYS", 7))
+FORECAST_COVER_DAYS = float(os.getenv("FORECAST_COVER_DAYS", 30))
+FORECAST_SERVICE_Z = float(os.getenv("FORECAST_SERVICE_Z", 1.65))  # ~95% cycle service level
+FORECAST_INTERVAL = float(os.getenv("FORECAST_INTERVAL", 6 * 3600))  # seconds, 0 = no scheduled job
+FORECAST_CHECK_INTERVAL = 60.0
+FORECAST_COUNTER = "forecast:last_run"
+FORECAST_INSERT_CHUNK = 10000
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _day_offset(db, day_column, first_day: date):
+    """Days since first_day as a SQL expression, so no date object is built per row (None if unsupported)"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return cast(func.julianday(day_column) - func.julianday(first_day.isoformat()), Integer)
+    if dialect == "postgresql":
+        return day_column - first_day  # date - date is an integer
+    return None
+
+
+def load_usage(db, window_days: int = FORECAST_WINDOW_DAYS, today: date | None = None):
+    """(product ids, quantities, usage matrix [products x days], first day) for every product"""
+    today = today or date.today()
+    first_day = today - timedelta(days=window_days - 1)
+
+    products = db.execute(
+        select(models.ProductDB.id, models.ProductDB.quantity).order_by(models.ProductDB.id)
+    ).all()
+    ids = np.fromiter((row[0] for row in products), dtype=np.int64, count=len(products))
+    quantities = np.fromiter((row[1] or 0 for row in products), dtype=np.float64, count=len(products))
+
+    rollups = models.ScanDailyRollup
+    offset = _day_offset(db, rollups.day, first_day)
+    rows = db.execute(
+        select(rollups.product_id, rollups.day if offset is None else offset, rollups.units).where(rollups.day >= first_day)
+    ).all()
+    product_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    if offset is None:
+        offsets = np.fromiter(((row[1] - first_day).days for row in rows), dtype=np.int64, count=len(rows))
+    else:
+        offsets = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    units = np.fromiter((row[2] for row in rows), dtype=np.float64, count=len(rows))
+
+    # Scatter into the matrix; several classifications of one product-day simply add up
+    rows_index = np.searchsorted(ids, product_ids)
+    valid = (rows_index < len(ids)) & (offsets >= 0) & (offsets < window_days)
+    valid[valid] &= ids[rows_index[valid]] == product_ids[valid]  # drop rollups of deleted products
+    flat = rows_index[valid] * window_days + offsets[valid]
+    usage = np.bincount(flat, weights=units[valid], minlength=len(ids) * window_days).reshape(len(ids), window_days)
+    return ids, quantities, usage, first_day
+
+
+def compute(
+    quantities,
+    usage,
+    half_life: float = FORECAST_HALF_LIFE,
+    lead_time: float = FORECAST_LEAD_TIME_DAYS,
+    cover_days: float = FORECAST_COVER_DAYS,
+    z: float = FORECAST_SERVICE_Z,
+) -> dict:
+    """Vectorized forecast for every row of `usage` (one row per product, one column per day, oldest first)"""
+    n_products, n_days = usage.shape
+    if n_products == 0:
+        empty = np.zeros(0)
+        return {"rate": empty, "std": empty, "days_left": empty, "threshold": empty, "to_order": empty}
+
+    # Only count days since the product's first scan in the window, so new products aren't diluted
+    scanned = usage > 0
+    first = np.where(scanned.any(axis=1), scanned.argmax(axis=1), n_days)
+    active_days = n_days - first
+    day_index = np.arange(n_days)
+    active = day_index[None, :] >= first[:, None]
+
+    weights = np.where(active, 0.5 ** ((n_days - 1 - day_index)[None, :] / half_life), 0.0)
+    weight_sums = weights.sum(axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rate = np.where(weight_sums > 0, (usage * weights).sum(axis=1) / weight_sums, 0.0)
+        mean = np.where(active_days > 0, usage.sum(axis=1) / active_days, 0.0)
+        squares = np.where(active, (usage - mean[:, None]) ** 2, 0.0).sum(axis=1)
+        std = np.where(active_days > 1, np.sqrt(squares / (active_days - 1)), 0.0)
+        days_left = np.where(rate > 0, quantities / rate, np.inf)
+
+    threshold = np.ceil(rate * lead_time + z * std * math.sqrt(lead_time))
+    to_order = np.ceil(rate * cover_days)
+    return {"rate": rate, "std": std, "days_left": days_left, "threshold": threshold, "to_order": to_order}
+
+
+def _masked(values, mask) -> list:
+    """values as a Python list, None where mask is False"""
+    return [value if ok else None for value, ok in zip(values.tolist(), mask.tolist())]
+
+
+def run(window_days: int = FORECAST_WINDOW_DAYS) -> dict:
+    """Recompute and store forecasts for every product; returns a summary"""
+    started = time.perf_counter()
+    db = SessionLocal()
+    try:
+        ids, quantities, usage, _ = load_usage(db, window_days)
+        loaded = time.perf_counter()
+        result = compute(quantities, usage)
+        computed = time.perf_counter()
+
+        now = datetime.now()
+        has_usage = result["rate"] > 0
+        finite = np.isfinite(result["days_left"]) & (result["days_left"] < 36500)
+        stockout = now.date().toordinal() + np.floor(np.where(finite, result["days_left"], 0)).astype(np.int64)
+        # Column-wise conversion to plain Python values for the DB driver
+        columns = {
+            "product_id": ids.tolist(),
+            "daily_rate": np.round(result["rate"], 4).tolist(),
+            "daily_std": np.round(result["std"], 4).tolist(),
+            "days_until_stockout": _masked(np.round(result["days_left"], 2), finite),
+            "stockout_date": [date.fromordinal(day) if ok else None for day, ok in zip(stockout.tolist(), finite.tolist())],
+            "suggested_threshold": _masked(result["threshold"].astype(np.int64), has_usage),
+            "suggested_quantity_to_order": _masked(result["to_order"].astype(np.int64), has_usage),
+        }
+        rows = [
+            dict(zip(columns, values), computed_at=now, window_days=window_days)
+            for values in zip(*columns.values())
+        ]
+
+        db.execute(delete(models.ProductForecast))
+        for offset in range(0, len(rows), FORECAST_INSERT_CHUNK):
+            db.execute(insert(models.ProductForecast), rows[offset:offset + FORECAST_INSERT_CHUNK])
+        db.commit()
+        finished = time.perf_counter()
+    finally:
+        db.close()
+
+    return {
+        "products": len(ids),
+        "with_usage": int(has_usage.sum()),
+        "window_days": window_days,
+        "computed_at": now,
+        "load_s": round(loaded - started, 3),
+        "compute_s": round(computed - loaded, 3),
+        "store_s": round(finished - computed, 3),
+    }
+
+
+def _claim_run(interval: float) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.claim_periodic_run(db, FORECAST_COUNTER, interval)
+    finally:
+        db.close()
+
+
+class ForecastJob:
+    """Recomputes forecasts on a background thread every `interval` seconds."""
+
+    def __init__(self, interval: float = FORECAST_INTERVAL):
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0 and available():
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="forecast-job", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if _claim_run(self.interval):
+                    summary = run()
+                    print(f"Forecast updated for {summary['products']} products in "
+                          f"{summary['load_s'] + summary['compute_s'] + summary['store_s']:.2f}s")
+            except Exception as e:
+                print(f"Forecast job failed: {e}")
+            self._stopping.wait(timeout=min(self.interval, FORECAST_CHECK_INTERVAL))
+
+
+forecast_job = ForecastJob()
@@ -0,0 +1,250 @@
+"""
+    Idempotency-Key support for scans, scan logs and quantity updates (ROUTES).
+
+    A request sent with an Idempotency-Key header runs once. Repeats with the
+    same key get the first response back (with Idempotent-Replayed: true)
+    without running anything, so clients can keep scans in flight and retry on
+    timeouts without decrementing stock twice. Reusing a key with a different
+    body is answered 422.
+
+    Keys are claimed with an INSERT into idempotency_keys before the request
+    runs, so a duplicate arriving at any worker while the first is still
+    running waits for its response (up to IDEMPOTENCY_WAIT seconds, then 409).
+    Finished responses are kept for IDEMPOTENCY_TTL seconds in that table and
+    the most recent ones in an in-process LRU. 5xx responses aren't kept: the
+    claim is dropped so a retry runs again (unless it committed changes before
+    failing). A claim whose request died without
+    committing anything can be taken over after IDEMPOTENCY_LEASE seconds.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import metrics, models
+from app.database import AppSession, engine
+
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", 24 * 3600))
+IDEMPOTENCY_CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", 10000))
+IDEMPOTENCY_LEASE = float(os.getenv("IDEMPOTENCY_LEASE", 60))
+IDEMPOTENCY_WAIT = float(os.getenv("IDEMPOTENCY_WAIT", 10))
+IDEMPOTENCY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL", 300))
+MAX_KEY_LENGTH = 255
+MAX_CACHED_BODY = 64 * 1024  # larger responses (big scan batches) are only kept in the table
+POLL_INTERVAL = 0.05
+HEADER = "Idempotency-Key"
+
+ROUTES = (
+    ("POST", re.compile(r"/products/scan/[^/]+(/log)?/?")),  # single scans, scan + log, /scan/batch
+    ("POST", re.compile(r"/scan_logs/?")),
+    ("PUT", re.compile(r"/products/[^/]+/quantity/[^/]+/?")),
+    ("POST", re.compile(r"/products/[^/]+/restock/?")),
+)
+
+keys = models.IdempotencyRecord.__table__
+
+# Key of the claim the current request runs under; its first commit marks the claim committed
+_claim: ContextVar[str | None] = ContextVar("idempotency_claim", default=None)
+
+
+@event.listens_for(AppSession, "before_commit")
+def _mark_committed(session):
+    key = _claim.get()
+    if key is not None and not session.info.get("idempotency_marked"):
+        session.info["idempotency_marked"] = True
+        session.execute(update(keys).where(keys.c.key == key).values(committed=True))
+
+
+def covered(method: str, path: str) -> bool:
+    return any(method == m and pattern.fullmatch(path) for m, pattern in ROUTES)
+
+
+class IdempotencyStore:
+    """Finished responses by key: an LRU in front of the idempotency_keys table."""
+
+    def __init__(self, maxsize: int = IDEMPOTENCY_CACHE_SIZE, ttl: float = IDEMPOTENCY_TTL, lease: float = IDEMPOTENCY_LEASE):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lease = lease
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (fingerprint, status, media type, body, expires_at)
+        self._lock = threading.Lock()
+        self._running: dict[str, asyncio.Future] = {}  # keys this worker is running now
+        self._purged_at = time.monotonic()
+
+    # ---------- LRU ----------
+    def cached(self, key: str) -> tuple | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[4] <= datetime.now():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def remember(self, key: str, entry: tuple):
+        if entry[3] is not None and len(entry[3]) > MAX_CACHED_BODY:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    # ---------- Table (blocking; called in threads) ----------
+    def claim(self, key: str, fingerprint: str) -> tuple[str, tuple | None]:
+        """('run', None) if this request is to run, else ('done', entry), ('busy' | 'mismatch' | 'lost', None)"""
+        while True:
+            now = datetime.now()
+            try:
+                with engine.begin() as conn:
+                    conn.execute(insert(keys).values(
+                        key=key, fingerprint=fingerprint, committed=False,
+                        locked_until=now + timedelta(seconds=self.lease), expires_at=now + timedelta(seconds=self.ttl),
+                    ))
+                return "run", None
+            except IntegrityError:
+                pass
+
+            with engine.begin() as conn:
+                row = conn.execute(select(keys).where(keys.c.key == key)).first()
+                if row is None:
+                    continue  # purged in between
+                if row.expires_at <= now:
+                    conn.execute(delete(keys).where(keys.c.key == key, keys.c.expires_at == row.expires_at))
+                    continue
+                if row.fingerprint != fingerprint:
+                    return "mismatch", None
+                if row.status_code is not None:
+                    return "done", (row.fingerprint, row.status_code, row.media_type, row.body, row.expires_at)
+                if row.locked_until > now:
+                    return "busy", None
+                if row.committed:
+                    return "lost", None  # it changed data but never stored its response
+                taken = conn.execute(
+                    update(keys)
+                    .where(keys.c.key == key, keys.c.locked_until == row.locked_until, keys.c.status_code.is_(None))
+                    .values(locked_until=now + timedelta(seconds=self.lease))
+                ).rowcount
+                return ("run", None) if taken else ("busy", None)
+
+    def finish(self, key: str, status_code: int, media_type: str | None, body: bytes) -> datetime:
+        """Store the response; returns when it expires"""
+        expires_at = datetime.now() + timedelta(seconds=self.ttl)
+        with engine.begin() as conn:
+            conn.execute(update(keys).where(keys.c.key == key).values(
+                status_code=status_code, media_type=media_type, body=body, expires_at=expires_at,
+            ))
+        return expires_at
+
+    def release(self, key: str) -> bool:
+        """Drop an unfinished claim so a retry runs again; False if its request committed changes already"""
+        with engine.begin() as conn:
+            return conn.execute(delete(keys).where(
+                keys.c.key == key, keys.c.status_code.is_(None), keys.c.committed.is_(False)
+            )).rowcount > 0
+
+    def purge(self) -> int:
+        """Delete expired keys"""
+        try:
+            with engine.begin() as conn:
+                return conn.execute(delete(keys).where(keys.c.expires_at < datetime.now())).rowcount
+        except Exception as e:
+            print(f"Idempotency key purge failed: {e}")
+            return 0
+
+    # ---------- Requests ----------
+    async def run(self, key: str, fingerprint: str, call_next) -> Response:
+        """The response for `key`: replayed if it already ran, else from call_next()"""
+        if time.monotonic() - self._purged_at > IDEMPOTENCY_PURGE_INTERVAL:
+            self._purged_at = time.monotonic()
+            asyncio.get_running_loop().run_in_executor(None, self.purge)
+
+        while True:
+            entry = self.cached(key)
+            if entry is not None:
+                return _replay(entry, fingerprint)
+            running = self._running.get(key)
+            if running is None:
+                break
+            await asyncio.shield(running)  # the same key is running in this worker
+
+        self._running[key] = done = asyncio.get_running_loop().create_future()
+        try:
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT
+            while True:
+                outcome, entry = await asyncio.to_thread(self.claim, key, fingerprint)
+                if outcome == "run":
+                    break
+                if outcome == "done":
+                    self.remember(key, entry)
+                    return _replay(entry, fingerprint)
+                if outcome == "mismatch":
+                    return _reject("mismatch", 422, f"{HEADER} was already used for a different request")
+                if outcome == "lost":
+                    return _reject("lost", 409, f"The request with this {HEADER} was applied but its response is lost; check before sending it again with a new key")
+                if time.monotonic() > deadline:
+                    return _reject("busy", 409, f"A request with this {HEADER} is still running", {"Retry-After": "1"})
+                await asyncio.sleep(POLL_INTERVAL)
+
+            token = _claim.set(key)
+            try:
+                response = await call_next()
+                body = b"".join([chunk async for chunk in response.body_iterator])
+            except BaseException:
+                await asyncio.to_thread(self.release, key)
+                raise
+            finally:
+                _claim.reset(token)
+
+            if response.status_code >= 500 and await asyncio.to_thread(self.release, key):
+                metrics.count_idempotency("failed")
+            else:
+                media_type = response.headers.get("content-type")
+                expires_at = await asyncio.to_thread(self.finish, key, response.status_code, media_type, body)
+                self.remember(key, (fingerprint, response.status_code, media_type, body, expires_at))
+                metrics.count_idempotency("executed")
+            return Response(content=body, status_code=response.status_code, headers=dict(response.headers))
+        finally:
+            del self._running[key]
+            done.set_result(None)
+
+
+def _replay(entry: tuple, fingerprint: str) -> Response:
+    stored_fingerprint, status_code, media_type, body, _ = entry
+    if stored_fingerprint != fingerprint:
+        return _reject("mismatch", 422, f"{HEADER} was already used for a different request")
+    metrics.count_idempotency("replayed")
+    headers = {"Idempotent-Replayed": "true"}
+    if media_type:
+        headers["Content-Type"] = media_type
+    return Response(content=body, status_code=status_code, headers=headers)
+
+
+def _reject(outcome: str, status_code: int, detail: str, headers: dict | None = None) -> Response:
+    metrics.count_idempotency(outcome)
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+
+store = IdempotencyStore()
+
+
+async def idempotency_middleware(request, call_next):
+    """Run covered requests that carry an Idempotency-Key at most once"""
+    key = request.headers.get(HEADER)
+    if key is None or not covered(request.method, request.url.path):
+        return await call_next(request)
+    if not 0 < len(key) <= MAX_KEY_LENGTH:
+        return JSONResponse({"detail": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters"}, status_code=400)
+    fingerprint = hashlib.sha256(await request.body()).hexdigest()
+    return await store.run(f"{request.method} {request.url.path} {key}", fingerprint, lambda: call_next(request))
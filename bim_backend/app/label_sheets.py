@@ -0,0 +1,184 @@
+"""
+    Printable barcode label sheets (POST /products/labels).
+
+    Labels are laid out on sheet templates (LAYOUTS, in millimetres) and come
+    back as one multi-page PDF or a ZIP of PNG pages. Whole pages are composed
+    in a process pool: each worker pastes the products' barcode PNGs from
+    BARCODE_DIR (rendering and saving the ones that are missing, so later
+    requests reuse them) under the product names, and returns the page as a
+    1-bit raster. Pages are written out in order as they finish, with at most
+    LABEL_PAGES_AHEAD in flight, so memory doesn't grow with the label count.
+"""
+import io
+import os
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+from PIL import Image, ImageFont, ImageDraw
+
+from app import barcode_images
+from app.scan_log_export import DrainableSink
+
+LABEL_WORKERS = int(os.getenv("LABEL_WORKERS", os.cpu_count() or 2))
+LABEL_PAGES_AHEAD = LABEL_WORKERS * 2
+MAX_LABELS = int(os.getenv("MAX_LABELS", 20000))
+DEFAULT_DPI = 300
+MIN_DPI, MAX_DPI = 150, 600
+MM_PER_INCH = 25.4
+
+# name -> (page w, h), (columns, rows), label (w, h), first label's (left, top), pitch (x, y); all in mm
+LAYOUTS = {
+    "avery-5160": ((215.9, 279.4), (3, 10), (66.675, 25.4), (4.7625, 12.7), (69.85, 25.4)),  # Letter, 30 per sheet
+    "avery-5163": ((215.9, 279.4), (2, 5), (101.6, 50.8), (3.96875, 12.7), (106.3625, 50.8)),  # Letter, 10 per sheet
+    "avery-5167": ((215.9, 279.4), (4, 20), (44.45, 12.7), (7.62, 12.7), (52.07, 12.7)),  # Letter, 80 per sheet
+    "avery-L7160": ((210.0, 297.0), (3, 7), (63.5, 38.1), (7.2, 15.15), (66.04, 38.1)),  # A4, 21 per sheet
+    "avery-L7163": ((210.0, 297.0), (2, 7), (99.1, 38.1), (4.65, 15.15), (101.6, 38.1)),  # A4, 14 per sheet
+    "avery-L7651": ((210.0, 297.0), (5, 13), (38.1, 21.2), (4.75, 10.7), (40.6, 21.2)),  # A4, 65 per sheet
+}
+DEFAULT_LAYOUT = "avery-5160"
+FORMATS = {"pdf": ("application/pdf", "pdf"), "png": ("application/zip", "zip")}
+
+_pool: ProcessPoolExecutor | None = None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=LABEL_WORKERS)
+    return _pool
+
+
+def labels_per_page(layout: str) -> int:
+    columns, rows = LAYOUTS[layout][1]
+    return columns * rows
+
+
+def page_count(labels: int, layout: str) -> int:
+    return -(-labels // labels_per_page(layout))
+
+
+# ---------- Page composition (runs in the worker processes) ----------
+def _px(mm: float, dpi: int) -> int:
+    return round(mm * dpi / MM_PER_INCH)
+
+
+def _label(value: str, name: str, width: int, height: int, dpi: int, font) -> Image.Image:
+    """One label: the product name over its barcode image, at print size or shrunk to fit"""
+    label = Image.new("L", (width, height), 255)
+    pad = max(width, height) // 40
+    top = pad
+    if name:
+        draw = ImageDraw.Draw(label)
+        if draw.textlength(name, font=font) > width - 2 * pad:
+            while name and draw.textlength(name + "...", font=font) > width - 2 * pad:
+                name = name[:-1]
+            name += "..."
+        draw.text((width // 2, top), name, fill=0, font=font, anchor="mt")
+        top += font.size + pad
+    with Image.open(io.BytesIO(barcode_images.load_or_render(value))) as image:
+        image = image.convert("L")
+        scale = min(
+            dpi / barcode_images.DEFAULT_DPI,
+            (width - 2 * pad) / image.width,
+            (height - top - pad) / image.height,
+        )
+        if scale != 1:
+            image = image.resize((max(int(image.width * scale), 1), max(int(image.height * scale), 1)), Image.Resampling.BOX)
+        label.paste(image, ((width - image.width) // 2, top + (height - top - pad - image.height) // 2))
+    return label
+
+
+def compose_page(layout: str, labels: list[tuple[str, str]], dpi: int, fmt: str) -> tuple[int, int, bytes]:
+    """(width px, height px, page) for one sheet: Flate-compressed 1-bit rows for PDF, else a PNG"""
+    (page_w, page_h), (columns, _), (label_w, label_h), (left, top), (pitch_x, pitch_y) = LAYOUTS[layout]
+    page = Image.new("L", (_px(page_w, dpi), _px(page_h, dpi)), 255)
+    width, height = _px(label_w, dpi), _px(label_h, dpi)
+    font = ImageFont.load_default(size=max(height // 8, 8))
+    rendered = {}  # copies of a label repeat on the page
+    for i, (value, name) in enumerate(labels):
+        key = (value, name)
+        if key not in rendered:
+            rendered[key] = _label(value, name, width, height, dpi, font)
+        row, column = divmod(i, columns)
+        page.paste(rendered[key], (_px(left + column * pitch_x, dpi), _px(top + row * pitch_y, dpi)))
+    page = page.convert("1", dither=Image.Dither.NONE)
+    if fmt == "pdf":
+        return page.width, page.height, zlib.compress(page.tobytes(), 6)
+    buf = io.BytesIO()
+    page.save(buf, "PNG", dpi=(dpi, dpi))
+    return page.width, page.height, buf.getvalue()
+
+
+# ---------- Streaming ----------
+def _pages(labels: list[tuple[str, str]], layout: str, dpi: int, fmt: str) -> Iterator[tuple[int, int, bytes]]:
+    """Composed pages in order, keeping at most LABEL_PAGES_AHEAD in flight"""
+    per_page = labels_per_page(layout)
+    chunks = (labels[i:i + per_page] for i in range(0, len(labels), per_page))
+    pool = _get_pool()
+    pending = deque()
+    for chunk in chunks:
+        pending.append(pool.submit(compose_page, layout, chunk, dpi, fmt))
+        if len(pending) >= LABEL_PAGES_AHEAD:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _pdf(pages: Iterator[tuple[int, int, bytes]], count: int, layout: str) -> Iterator[bytes]:
+    """Minimal PDF written front to back: catalog, page tree, then per page its object, contents and image"""
+    page_w, page_h = (round(mm * 72 / MM_PER_INCH, 3) for mm in LAYOUTS[layout][0])
+    offsets = []
+    position = 0
+
+    def obj(number: int, body: bytes, stream: bytes | None = None) -> bytes:
+        nonlocal position
+        offsets.append((number, position))
+        data = f"{number} 0 obj\n".encode() + body
+        if stream is not None:
+            data += b"\nstream\n" + stream + b"\nendstream"
+        data += b"\nendobj\n"
+        position += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position = len(header)
+    kids = " ".join(f"{3 + 3 * i} 0 R" for i in range(count))
+    yield header + obj(1, b"<< /Type /Catalog /Pages 2 0 R >>") + obj(
+        2, f"<< /Type /Pages /Kids [{kids}] /Count {count} >>".encode()
+    )
+    for i, (width, height, data) in enumerate(pages):
+        page, contents, image = 3 + 3 * i, 4 + 3 * i, 5 + 3 * i
+        draw = f"q {page_w} 0 0 {page_h} 0 0 cm /Im0 Do Q".encode()
+        yield obj(page, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_w} {page_h}] "
+            f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {contents} 0 R >>"
+        ).encode()) + obj(contents, f"<< /Length {len(draw)} >>".encode(), draw) + obj(image, (
+            f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceGray "
+            f"/BitsPerComponent 1 /Filter /FlateDecode /Length {len(data)} >>"
+        ).encode(), data)
+
+    total = 3 + 3 * count
+    xref = [f"xref\n0 {total}\n", "0000000000 65535 f \n"]
+    xref += [f"{offset:010d} 00000 n \n" for _, offset in sorted(offsets)]
+    yield "".join(xref).encode() + f"trailer\n<< /Size {total} /Root 1 0 R >>\nstartxref\n{position}\n%%EOF\n".encode()
+
+
+def _png_zip(pages: Iterator[tuple[int, int, bytes]]) -> Iterator[bytes]:
+    """PNG pages in a ZIP written as it goes (stored: PNG is compressed already)"""
+    sink = DrainableSink()
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+        for i, (_, _, data) in enumerate(pages, start=1):
+            archive.writestr(f"labels-{i:04d}.png", data)
+            yield sink.drain()
+    yield sink.drain()
+
+
+def render_sheets(labels: list[tuple[str, str]], layout: str = DEFAULT_LAYOUT, fmt: str = "pdf", dpi: int = DEFAULT_DPI) -> Iterator[bytes]:
+    """Yield the label sheets for (barcode, name) pairs, one page after another"""
+    pages = _pages(labels, layout, dpi, fmt)
+    if fmt == "pdf":
+        return _pdf(pages, page_count(len(labels), layout), layout)
+    return _png_zip(pages)
@@ -1,13 +1,46 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import Base, engine
-from app import models
-from app.routes import products, email, scan_logs
+from app.database import Base, engine, read_your_writes_middleware, upgrade_schema, ASYNC_MODE
+from app import catalog_version, metrics, models, product_search
+from app.alert_dispatcher import dispatcher
+from app.change_feed import feed
+from app.forecasting import forecast_job
+from app.idempotency import idempotency_middleware
+from app.scan_log_archive import retention_job
+from app.scan_log_writer import scan_log_writer
+from app.stock_ledger import stock_compactor
+from app.routes import products, email, scan_logs, analytics, forecast, changes, metrics as metrics_routes
 
 # Initialize DB
 Base.metadata.create_all(bind=engine)
+upgrade_schema()
+catalog_version.stamp_pending()  # rows a previous run committed but didn't get to stamp
+product_search.install()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await feed.start()
+    if ASYNC_MODE:
+        await dispatcher.start_async()
+    else:
+        dispatcher.start()
+    forecast_job.start()
+    retention_job.start()
+    stock_compactor.start()
+    scan_log_writer.start()
+    yield
+    scan_log_writer.stop()
+    stock_compactor.stop()
+    retention_job.stop()
+    forecast_job.stop()
+    if ASYNC_MODE:
+        await dispatcher.stop_async()
+    else:
+        dispatcher.stop()
+    await feed.stop()
+
+app = FastAPI(lifespan=lifespan)
 
 # Allow frontend (Expo app) to connect
 origins = ["http://localhost:3000"]
@@ -18,8 +51,22 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(idempotency_middleware)
+app.middleware("http")(read_your_writes_middleware)
+app.middleware("http")(metrics.metrics_middleware)
 
 # Register routers
+if ASYNC_MODE:
+    # Async routes go first so they take precedence over their sync twins
+    from app.routes import async_products, async_email, async_scan_logs
+
+    app.include_router(async_products.router)
+    app.include_router(async_email.router)
+    app.include_router(async_scan_logs.router)
 app.include_router(products.router)
 app.include_router(email.router)
 app.include_router(scan_logs.router)
+app.include_router(analytics.router)
+app.include_router(forecast.router)
+app.include_router(changes.router)
+app.include_router(metrics_routes.router)
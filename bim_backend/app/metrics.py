@@ -0,0 +1,235 @@
+"""
+    Per-request performance instrumentation, exposed in Prometheus text format.
+
+    The HTTP middleware opens a per-request stats object in a contextvar; the
+    SQLAlchemy engine hooks add every statement's count, time and row count to
+    it (and to per-engine totals). Slow statements are logged together with the
+    endpoint that issued them. Metrics are per worker process.
+"""
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", 200))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+POOL_WAIT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+GROUP_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+slow_query_log = logging.getLogger("bim.slow_sql")
+
+_lock = threading.Lock()
+_request_stats: contextvars.ContextVar["RequestStats | None"] = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+class RequestStats:
+    __slots__ = ("scope", "statements", "sql_seconds", "rows")
+
+    def __init__(self, scope: dict):
+        self.scope = scope  # routing fills in scope["route"] before any endpoint SQL runs
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.rows = 0
+
+    @property
+    def route(self) -> str:
+        """Route path template ("/products/{barcode}"), so labels don't explode per barcode"""
+        return getattr(self.scope.get("route"), "path", "unmatched")
+
+
+# label tuple -> metric
+request_latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (method, route, status)
+request_statements = defaultdict(lambda: Histogram(STATEMENT_BUCKETS))  # (method, route)
+request_sql_seconds = defaultdict(float)  # (method, route)
+request_sql_rows = defaultdict(int)  # (method, route)
+slow_queries = defaultdict(int)  # (route,)
+engine_statements = defaultdict(int)  # (engine,)
+engine_sql_seconds = defaultdict(float)  # (engine,)
+pool_wait = defaultdict(lambda: Histogram(POOL_WAIT_BUCKETS))  # (engine,)
+_pools = {}  # engine name -> pool
+replica_fallbacks = defaultdict(int)  # (engine,)
+idempotency_outcomes = defaultdict(int)  # (outcome,)
+group_commit_rows = defaultdict(lambda: Histogram(GROUP_SIZE_BUCKETS))  # (writer,)
+group_commit_seconds = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (writer,)
+group_commit_rejected = defaultdict(int)  # (writer,)
+group_commit_queued = {}  # (writer,) -> callable returning the current queue length
+
+
+# ---------- Request middleware ----------
+async def metrics_middleware(request, call_next):
+    """Time the request and attribute SQL work to its route template"""
+    stats = RequestStats(request.scope)
+    token = _request_stats.set(stats)
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        elapsed = time.perf_counter() - start
+        _request_stats.reset(token)
+        route_path, method = stats.route, request.method
+        with _lock:
+            request_latency[(method, route_path, str(status))].observe(elapsed)
+            request_statements[(method, route_path)].observe(stats.statements)
+            request_sql_seconds[(method, route_path)] += stats.sql_seconds
+            request_sql_rows[(method, route_path)] += stats.rows
+
+
+def _current_route() -> str:
+    stats = _request_stats.get()
+    return stats.route if stats else "background"
+
+
+# ---------- SQLAlchemy hooks ----------
+def instrument_engine(engine, name: str = "primary"):
+    """Count/time statements on an engine and keep its pool for saturation gauges"""
+    _pools[name] = engine.pool
+    if isinstance(engine.pool, TimedQueuePool):
+        engine.pool.metrics_name = name
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("bim_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["bim_query_start"].pop()
+        rows = cursor.rowcount if cursor.rowcount and cursor.rowcount > 0 else 0  # -1 when the driver can't tell
+        stats = _request_stats.get()
+        with _lock:
+            engine_statements[(name,)] += 1
+            engine_sql_seconds[(name,)] += elapsed
+        if stats is not None:
+            stats.statements += 1
+            stats.sql_seconds += elapsed
+            stats.rows += rows
+        if elapsed * 1000 >= SLOW_QUERY_MS:
+            route = _current_route()
+            with _lock:
+                slow_queries[(route,)] += 1
+            slow_query_log.warning("Slow query (%.1f ms) from %s: %s", elapsed * 1000, route, " ".join(statement.split())[:500])
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("bim_query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    metrics_name = "primary"
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            with _lock:
+                pool_wait[(self.metrics_name,)].observe(time.perf_counter() - start)
+
+
+def count_replica_fallback(engine: str):
+    with _lock:
+        replica_fallbacks[(engine,)] += 1
+
+
+def count_idempotency(outcome: str):
+    with _lock:
+        idempotency_outcomes[(outcome,)] += 1
+
+
+# ---------- Group commit writers ----------
+def observe_group_commit(writer: str, rows: int, seconds: float):
+    with _lock:
+        group_commit_rows[(writer,)].observe(rows)
+        group_commit_seconds[(writer,)].observe(seconds)
+
+
+def count_group_commit_rejected(writer: str):
+    with _lock:
+        group_commit_rejected[(writer,)] += 1
+
+
+# ---------- Prometheus exposition ----------
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _histogram_lines(name, help_text, label_names, series) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for values, hist in sorted(series.items()):
+        cumulative = 0
+        for bound, count in zip(hist.buckets, hist.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels((*label_names, 'le'), (*values, bound))} {cumulative}")
+        lines.append(f"{name}_bucket{_labels((*label_names, 'le'), (*values, '+Inf'))} {hist.count}")
+        lines.append(f"{name}_sum{_labels(label_names, values)} {hist.sum}")
+        lines.append(f"{name}_count{_labels(label_names, values)} {hist.count}")
+    return lines
+
+
+def _simple_lines(name, kind, help_text, label_names, series) -> list[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    for values, value in sorted(series.items()):
+        lines.append(f"{name}{_labels(label_names, values)} {value}")
+    return lines
+
+
+def render() -> str:
+    with _lock:
+        lines = []
+        lines += _histogram_lines("bim_http_request_duration_seconds", "Request latency", ("method", "route", "status"), request_latency)
+        lines += _histogram_lines("bim_http_request_sql_statements", "SQL statements per request", ("method", "route"), request_statements)
+        lines += _simple_lines("bim_http_request_sql_seconds_total", "counter", "Time spent in SQL per route", ("method", "route"), request_sql_seconds)
+        lines += _simple_lines("bim_http_request_sql_rows_total", "counter", "Rows returned/affected per route (where the driver reports it)", ("method", "route"), request_sql_rows)
+        lines += _simple_lines("bim_slow_queries_total", "counter", f"Statements slower than {SLOW_QUERY_MS:g} ms", ("route",), slow_queries)
+        lines += _simple_lines("bim_sql_statements_total", "counter", "SQL statements per engine", ("engine",), engine_statements)
+        lines += _simple_lines("bim_sql_seconds_total", "counter", "SQL time per engine", ("engine",), engine_sql_seconds)
+        lines += _histogram_lines("bim_db_pool_checkout_wait_seconds", "Time waiting for a pooled connection", ("engine",), pool_wait)
+        pool_series = {"checked_out": {}, "size": {}, "overflow": {}}
+        for name, pool in _pools.items():
+            if hasattr(pool, "checkedout"):
+                pool_series["checked_out"][(name,)] = pool.checkedout()
+                pool_series["size"][(name,)] = pool.size()
+                pool_series["overflow"][(name,)] = max(pool.overflow(), 0)
+        lines += _simple_lines("bim_db_pool_checked_out", "gauge", "Connections currently checked out", ("engine",), pool_series["checked_out"])
+        lines += _simple_lines("bim_db_pool_size", "gauge", "Configured pool size", ("engine",), pool_series["size"])
+        lines += _simple_lines("bim_db_pool_overflow", "gauge", "Overflow connections in use", ("engine",), pool_series["overflow"])
+        lines += _simple_lines("bim_db_replica_fallbacks_total", "counter", "Times a read replica failed and reads went to the primary", ("engine",), replica_fallbacks)
+        lines += _simple_lines("bim_idempotency_requests_total", "counter", "Requests with an Idempotency-Key by outcome (executed, replayed, failed, busy, mismatch, lost)", ("outcome",), idempotency_outcomes)
+        lines += _histogram_lines("bim_group_commit_rows", "Rows written per group commit", ("writer",), group_commit_rows)
+        lines += _histogram_lines("bim_group_commit_seconds", "Time to write and commit one group", ("writer",), group_commit_seconds)
+        lines += _simple_lines("bim_group_commit_rejected_total", "counter", "Writes refused because the queue was full or they waited too long", ("writer",), group_commit_rejected)
+        queued = {labels: length() for labels, length in group_commit_queued.items()}
+        lines += _simple_lines("bim_group_commit_queued", "gauge", "Writes waiting for the next group", ("writer",), queued)
+    return "\n".join(lines) + "\n"
@@ -2,8 +2,9 @@
     Strictly contains database tables
 """
 import uuid
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, Float, String, Date, DateTime, ForeignKey, Index, Boolean, LargeBinary, case, func, text, true
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import column_property, relationship
 from datetime import datetime
 from app.database import Base
 
@@ -14,14 +15,95 @@ class ProductDB(Base):
     id = Column(Integer, primary_key=True, index=True)
     barcode = Column(String, unique=True, index=True)
     name = Column(String, index=True)
-    quantity = Column(Integer, default=0)
+    # active_history: the stock ledger needs the old value of every change (see stock_ledger.py)
+    quantity = column_property(Column(Integer, default=0), active_history=True)
     quantity_to_order = Column(Integer, default=0)
     threshold = Column(Integer, default=5)
     barcode_file = Column(String, nullable=True)
     classification = Column(String, nullable=True)
+
+    # Catalog version of the last change to this row (see catalog_version.py)
+    version = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    # Re-armed once stock is back above threshold; a restock alert fires only on the way down
+    alert_armed = Column(Boolean, nullable=False, default=True, server_default=true())
+    # > 0: stock lives in that many stock_shards rows and `quantity` trails them (see stock_ledger.py)
+    stock_shards = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+
+    __table_args__ = (
+        # Type-ahead search walks these in name order (see product_search.py)
+        Index("ix_products_name_lower", func.lower(name)),
+        Index("ix_products_classification_name_lower", classification, func.lower(name)),
+        # The low-stock set, most urgent first (overall and per classification): only products at or
+        # below their threshold are in it, and every write keeps it current in its own transaction
+        # (see crud.low_stock_query)
+        Index(
+            "ix_products_low_stock", text("(quantity - threshold)"), "id",
+            sqlite_where=text("quantity <= threshold"), postgresql_where=text("quantity <= threshold"),
+        ),
+        Index(
+            "ix_products_low_stock_classification", "classification", text("(quantity - threshold)"), "id",
+            sqlite_where=text("quantity <= threshold"), postgresql_where=text("quantity <= threshold"),
+        ),
+    )
     
     scan_logs = relationship("ScanLog", back_populates="product", cascade="all, delete-orphan")
 
+    @hybrid_property
+    def status(self):
+        """High / Warning / Low against the threshold; a CASE in queries"""
+        if self.quantity > self.threshold:
+            return "High"
+        if self.quantity == self.threshold:
+            return "Warning"
+        return "Low"
+
+    @status.inplace.expression
+    @classmethod
+    def _status_expression(cls):
+        return case(
+            (cls.quantity > cls.threshold, "High"),
+            (cls.quantity == cls.threshold, "Warning"),
+            else_="Low",
+        ).label("status")
+
+
+class Counter(Base):
+    """Named monotonic counters (barcode allocation blocks, catalog version, ...)"""
+    __tablename__ = "counters"
+
+    name = Column(String, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class ProductTombstone(Base):
+    """Deleted products, so delta sync clients can drop them"""
+    __tablename__ = "product_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    barcode = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, default=datetime.now)
+
+
+class AlertOutbox(Base):
+    """Restock alerts waiting to be mailed by alert_dispatcher"""
+    __tablename__ = "alert_outbox"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    product_name = Column(String, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    threshold = Column(Integer, nullable=False)
+    quantity_to_order = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.now, index=True)
+    sent_at = Column(DateTime, nullable=True, index=True)
+    claimed_by = Column(String, nullable=True)  # dispatcher currently sending it
+    claimed_at = Column(DateTime, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(String, nullable=True)
+
 
 class EmailSettingsDB(Base):
     __tablename__ = "email_settings"
@@ -61,3 +143,118 @@ class ScanLog(Base):
     classification = Column(String, nullable=True)  # NEW FIELD
 
     product = relationship("ProductDB", back_populates="scan_logs")
+
+    # Composite indexes for keyset pagination on (scanned_at, id) and its filters
+    __table_args__ = (
+        Index("ix_scan_logs_scanned_at_id", "scanned_at", "id"),
+        Index("ix_scan_logs_product_scanned_at", "product_id", "scanned_at", "id"),
+        Index("ix_scan_logs_classification_scanned_at", "classification", "scanned_at", "id"),
+        Index("ix_scan_logs_scanned_by_scanned_at", "scanned_by", "scanned_at", "id"),
+        Index("ix_scan_logs_purpose_scanned_at", "purpose", "scanned_at", "id"),
+    )
+
+
+class ScanDailyRollup(Base):
+    """Units and scans per product, classification and day (see scan_rollups.py)"""
+    __tablename__ = "scan_daily_rollups"
+
+    product_id = Column(Integer, primary_key=True)
+    classification = Column(String, primary_key=True, default="")  # "" when unclassified
+    day = Column(Date, primary_key=True)
+    units = Column(Integer, nullable=False, default=0)
+    scans = Column(Integer, nullable=False, default=0)
+
+    # Covering index: analytics and the forecast job read day ranges without touching the table
+    __table_args__ = (
+        Index("ix_scan_daily_rollups_day", "day", "classification", "product_id", "units", "scans"),
+    )
+
+
+class ProductForecast(Base):
+    """Latest stock-out forecast and reorder suggestion per product (see forecasting.py)"""
+    __tablename__ = "product_forecasts"
+
+    product_id = Column(Integer, primary_key=True)
+    computed_at = Column(DateTime, nullable=False)
+    window_days = Column(Integer, nullable=False)
+    daily_rate = Column(Float, nullable=False)
+    daily_std = Column(Float, nullable=False)
+    days_until_stockout = Column(Float, nullable=True, index=True)  # NULL when nothing is being used
+    stockout_date = Column(Date, nullable=True)
+    suggested_threshold = Column(Integer, nullable=True)  # NULL without usage in the window
+    suggested_quantity_to_order = Column(Integer, nullable=True)
+
+
+class ScanLogArchive(Base):
+    """One compressed file of scan logs moved out of scan_logs (see scan_log_archive.py)"""
+    __tablename__ = "scan_log_archives"
+
+    id = Column(Integer, primary_key=True)
+    month = Column(Date, nullable=False, index=True)  # first day of the archived month
+    path = Column(String, nullable=False)  # relative to SCAN_LOG_ARCHIVE_DIR
+    rows = Column(Integer, nullable=False)
+    units = Column(Integer, nullable=False)
+    bytes = Column(Integer, nullable=False)
+    first_scanned_at = Column(DateTime, nullable=True)
+    last_scanned_at = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+class ScanArchiveTotal(Base):
+    """Units and scans per product, classification and archived month"""
+    __tablename__ = "scan_archive_totals"
+
+    month = Column(Date, primary_key=True)
+    product_id = Column(Integer, primary_key=True)
+    classification = Column(String, primary_key=True, default="")  # "" when unclassified
+    units = Column(Integer, nullable=False, default=0)
+    scans = Column(Integer, nullable=False, default=0)
+
+
+class StockMovement(Base):
+    """Append-only stock ledger: one row per change to a product's quantity (see stock_ledger.py)"""
+    __tablename__ = "stock_movements"
+
+    id = Column(Integer, primary_key=True)
+    product_id = Column(Integer, nullable=False)
+    delta = Column(Integer, nullable=False)
+    reason = Column(String, nullable=False)  # initial, opening, scan, restock, correction
+    shard = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.now)
+
+    __table_args__ = (
+        Index("ix_stock_movements_product_id", "product_id", "id"),
+    )
+
+
+class StockSnapshot(Base):
+    """A product's ledger quantity folded up to movement_id"""
+    __tablename__ = "stock_snapshots"
+
+    product_id = Column(Integer, primary_key=True)
+    movement_id = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, nullable=False, default=datetime.now)
+
+
+class StockShard(Base):
+    """One slice of a sharded product's stock; every shard stays >= 0"""
+    __tablename__ = "stock_shards"
+
+    product_id = Column(Integer, primary_key=True)
+    shard = Column(Integer, primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+
+
+class IdempotencyRecord(Base):
+    """A request made with an Idempotency-Key and, once it finished, its response (see idempotency.py)"""
+    __tablename__ = "idempotency_keys"
+
+    key = Column(String, primary_key=True)  # "<method> <path> <Idempotency-Key>"
+    fingerprint = Column(String, nullable=False)  # sha256 of the request body
+    status_code = Column(Integer, nullable=True)  # NULL while the first request is still running
+    media_type = Column(String, nullable=True)
+    body = Column(LargeBinary, nullable=True)
+    committed = Column(Boolean, nullable=False, default=False)  # its database changes are committed
+    locked_until = Column(DateTime, nullable=False)  # another request may take over an unfinished key after this
+    expires_at = Column(DateTime, nullable=False, index=True)
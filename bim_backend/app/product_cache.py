@@ -0,0 +1,119 @@
+"""
+    Read-through LRU + TTL cache for barcode lookups (the scan hot path).
+
+    Write paths in routes/products.py invalidate entries explicitly. Other
+    uvicorn workers are kept coherent through the catalog version counter: at
+    most every PRODUCT_CACHE_SYNC seconds a lookup checks whether the version
+    moved and, if so, drops the barcodes changed or deleted since the last check
+    (one indexed query on products.version / product_tombstones.version).
+    Misses and syncs always read from the primary, never a read replica.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from app import catalog_version, models
+from app.database import use_primary
+
+PRODUCT_CACHE_SIZE = int(os.getenv("PRODUCT_CACHE_SIZE", 10000))
+PRODUCT_CACHE_TTL = float(os.getenv("PRODUCT_CACHE_TTL", 60))
+PRODUCT_CACHE_SYNC = float(os.getenv("PRODUCT_CACHE_SYNC", 1.0))
+
+
+class ProductCache:
+    """Bounded barcode -> product snapshot cache with hit/miss/eviction counters."""
+
+    def __init__(self, maxsize: int = PRODUCT_CACHE_SIZE, ttl: float = PRODUCT_CACHE_TTL, sync_interval: float = PRODUCT_CACHE_SYNC):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.sync_interval = sync_interval
+        self._entries: "OrderedDict[str, tuple[float, object]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0  # bumped on every invalidation, guards against stale fills
+        self._synced_version = None
+        self._synced_at = 0.0
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def get(self, barcode: str):
+        with self._lock:
+            entry = self._entries.get(barcode)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(barcode)
+                    self.counters["hits"] += 1
+                    return value
+                del self._entries[barcode]
+                self.counters["expirations"] += 1
+            self.counters["misses"] += 1
+            return None
+
+    def put(self, barcode: str, value, generation: int | None = None):
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return  # something was invalidated while we were loading
+            self._entries[barcode] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(barcode)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters["evictions"] += 1
+
+    def invalidate(self, *barcodes: str):
+        with self._lock:
+            self._generation += 1
+            for barcode in barcodes:
+                if self._entries.pop(barcode, None) is not None:
+                    self.counters["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def sync(self, db: Session):
+        """Drop entries changed by other workers since the last check"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = now
+            since = self._synced_version
+
+        version = catalog_version.read_version(db)
+        if since is None:
+            # First sync: nothing cached can predate this version
+            self._synced_version = version
+            return
+        if version <= since:
+            return
+
+        products, tombstones = models.ProductDB, models.ProductTombstone
+        changed = db.execute(select(products.barcode).where(products.version > since)).scalars().all()
+        deleted = db.execute(select(tombstones.barcode).where(tombstones.version > since)).scalars().all()
+        self.invalidate(*changed, *deleted)
+        self._synced_version = version
+
+    def get_or_load(self, db: Session, barcode: str, loader: Callable[[Session, str], object]):
+        """Cached value for barcode, calling loader(db, barcode) on a miss (None is not cached)"""
+        with use_primary(db):  # a lagging replica could refill an entry this worker just invalidated
+            self.sync(db)
+            value = self.get(barcode)
+            if value is not None:
+                return value
+            generation = self._generation
+            value = loader(db, barcode)
+        if value is not None:
+            self.put(barcode, value, generation)
+        return value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counters, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+product_cache = ProductCache()
@@ -0,0 +1,120 @@
+"""
+    Streaming bulk product import (CSV / NDJSON).
+
+    Rows are read lazily from the uploaded file, validated against
+    schemas.ProductCreate in chunks, given barcodes in one allocator round trip
+    per chunk and inserted with a single executemany INSERT, their initial
+    stock movements in the same transaction. Memory use depends on the chunk
+    size, not on the file size.
+"""
+import csv
+import io
+import json
+import os
+from collections import deque
+from typing import IO, Iterator
+
+from pydantic import ValidationError
+from sqlalchemy.exc import IntegrityError
+
+from app import crud, schemas, barcode_images
+from app.barcode_allocator import allocator
+from app.barcode_images import BARCODE_DIR
+from app.database import SessionLocal
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 500))
+MAX_PENDING_RENDERS = barcode_images.RENDER_WORKERS * 4  # backpressure on the render pool
+FORMATS = ("csv", "ndjson")
+
+
+def detect_format(filename: str | None, content_type: str | None) -> str | None:
+    """Guess csv/ndjson from the upload's filename or content type"""
+    name = (filename or "").lower()
+    ctype = (content_type or "").lower()
+    if name.endswith(".csv") or "csv" in ctype:
+        return "csv"
+    if name.endswith((".ndjson", ".jsonl")) or "ndjson" in ctype or "jsonl" in ctype:
+        return "ndjson"
+    return None
+
+
+def iter_rows(fileobj: IO[bytes], fmt: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """Yield (row number, row dict, parse error) without reading the whole file"""
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    if fmt == "csv":
+        for line_no, row in enumerate(csv.DictReader(text), start=2):  # line 1 is the header
+            # Blank cells fall back to schema defaults
+            yield line_no, {k: v for k, v in row.items() if k is not None and v not in ("", None)}, None
+    else:
+        for line_no, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, None, f"Invalid JSON: {e.msg}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, None, "Expected a JSON object"
+                continue
+            yield line_no, row, None
+
+
+def _validation_message(e: ValidationError) -> str:
+    return "; ".join(f"{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors())
+
+
+def _insert_chunk(db, products: list[schemas.ProductCreate]) -> list[str]:
+    """Insert one validated chunk, returning the barcodes it was given"""
+    for _ in range(3):
+        barcodes = allocator.allocate_many(len(products))
+        files = [os.path.join(BARCODE_DIR, value) for value in barcodes]
+        try:
+            crud.bulk_create_products(db, products, barcodes, files)
+            return barcodes
+        except IntegrityError:
+            # Only possible if an allocated value hits a legacy random barcode
+            db.rollback()
+    raise RuntimeError("Failed to allocate unique barcodes for import chunk")
+
+
+def import_products(fileobj: IO[bytes], fmt: str) -> Iterator[dict]:
+    """Run the import, yielding error/progress/done events as it goes"""
+    totals = {"rows": 0, "imported": 0, "failed": 0}
+    pending_renders = deque()
+    db = SessionLocal()
+
+    def flush(chunk):
+        barcodes = _insert_chunk(db, chunk)
+        totals["imported"] += len(barcodes)
+        if len(pending_renders) >= MAX_PENDING_RENDERS:
+            pending_renders.popleft().result()
+        pending_renders.append(barcode_images.prerender_many(barcodes))
+
+    try:
+        chunk = []
+        for line_no, row, error in iter_rows(fileobj, fmt):
+            totals["rows"] += 1
+            if error is None:
+                try:
+                    chunk.append(schemas.ProductCreate(**row))
+                except ValidationError as e:
+                    error = _validation_message(e)
+            if error is not None:
+                totals["failed"] += 1
+                yield {"event": "error", "line": line_no, "detail": error}
+                continue
+
+            if len(chunk) >= IMPORT_CHUNK_SIZE:
+                flush(chunk)
+                chunk = []
+                yield {"event": "progress", **totals}
+
+        if chunk:
+            flush(chunk)
+        yield {"event": "done", **totals}
+    except Exception as e:
+        db.rollback()
+        yield {"event": "aborted", "detail": str(e), **totals}
+    finally:
+        db.close()
@@ -0,0 +1,260 @@
+"""
+    Product search (GET /products/search): type-ahead prefix matching and
+    fuzzy name matching, filtered by classification and stock status.
+
+    Prefix matches walk the lower(name) index in name order, so a keystroke
+    costs one short index range scan whatever the catalogue size. Fuzzy
+    matching is ranked by trigram similarity and runs on whichever index the
+    database offers:
+
+      trigram   Postgres: pg_trgm GiST index on lower(name), ranked by word similarity
+      fts5      SQLite: FTS5 trigram table over the names, kept in sync by triggers
+      ngram     anything else (or when the above can't be set up): an in-memory
+                trigram index per worker, kept in sync through the catalog
+                version like product_cache.py
+
+    On SQLite, fuzzy results are ranked among the first SEARCH_CANDIDATES
+    matches; the in-memory index filters its SEARCH_CANDIDATES best. Fuzzy
+    queries shorter than three characters are answered as prefix queries.
+    install() sets the index up on startup.
+"""
+import heapq
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import combinations
+
+from sqlalchemy import column, func, literal, select, table, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app import catalog_version, crud, fast_json, models
+from app.database import engine
+
+PRODUCT_SEARCH_BACKEND = os.getenv("PRODUCT_SEARCH_BACKEND", "auto")  # auto, trigram, fts5 or ngram
+SEARCH_CANDIDATES = int(os.getenv("SEARCH_CANDIDATES", 200))  # fts5 / ngram matches ranked per query
+NGRAM_SYNC = float(os.getenv("NGRAM_SYNC", 1.0))  # seconds between catalog version checks
+NGRAM_THRESHOLD = 0.3  # share of the query's trigrams a name must contain (pg_trgm's default)
+BACKENDS = ("trigram", "fts5", "ngram")
+MODES = ("prefix", "fuzzy")
+STATUSES = ("High", "Warning", "Low")
+
+# Names go in padded with spaces, so word starts and ends make trigrams of their own (as in pg_trgm)
+FTS_NAME = "' ' || coalesce({row}.name, '') || ' '"
+FTS_TRIGGERS = {
+    "products_fts_ai": "AFTER INSERT ON products BEGIN "
+                       f"INSERT INTO products_fts(rowid, name) VALUES (new.id, {FTS_NAME.format(row='new')}); END",
+    "products_fts_ad": "AFTER DELETE ON products BEGIN "
+                       "INSERT INTO products_fts(products_fts, rowid, name) "
+                       f"VALUES ('delete', old.id, {FTS_NAME.format(row='old')}); END",
+    "products_fts_au": "AFTER UPDATE OF name ON products BEGIN "
+                       "INSERT INTO products_fts(products_fts, rowid, name) "
+                       f"VALUES ('delete', old.id, {FTS_NAME.format(row='old')}); "
+                       f"INSERT INTO products_fts(rowid, name) VALUES (new.id, {FTS_NAME.format(row='new')}); END",
+}
+
+_backend = None
+
+
+# ---------- Setup ----------
+def install(bind=engine) -> str:
+    """Create the search index for this database; returns the backend in use"""
+    global _backend
+    if PRODUCT_SEARCH_BACKEND not in ("auto", *BACKENDS):
+        raise ValueError(f"Unknown PRODUCT_SEARCH_BACKEND '{PRODUCT_SEARCH_BACKEND}', choose from {['auto', *BACKENDS]}")
+    dialect = bind.dialect.name
+    backend = "ngram"
+    try:
+        if PRODUCT_SEARCH_BACKEND in ("auto", "trigram") and dialect == "postgresql":
+            with bind.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_products_name_trgm ON products USING gist (lower(name) gist_trgm_ops)"
+                ))
+            backend = "trigram"
+        elif PRODUCT_SEARCH_BACKEND in ("auto", "fts5") and dialect == "sqlite":
+            _install_fts5(bind)
+            backend = "fts5"
+    except DBAPIError as e:
+        print(f"Product search: no {dialect} text index ({e.orig}), using the in-memory index")
+    if PRODUCT_SEARCH_BACKEND not in ("auto", backend):
+        print(f"Product search: PRODUCT_SEARCH_BACKEND={PRODUCT_SEARCH_BACKEND} isn't available on {dialect}, using {backend}")
+    _backend = backend
+    return backend
+
+
+def _install_fts5(bind):
+    with bind.begin() as conn:
+        existing = set(conn.execute(
+            text("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'products'")
+        ).scalars())
+        if set(FTS_TRIGGERS) <= existing:
+            return
+        # First run, or products was dropped and recreated (benchmark seeding). Contentless:
+        # the padded names only exist in the index
+        conn.execute(text("CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(name, content='', tokenize='trigram')"))
+        for name, body in FTS_TRIGGERS.items():
+            conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+        conn.execute(text("INSERT INTO products_fts(products_fts) VALUES ('delete-all')"))
+        conn.execute(text(f"INSERT INTO products_fts(rowid, name) SELECT id, {FTS_NAME.format(row='products')} FROM products"))
+
+
+def backend() -> str:
+    return _backend or install()
+
+
+# ---------- Search ----------
+def search(
+    db: Session,
+    q: str,
+    mode: str = "prefix",
+    classification: str | None = None,
+    status: str | None = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> list[dict]:
+    """ProductOut-shaped dicts, best match first (prefix: in name order)"""
+    q = " ".join(q.lower().split())
+    p = models.ProductDB
+    query = crud.product_rows_query()
+    if classification is not None:
+        query = query.where(p.classification == classification)
+    if status is not None:
+        query = query.where(p.status == status)
+
+    if mode == "prefix" or len(q) < 3:
+        name = func.lower(p.name)
+        query = query.where(name >= q, name < q + "\U0010ffff", name.startswith(q, autoescape=True))
+        return fast_json.rows(db.execute(query.order_by(name, p.id).limit(limit).offset(offset)))
+
+    used = backend()
+    candidates = max(SEARCH_CANDIDATES, offset + limit)
+    if used == "trigram":
+        name, pattern = func.lower(p.name), literal(q)
+        query = query.where(pattern.op("<%")(name)).order_by(pattern.op("<<->")(name), p.id)
+        return fast_json.rows(db.execute(query.limit(limit).offset(offset)))
+    if used == "fts5":
+        # Ranking every match (ORDER BY rank) is too slow when a common word matches a large
+        # part of the catalogue, so take up to `candidates` matches unordered and rank them
+        # here: names with all the words first, then names with any of them
+        fts = table("products_fts", column("rowid"))
+        words = [_fts_word(word) for word in q.split()]
+        rows, seen = [], set()
+        for match in (" AND ".join(words), " OR ".join(words)):
+            if len(rows) >= offset + limit or (len(words) == 1 and rows):
+                break
+            found = db.execute(
+                query.join(fts, fts.c.rowid == p.id)
+                .where(text("products_fts MATCH :match").bindparams(match=match))
+                .limit(candidates)
+            )
+            rows.extend(row for row in fast_json.rows(found) if row["id"] not in seen and not seen.add(row["id"]))
+        return _rank(q, rows)[offset:offset + limit]
+
+    ranked = ngram_index.match(db, q, candidates)
+    if not ranked:
+        return []
+    position = {product_id: i for i, product_id in enumerate(ranked)}
+    rows = fast_json.rows(db.execute(query.where(p.id.in_(ranked))))
+    rows.sort(key=lambda row: position[row["id"]])
+    return rows[offset:offset + limit]
+
+
+def _fts_word(word: str) -> str:
+    """FTS5 query for names containing something like `word`: two of the space-padded word's
+    trigrams, so a typo still leaves a matching pair (any two for short words, neighbours otherwise)"""
+    padded = f" {word} "
+    grams = ['"' + padded[i:i + 3].replace('"', '""') + '"' for i in range(len(padded) - 2)]
+    pairs = combinations(grams, 2) if len(grams) <= 6 else zip(grams, grams[1:])
+    return "(" + " OR ".join([f"({a} AND {b})" for a, b in pairs] or grams) + ")"
+
+
+def _rank(q: str, rows: list[dict]) -> list[dict]:
+    """Most of the query's trigrams first, then shorter names"""
+    wanted = trigrams(q)
+    return sorted(rows, key=lambda row: (-len(wanted & trigrams(row["name"] or "")), len(row["name"] or ""), row["id"]))
+
+
+def trigrams(name: str) -> set[str]:
+    """pg_trgm-style trigrams: each word padded with two spaces in front and one behind"""
+    grams = set()
+    for word in name.lower().split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+# ---------- In-memory fallback ----------
+class NgramIndex:
+    """Trigram -> product ids, loaded on the first fuzzy query and then kept current by catalog version."""
+
+    def __init__(self, sync_interval: float = NGRAM_SYNC):
+        self.sync_interval = sync_interval
+        self._postings: dict[str, set[int]] = defaultdict(set)
+        self._grams: dict[int, frozenset[str]] = {}
+        self._lock = threading.Lock()
+        self._version = None
+        self._synced_at = 0.0
+
+    def _set(self, product_id: int, name: str | None):
+        self._drop(product_id)
+        grams = frozenset(trigrams(name or ""))
+        self._grams[product_id] = grams
+        for gram in grams:
+            self._postings[gram].add(product_id)
+
+    def _drop(self, product_id: int):
+        for gram in self._grams.pop(product_id, ()):
+            ids = self._postings[gram]
+            ids.discard(product_id)
+            if not ids:
+                del self._postings[gram]
+
+    def sync(self, db: Session):
+        """Load everything the first time, afterwards only products changed or deleted since the last sync"""
+        with self._lock:
+            now = time.monotonic()
+            if self._version is not None and now - self._synced_at < self.sync_interval:
+                return
+            self._synced_at = now
+            version = catalog_version.read_version(db)
+            if self._version is not None and version <= self._version:
+                return
+
+            products, tombstones = models.ProductDB, models.ProductTombstone
+            changed = select(products.id, products.name)
+            if self._version is not None:
+                changed = changed.where(products.version > self._version)
+                deleted = db.execute(
+                    select(tombstones.product_id).where(tombstones.version > self._version)
+                ).scalars().all()
+                for product_id in deleted:  # before the changes: SQLite may reuse a deleted product's id
+                    self._drop(product_id)
+            for product_id, name in db.execute(changed.execution_options(yield_per=10000)):
+                self._set(product_id, name)
+            self._version = version
+
+    def match(self, db: Session, q: str, limit: int) -> list[int]:
+        """Ids of the `limit` names sharing the largest share of the query's trigrams"""
+        self.sync(db)
+        grams = trigrams(q)
+        if not grams:
+            return []
+        hits = Counter()
+        with self._lock:
+            for gram in grams:
+                hits.update(self._postings.get(gram, ()))
+            sizes = {product_id: len(self._grams[product_id]) for product_id in hits}
+        needed = NGRAM_THRESHOLD * len(grams)
+        best = heapq.nsmallest(
+            limit,
+            ((-count, sizes[product_id], product_id) for product_id, count in hits.items() if count >= needed),
+        )
+        return [product_id for _, _, product_id in best]
+
+    def size(self) -> int:
+        return len(self._grams)
+
+
+ngram_index = NgramIndex()
@@ -0,0 +1,98 @@
+"""
+    Stand-in replication for trying read replicas on SQLite.
+
+    Copies the primary database file over each replica file every `interval`
+    seconds with SQLite's online backup API, so replicas lag the primary by up
+    to that long, like an asynchronous streaming replica would. Run it next to
+    the app, pointed at the same DATABASE_URL / READ_REPLICA_URLS:
+
+        python -m app.replica_sync --interval 1
+
+    Postgres replicas replicate on their own (see commands.txt).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from sqlalchemy import make_url
+
+REPLICA_SYNC_INTERVAL = float(os.getenv("REPLICA_SYNC_INTERVAL", 1.0))
+
+
+def sqlite_path(url: str) -> str:
+    url = make_url(url)
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        raise ValueError(f"{url.render_as_string(hide_password=True)} isn't an SQLite database file")
+    return url.database
+
+
+def copy_database(source: str, target: str):
+    """Bring the SQLite file `target` up to date with `source` (readers of `target` keep working)"""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    try:
+        src.backup(dst)
+    finally:
+        src.close()
+        dst.close()
+
+
+class SqliteReplicator:
+    """Copies the primary over the replicas every `interval` seconds"""
+
+    def __init__(self, primary_url: str, replica_urls: list[str], interval: float = REPLICA_SYNC_INTERVAL):
+        self.primary = sqlite_path(primary_url)
+        self.replicas = [sqlite_path(url) for url in replica_urls]
+        self.interval = interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def sync(self):
+        for replica in self.replicas:
+            copy_database(self.primary, replica)
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="replica-sync", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.sync()
+            except sqlite3.Error as e:
+                print(f"Replica sync failed: {e}")
+            self._stopping.wait(self.interval)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.database import DATABASE_URL, READ_REPLICA_URLS
+
+    parser = argparse.ArgumentParser(description="Copy the SQLite primary over its read replicas")
+    parser.add_argument("--interval", type=float, default=REPLICA_SYNC_INTERVAL, help="seconds between copies")
+    parser.add_argument("--once", action="store_true", help="copy once and exit")
+    args = parser.parse_args()
+
+    if not READ_REPLICA_URLS:
+        parser.error("READ_REPLICA_URLS is not set")
+    replicator = SqliteReplicator(DATABASE_URL, READ_REPLICA_URLS, args.interval)
+    if args.once:
+        replicator.sync()
+    else:
+        print(f"Copying {replicator.primary} to {', '.join(replicator.replicas)} every {args.interval:g}s")
+        try:
+            while True:
+                start = time.perf_counter()
+                replicator.sync()
+                time.sleep(max(args.interval - (time.perf_counter() - start), 0))
+        except KeyboardInterrupt:
+            pass
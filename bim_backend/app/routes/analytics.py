@@ -0,0 +1,65 @@
+"""
+    Consumption analytics, answered from the daily rollups (see scan_rollups.py).
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from datetime import date
+from app import schemas, crud, scan_rollups
+from app.database import get_db
+
+router = APIRouter(prefix="/analytics", tags=["analytics"])
+
+MAX_RANGE_DAYS = 3660
+MAX_TOP_MOVERS = 500
+
+def _range(date_from: Optional[date], date_to: Optional[date]) -> tuple[date, date]:
+    date_from, date_to = scan_rollups.day_range(date_from, date_to)
+    if date_from > date_to:
+        raise HTTPException(status_code=400, detail="date_from must not be after date_to")
+    if (date_to - date_from).days >= MAX_RANGE_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range must be under {MAX_RANGE_DAYS} days")
+    return date_from, date_to
+
+@router.get("/products/{barcode_value}/usage", response_model=schemas.ProductUsage)
+def product_usage(
+    barcode_value: str,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(get_db),
+):
+    """Units out and scans per day for one product (default: last 30 days, days without scans are 0)"""
+    product = crud.get_product_by_barcode(db, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    date_from, date_to = _range(date_from, date_to)
+    return schemas.ProductUsage(
+        product_id=product.id,
+        barcode=product.barcode,
+        name=product.name,
+        series=scan_rollups.usage_series(db, product.id, date_from, date_to),
+    )
+
+@router.get("/top-movers", response_model=List[schemas.TopMover])
+def top_movers(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    classification: Optional[str] = None,
+    limit: int = 20,
+    db: Session = Depends(get_db),
+):
+    """Products with the most units out in the range, optionally within one classification"""
+    if not 0 < limit <= MAX_TOP_MOVERS:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_TOP_MOVERS}")
+    date_from, date_to = _range(date_from, date_to)
+    return scan_rollups.top_movers(db, date_from, date_to, classification, limit)
+
+@router.get("/classifications", response_model=List[schemas.ClassificationConsumption])
+def consumption_by_classification(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    db: Session = Depends(get_db),
+):
+    """Units out and scans per classification in the range"""
+    date_from, date_to = _range(date_from, date_to)
+    return scan_rollups.by_classification(db, date_from, date_to)
@@ -0,0 +1,40 @@
+"""
+    Async versions of the /email routes (ASYNC_MODE), registered ahead of email.py.
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import schemas, async_crud
+from app.database import get_async_db
+
+router = APIRouter(prefix="/email", tags=["email"])
+
+@router.post("/", response_model=schemas.EmailSettingsOut)
+async def add_email(email: schemas.EmailSettingsCreate, db: AsyncSession = Depends(get_async_db)):
+    """Add a new email recipient"""
+    return await async_crud.add_email(db, email)
+
+@router.get("/", response_model=list[schemas.EmailSettingsOut])
+async def get_all_emails(db: AsyncSession = Depends(get_async_db)):
+    """Retrieve all email recipients"""
+    return await async_crud.get_all_emails(db)
+
+@router.put("/{email_id}", response_model=schemas.EmailSettingsOut)
+async def update_email(email_id: int, email: schemas.EmailSettingsCreate, db: AsyncSession = Depends(get_async_db)):
+    """Update a specific email recipient by ID"""
+    db_email = await db.get(async_crud.models.EmailSettingsDB, email_id)
+    if not db_email:
+        raise HTTPException(status_code=404, detail="Email not found")
+    db_email.email = email.email
+    await db.commit()
+    await db.refresh(db_email)
+    return db_email
+
+@router.delete("/{email_id}")
+async def delete_email(email_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Delete a specific email recipient by ID"""
+    db_email = await db.get(async_crud.models.EmailSettingsDB, email_id)
+    if not db_email:
+        raise HTTPException(status_code=404, detail="Email not found")
+    await db.delete(db_email)
+    await db.commit()
+    return {"message": "Email deleted successfully"}
@@ -0,0 +1,110 @@
+"""
+    Async versions of the hot /products routes, registered ahead of the sync
+    router when ASYNC_MODE is on. Everything else falls through to products.py.
+"""
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from app import schemas, async_crud
+from app.database import get_async_db
+from app.product_cache import product_cache
+from app.routes.products import MAX_SCAN_BATCH, _cached_product, _low_stock, _reject_scan, _search, _with_status
+
+router = APIRouter(prefix="/products", tags=["products"])
+
+# Must be registered before /scan/{barcode_value}
+@router.post("/scan/batch", response_model=list[schemas.ScanBatchResult])
+async def scan_batch(scans: list[schemas.ScanBatchItem], db: AsyncSession = Depends(get_async_db)):
+    """Apply a queue of offline scans in one transaction, returning a result per scan"""
+    if len(scans) > MAX_SCAN_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SCAN_BATCH} scans per batch")
+    if not scans:
+        return []
+
+    applied = await async_crud.apply_scan_batch(db, scans)
+    if applied is None:
+        raise HTTPException(status_code=409, detail="Stock changed while applying batch, please retry")
+    results, touched = applied
+    product_cache.invalidate(*(p.barcode for p in touched))
+    return results
+
+@router.post("/scan/{barcode_value}", response_model=schemas.ProductOut)
+async def scan_product(barcode_value: str, scan: schemas.ProductScan, db: AsyncSession = Depends(get_async_db)):
+    """Decrement product quantity safely, prevent negative stock"""
+    if scan.decrement_by <= 0:
+        raise HTTPException(status_code=400, detail="Decrement must be greater than 0")
+
+    product = await async_crud.decrement_product_quantity(db, barcode_value, scan.decrement_by)
+    if not product:
+        await db.rollback()
+        await db.run_sync(_reject_scan, barcode_value, scan.decrement_by)
+    await async_crud.record_threshold_edges(db, [product.id])
+    out = _with_status(product)  # exact total for sharded products, see products.scan_product
+    await db.commit()
+    product_cache.invalidate(barcode_value)
+    return out
+
+@router.post("/scan/{barcode_value}/log", response_model=schemas.ScanLogOut)
+async def scan_product_with_log(barcode_value: str, scan: schemas.ScanSubmit, db: AsyncSession = Depends(get_async_db)):
+    """Decrement product quantity and save the scan log in one request/transaction"""
+    if scan.decrement_by <= 0:
+        raise HTTPException(status_code=400, detail="Decrement must be greater than 0")
+
+    db_log = await async_crud.scan_product_with_log(db, barcode_value, scan)
+    if not db_log:
+        await db.run_sync(_reject_scan, barcode_value, scan.decrement_by)
+    product_cache.invalidate(barcode_value)
+    return db_log
+
+@router.put("/{barcode_value}/quantity/{new_quantity}", response_model=schemas.ProductOut)
+async def update_quantity(barcode_value: str, new_quantity: int, db: AsyncSession = Depends(get_async_db)):
+    """Manually update quantity of a product (e.g. correction), trigger email if threshold crossed"""
+    product = await async_crud.get_product_by_barcode(db, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    product.quantity = new_quantity
+    await db.flush()
+    await async_crud.record_threshold_edges(db, [product.id])
+    await db.commit()
+    product_cache.invalidate(barcode_value)
+    await db.refresh(product)
+    return _with_status(product)
+
+# Must be registered before /{barcode_value}
+@router.get("/search", response_model=list[schemas.ProductOut])
+async def search_products(
+    q: str,
+    mode: str = "prefix",
+    classification: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Products whose name starts with `q` (type-ahead) or resembles it (mode=fuzzy), best match first"""
+    return await db.run_sync(_search, q, mode, classification, status, limit, offset)
+
+@router.get("/low-stock", response_model=list[schemas.ProductOut])
+async def low_stock_products(
+    request: Request,
+    classification: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Products at or below their threshold, furthest below first, read from the low-stock index"""
+    return await db.run_sync(_low_stock, request.headers.get("if-none-match", ""), classification, status, limit, offset)
+
+@router.get("/barcode/{barcode}")
+async def get_product_by_barcode(barcode: str, db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(_cached_product, barcode)
+
+@router.get("/{barcode_value}", response_model=schemas.ProductOut)
+async def get_product(barcode_value: str, db: AsyncSession = Depends(get_async_db)):
+    """Fetch a single product by barcode"""
+    product = await db.run_sync(_cached_product, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    return product
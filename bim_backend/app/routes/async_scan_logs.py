@@ -0,0 +1,100 @@
+"""
+    Async versions of the /scan_logs routes (ASYNC_MODE), registered ahead of scan_logs.py.
+"""
+import asyncio
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+from app import schemas, async_crud, fast_json, scan_log_archive
+from app.database import SessionLocal, get_async_db
+from app.fast_json import FastJSONResponse
+from app.routes.scan_logs import (
+    MAX_PAGE_SIZE, _decode_cursor, _encode_cursor, scan_log_response, scan_log_timed_out, submit_scan_log,
+)
+from app.scan_log_writer import SCAN_LOG_WAIT_TIMEOUT, scan_log_writer
+
+router = APIRouter(prefix="/scan_logs", tags=["scan_logs"])
+
+@router.post("/", response_model=schemas.ScanLogOut)
+async def create_scan_log(scan: schemas.ScanLogCreate, db: AsyncSession = Depends(get_async_db)):
+    product = await db.get(async_crud.models.ProductDB, scan.product_id)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    if scan_log_writer.running:
+        row = {
+            "purpose": scan.purpose,
+            "scanned_by": scan.scanned_by,
+            "product_id": scan.product_id,
+            "quantity": product.quantity,
+            "threshold": product.threshold,
+            "decremented_by": scan.decremented_by,
+            "classification": product.classification,
+            "scanned_at": datetime.now(),
+        }
+        await db.close()
+        # submit() may block on a full queue, so off the event loop
+        future = await asyncio.to_thread(submit_scan_log, row)
+        return scan_log_response(row, await wait_for_scan_log(future), product)
+    return await async_crud.create_scan_log(db, scan, product)
+
+async def wait_for_scan_log(future) -> int:
+    """wait_for_scan_log() of scan_logs.py without blocking the event loop"""
+    waiter = asyncio.wrap_future(future)
+    # asyncio.wait, not wait_for: a timeout must not cancel a row the writer may already be committing
+    done, _ = await asyncio.wait({waiter}, timeout=SCAN_LOG_WAIT_TIMEOUT)
+    if not done and future.cancel():
+        raise scan_log_timed_out()
+    done, _ = await asyncio.wait({waiter}, timeout=SCAN_LOG_WAIT_TIMEOUT)
+    if not done:
+        raise scan_log_timed_out()
+    return waiter.result()
+
+@router.get("/", response_model=List[schemas.ScanLogOut])
+async def read_scan_logs(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    order: str = "asc",
+    product_id: Optional[int] = None,
+    barcode: Optional[str] = None,
+    classification: Optional[str] = None,
+    scanned_by: Optional[str] = None,
+    purpose: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_archived: bool = False,
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Scan logs ordered by (scanned_at, id). Pass the X-Next-Cursor header back as `cursor` for the next page."""
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Order must be 'asc' or 'desc'")
+
+    query = dict(
+        limit=limit,
+        after=_decode_cursor(cursor) if cursor else None,
+        descending=order == "desc",
+        product_id=product_id,
+        barcode=barcode,
+        classification=classification,
+        scanned_by=scanned_by,
+        purpose=purpose,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    if include_archived:
+        # Archive files are read with blocking I/O, so this goes to a thread with a sync session
+        logs = await asyncio.to_thread(_get_scan_logs_with_archives, query)
+    else:
+        logs = await async_crud.get_scan_logs(db, **query)
+    headers = {"X-Next-Cursor": _encode_cursor(logs[-1])} if len(logs) == limit else None
+    return FastJSONResponse(fast_json.scan_log_dicts(logs), headers=headers)
+
+
+def _get_scan_logs_with_archives(query: dict) -> list:
+    db = SessionLocal()
+    try:
+        return scan_log_archive.get_scan_logs(db, **query)
+    finally:
+        db.close()
@@ -0,0 +1,99 @@
+"""
+    Change feed endpoints (see change_feed.py).
+
+    GET /changes/stream is Server-Sent Events: every event carries `id: <seq>`,
+    so browsers resume on their own through Last-Event-ID. WS /changes/ws sends
+    the same events as JSON messages. Both take `since` (resume after this
+    sequence) and `types` (comma-separated event types to receive).
+"""
+import asyncio
+import json
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from app import change_feed
+from app.change_feed import feed
+
+router = APIRouter(prefix="/changes", tags=["changes"])
+
+
+def _parse_types(types: str | None) -> set[str] | None:
+    if not types:
+        return None
+    wanted = {t.strip() for t in types.split(",") if t.strip()}
+    unknown = wanted - set(change_feed.EVENT_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown event types {sorted(unknown)}; choose from {list(change_feed.EVENT_TYPES)}")
+    return wanted
+
+
+@router.get("/")
+def change_feed_status():
+    """Latest sequence number and number of subscribers on this worker"""
+    return {"latest": feed.broker.latest(), "subscribers": feed.subscribers(), "types": list(change_feed.EVENT_TYPES)}
+
+
+@router.get("/stream")
+async def stream_changes(
+    since: Optional[int] = None,
+    types: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+):
+    """Server-Sent Events stream of inventory changes"""
+    try:
+        wanted = _parse_types(types)
+        if since is None and last_event_id:
+            since = int(last_event_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    async def events():
+        yield b"retry: 3000\n\n"
+        async for item in feed.events(since, wanted):
+            if item is None:
+                yield b": keepalive\n\n"
+            else:
+                yield f"id: {item['seq']}\nevent: {item['type']}\ndata: {json.dumps(item, default=str)}\n\n".encode()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/ws")
+async def websocket_changes(websocket: WebSocket, since: Optional[int] = None, types: Optional[str] = Query(None)):
+    """Inventory changes as JSON messages; heartbeats are {"type": "heartbeat", "seq": <latest>}"""
+    await websocket.accept()
+    try:
+        wanted = _parse_types(types)
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e)[:120])
+        return
+
+    async def send():
+        async for item in feed.events(since, wanted):
+            if item is None:
+                item = {"type": "heartbeat", "seq": await asyncio.to_thread(feed.broker.latest)}
+            await websocket.send_text(json.dumps(item, default=str))
+        await websocket.close(code=1013, reason="Too far behind, reconnect with since=<last seq>")
+
+    async def receive():
+        # Nothing is expected from the client; this only notices the disconnect
+        try:
+            while True:
+                await websocket.receive_text()
+        except WebSocketDisconnect:
+            pass
+
+    sender, receiver = asyncio.create_task(send()), asyncio.create_task(receive())
+    done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(*pending, return_exceptions=True)
+    for task in done:
+        if task.exception() is not None and not isinstance(task.exception(), WebSocketDisconnect):
+            print(f"Change feed websocket failed: {task.exception()}")
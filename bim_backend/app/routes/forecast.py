@@ -0,0 +1,63 @@
+"""
+    Stock-out forecasts and reorder suggestions (see forecasting.py).
+"""
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from typing import List, Optional
+from app import schemas, models, forecasting
+from app.database import get_db
+
+router = APIRouter(prefix="/forecast", tags=["forecast"])
+
+MAX_PAGE_SIZE = 1000
+
+def _require_numpy():
+    if not forecasting.available():
+        raise HTTPException(status_code=400, detail="Forecasting requires numpy to be installed")
+
+def _forecast_query():
+    products, forecasts = models.ProductDB, models.ProductForecast
+    return select(
+        forecasts.product_id, products.barcode, products.name, products.classification,
+        products.quantity, products.threshold, products.quantity_to_order,
+        forecasts.daily_rate, forecasts.daily_std, forecasts.days_until_stockout, forecasts.stockout_date,
+        forecasts.suggested_threshold, forecasts.suggested_quantity_to_order, forecasts.computed_at,
+    ).join(products, products.id == forecasts.product_id)
+
+@router.get("/", response_model=List[schemas.ProductForecastOut])
+def list_forecasts(
+    within_days: Optional[float] = None,
+    classification: Optional[str] = None,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+):
+    """Products that will run out soonest first; `within_days` keeps only those running out within that many days"""
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+    forecasts = models.ProductForecast
+    stmt = (
+        _forecast_query()
+        .where(forecasts.days_until_stockout.is_not(None))
+        .order_by(forecasts.days_until_stockout, forecasts.product_id)
+        .limit(limit)
+    )
+    if within_days is not None:
+        stmt = stmt.where(forecasts.days_until_stockout <= within_days)
+    if classification is not None:
+        stmt = stmt.where(models.ProductDB.classification == classification)
+    return db.execute(stmt).mappings().all()
+
+@router.post("/run", response_model=schemas.ForecastRun)
+def run_forecast():
+    """Recompute forecasts for every product now (the scheduled job does this every FORECAST_INTERVAL)"""
+    _require_numpy()
+    return forecasting.run()
+
+@router.get("/{barcode_value}", response_model=schemas.ProductForecastOut)
+def get_forecast(barcode_value: str, db: Session = Depends(get_db)):
+    """Forecast for one product"""
+    forecast = db.execute(_forecast_query().where(models.ProductDB.barcode == barcode_value)).mappings().first()
+    if not forecast:
+        raise HTTPException(status_code=404, detail="No forecast for this product yet")
+    return forecast
@@ -0,0 +1,11 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from app import metrics
+
+router = APIRouter(tags=["metrics"])
+
+# Prometheus scrape endpoint
+@router.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Request latency, SQL and connection pool metrics of this worker (Prometheus text format)"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -1,53 +1,191 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Request, UploadFile, File
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from app import schemas, crud, models, email_service
-from app.database import get_db
-import uuid, os, barcode
-from barcode.writer import ImageWriter
-import random
-from fastapi.responses import JSONResponse
+from app import schemas, crud, models, barcode_images, fast_json, label_sheets, product_import, product_search, catalog_version, scan_rollups, stock_ledger
+from app.barcode_images import BARCODE_DIR
+from app.barcode_allocator import allocator
+from app.product_cache import product_cache
+from app.database import get_db, on_replica
+from app.fast_json import FastJSONResponse
+import uuid, os
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from typing import Optional
+import json
 
 router = APIRouter(prefix="/products", tags=["products"])
 
-BARCODE_DIR = "barcodes"
-os.makedirs(BARCODE_DIR, exist_ok=True)
+MAX_SCAN_BATCH = 1000
+MAX_SEARCH_LIMIT = 100
+MAX_LOW_STOCK_LIMIT = 1000
+LOW_STOCK_STATUSES = ("Warning", "Low")
 
 @router.post("/", response_model=schemas.ProductOut)
 def create_product(product: schemas.ProductCreate, db: Session = Depends(get_db)):
-    """Generate a unique numeric barcode for a new product and save it to DB"""
-    
+    """Allocate a unique barcode for a new product and save it to DB"""
+
+    # Allocated values never collide with each other; retrying only matters if
+    # one happens to hit a legacy randomly generated barcode.
     MAX_ATTEMPTS = 10
     for _ in range(MAX_ATTEMPTS):
-        barcode_value = str(random.randint(10000000, 99999999))  # 8-digit
-        # Check if barcode already exists
-        existing = db.query(models.ProductDB).filter(models.ProductDB.barcode == barcode_value).first()
-        if not existing:
+        barcode_value = allocator.allocate()
+        file_path = os.path.join(BARCODE_DIR, f"{barcode_value}")
+        try:
+            db_product = crud.create_product(db, product, barcode_value, file_path)
             break
+        except IntegrityError:
+            db.rollback()
     else:
         raise HTTPException(status_code=500, detail="Failed to generate unique barcode")
 
-    # Save barcode image
-    file_path = os.path.join(BARCODE_DIR, f"{barcode_value}")
-    code128 = barcode.get("code128", barcode_value, writer=ImageWriter())
-    code128.save(file_path)
-
+    # Barcode image is rendered in the background; see GET /products/{barcode}/image
     print(f"Barcode Value: {barcode_value}")
-    db_product = crud.create_product(db, product, barcode_value, file_path)
+    barcode_images.prerender(barcode_value)
     return _with_status(db_product)
 
+@router.post("/import")
+def import_products(file: UploadFile = File(...), format: str | None = None):
+    """Bulk-create products from a CSV or NDJSON upload, streaming progress as NDJSON"""
+    fmt = format or product_import.detect_format(file.filename, file.content_type)
+    if fmt not in product_import.FORMATS:
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'ndjson'")
+
+    def events():
+        for event in product_import.import_products(file.file, fmt):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+@router.post("/labels")
+def print_labels(sheet: schemas.LabelSheetRequest, db: Session = Depends(get_db)):
+    """Label sheets for the given barcodes or filters, streamed as a multi-page PDF or a ZIP of PNG pages"""
+    if sheet.layout not in label_sheets.LAYOUTS:
+        raise HTTPException(status_code=400, detail=f"Unknown layout '{sheet.layout}', choose from {list(label_sheets.LAYOUTS)}")
+    if sheet.format not in label_sheets.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {list(label_sheets.FORMATS)}")
+    if not label_sheets.MIN_DPI <= sheet.dpi <= label_sheets.MAX_DPI:
+        raise HTTPException(status_code=400, detail=f"DPI must be between {label_sheets.MIN_DPI} and {label_sheets.MAX_DPI}")
+    if sheet.status is not None and sheet.status not in product_search.STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of {list(product_search.STATUSES)}")
+    if sheet.copies < 1:
+        raise HTTPException(status_code=400, detail="Copies must be at least 1")
+
+    products = crud.get_label_products(db, sheet.barcodes, sheet.classification, sheet.status, sheet.low_stock)
+    if sheet.barcodes is not None and len(products) < len(sheet.barcodes):
+        found = {barcode for barcode, _ in products}
+        missing = [barcode for barcode in sheet.barcodes if barcode not in found]
+        raise HTTPException(status_code=404, detail=f"Products not found (or filtered out): {missing[:20]}")
+    if not products:
+        raise HTTPException(status_code=404, detail="No products to print")
+    labels = [label for label in products for _ in range(sheet.copies)]
+    if len(labels) > label_sheets.MAX_LABELS:
+        raise HTTPException(status_code=400, detail=f"At most {label_sheets.MAX_LABELS} labels per request, asked for {len(labels)}")
+    db.close()  # the pages take a while; don't hold a connection
+
+    media_type, extension = label_sheets.FORMATS[sheet.format]
+    return StreamingResponse(
+        label_sheets.render_sheets(labels, sheet.layout, sheet.format, sheet.dpi),
+        media_type=media_type,
+        headers={
+            "Content-Disposition": f'attachment; filename="labels.{extension}"',
+            "X-Label-Count": str(len(labels)),
+            "X-Page-Count": str(label_sheets.page_count(len(labels), sheet.layout)),
+        },
+    )
+
+@router.get("/{barcode_value}/image")
+def get_barcode_image(
+    barcode_value: str,
+    request: Request,
+    format: str = "png",
+    dpi: int = barcode_images.DEFAULT_DPI,
+    db: Session = Depends(get_db),
+):
+    """Serve the barcode image (PNG or SVG), rendered on demand and cached"""
+    if format not in barcode_images.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Format must be 'png' or 'svg'")
+    if not barcode_images.MIN_DPI <= dpi <= barcode_images.MAX_DPI:
+        raise HTTPException(
+            status_code=400,
+            detail=f"DPI must be between {barcode_images.MIN_DPI} and {barcode_images.MAX_DPI}"
+        )
+
+    # ETag only depends on the render inputs, so revalidation skips the DB and the renderer
+    etag = barcode_images.etag(barcode_value, format, dpi)
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=86400"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    if not _cached_product(db, barcode_value):
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    data = barcode_images.get_image(barcode_value, format, dpi)
+    return Response(content=data, media_type=barcode_images.MEDIA_TYPES[format], headers=headers)
+
+@router.get("/cache/stats")
+def product_cache_stats():
+    """Hit/miss/eviction counters of the barcode lookup cache"""
+    return product_cache.stats()
+
+# Must be registered before /{barcode_value}
+@router.get("/search", response_model=list[schemas.ProductOut])
+def search_products(
+    q: str,
+    mode: str = "prefix",
+    classification: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 20,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+):
+    """Products whose name starts with `q` (type-ahead) or resembles it (mode=fuzzy), best match first.
+    Pass the X-Next-Offset header back as `offset` for the next page."""
+    return _search(db, q, mode, classification, status, limit, offset)
+
+# Must be registered before /{barcode_value}
+@router.get("/low-stock", response_model=list[schemas.ProductOut])
+def low_stock_products(
+    request: Request,
+    classification: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: int = 100,
+    offset: int = 0,
+    db: Session = Depends(get_db),
+):
+    """Products at or below their threshold, furthest below first, read from the low-stock index.
+    Poll with If-None-Match: 304 until the catalogue changes. X-Low-Stock-Count has the total."""
+    return _low_stock(db, request.headers.get("if-none-match", ""), classification, status, limit, offset)
+
 @router.get("/{barcode_value}", response_model=schemas.ProductOut)
 def get_product(barcode_value: str, db: Session = Depends(get_db)):
     """Fetch a single product by barcode"""
-    product = crud.get_product_by_barcode(db, barcode_value)
+    product = _cached_product(db, barcode_value)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    return _with_status(product)
+    return product
 
-@router.get("/", response_model=list[schemas.ProductOut])
-def list_products(db: Session = Depends(get_db)):
-    """List all products with status (High/Warning/Low)"""
-    products = crud.get_products(db)
-    return [_with_status(p) for p in products]
+@router.get("/")
+def list_products(request: Request, since: Optional[int] = None, db: Session = Depends(get_db)):
+    """List all products with status (High/Warning/Low), or only changes after `since`"""
+    if since is not None:
+        # Read the version first: everything up to it is guaranteed to be in the delta
+        version = catalog_version.read_version(db)
+        return FastJSONResponse({
+            "version": version,
+            "changed": crud.get_product_rows(db, since),
+            "deleted": [t.barcode for t in crud.get_tombstones_since(db, since)],
+        })
+
+    # A replica may not have caught up with the version this worker remembers; go by its own
+    version = catalog_version.read_version(db) if on_replica(db) else catalog_version.current_version(db)
+    headers = {"ETag": catalog_version.etag(version), "X-Catalog-Version": str(version)}
+    if headers["ETag"] in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    body = catalog_version.cached_list(version)
+    if body is None:
+        body = fast_json.dumps(crud.get_product_rows(db))
+        catalog_version.cache_list(version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
 
 @router.put("/{barcode_value}", response_model=schemas.ProductOut)
 def update_product(
@@ -62,7 +200,10 @@ def update_product(
 
     product.name = product_update.name
     product.threshold = product_update.threshold
+    db.flush()
+    crud.record_threshold_edges(db, [product.id])
     db.commit()
+    product_cache.invalidate(barcode_value)
     db.refresh(product)
     return _with_status(product)
 
@@ -81,7 +222,10 @@ def patch_product(
     for key, value in update_data.items():
         setattr(product, key, value)
 
+    db.flush()
+    crud.record_threshold_edges(db, [product.id])
     db.commit()
+    product_cache.invalidate(barcode_value, product.barcode)
     db.refresh(product)
     return _with_status(product)
 
@@ -92,32 +236,14 @@ def delete_product(barcode_value: str, db: Session = Depends(get_db)):
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
 
-    # # Delete the barcode file
-    # if product.barcode_file:
-    #     file_path = os.path.normpath(product.barcode_file)  # normalize path for OS
-    #     if os.path.isfile(file_path):
-    #         try:
-    #             os.remove(file_path)
-    #         except Exception as e:
-    #             print(f"Failed to delete file {file_path}: {e}")
-
-    # Delete PNG file if exists
-    if product.barcode_file:
-        # Normalize the path to handle single backslashes
-        normalized_path = os.path.normpath(product.barcode_file)
-        print(f"Normalized Path: {normalized_path}")
-        file_path = f"{os.path.join(os.getcwd(), normalized_path)}.png"
-        print(f"File path: {file_path}")
-
-        if os.path.isfile(file_path):
-            try:
-                os.remove(file_path)
-                print(f"Deleted barcode file: {file_path}")
-            except Exception as e:
-                pass
+    # Delete rendered barcode images (PNG/SVG, every DPI) and their cache entries
+    barcode_images.discard(product.barcode)
 
+    scan_rollups.discard_product(db, product.id)
+    stock_ledger.discard_product(db, product.id)
     db.delete(product)
     db.commit()
+    product_cache.invalidate(barcode_value)
     return {"message": f"Product '{barcode_value}' deleted successfully"}
 
 # @router.post("/scan/{barcode_value}", response_model=schemas.ProductOut)
@@ -146,11 +272,29 @@ def delete_product(barcode_value: str, db: Session = Depends(get_db)):
 
 #     return _with_status(product)
 
+# Must be registered before /scan/{barcode_value}
+@router.post("/scan/batch", response_model=list[schemas.ScanBatchResult])
+def scan_batch(
+    scans: list[schemas.ScanBatchItem],
+    db: Session = Depends(get_db),
+):
+    """Apply a queue of offline scans in one transaction, returning a result per scan"""
+    if len(scans) > MAX_SCAN_BATCH:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_SCAN_BATCH} scans per batch")
+    if not scans:
+        return []
+
+    applied = crud.apply_scan_batch(db, scans)
+    if applied is None:
+        raise HTTPException(status_code=409, detail="Stock changed while applying batch, please retry")
+    results, touched = applied
+    product_cache.invalidate(*(p.barcode for p in touched))
+    return results
+
 @router.post("/scan/{barcode_value}", response_model=schemas.ProductOut)
 def scan_product(
     barcode_value: str,
     scan: schemas.ProductScan,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     """Decrement product quantity safely, prevent negative stock"""
@@ -158,44 +302,43 @@ def scan_product(
     if scan.decrement_by <= 0:
         raise HTTPException(status_code=400, detail="Decrement must be greater than 0")
 
-    product = crud.get_product_by_barcode(db, barcode_value)
+    # 🚨 Conditional UPDATE: only subtracts if enough stock is left
+    product = crud.decrement_product_quantity(db, barcode_value, scan.decrement_by)
     if not product:
-        raise HTTPException(status_code=404, detail="Product not found")
+        db.rollback()
+        _reject_scan(db, barcode_value, scan.decrement_by)
+    # Threshold email (queued in the outbox, sent by alert_dispatcher)
+    crud.record_threshold_edges(db, [product.id])
+    # Built before the commit: for a sharded product only this session knows the exact total
+    out = _with_status(product)
+    db.commit()
+    product_cache.invalidate(barcode_value)
 
-    # 🚨 Prevent subtracting more than available
-    if scan.decrement_by > product.quantity:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Cannot subtract {scan.decrement_by}. Only {product.quantity} left."
-        )
+    return out
 
-    # Safe subtraction
-    product.quantity -= scan.decrement_by
-    db.commit()
-    db.refresh(product)
+@router.post("/scan/{barcode_value}/log", response_model=schemas.ScanLogOut)
+def scan_product_with_log(
+    barcode_value: str,
+    scan: schemas.ScanSubmit,
+    db: Session = Depends(get_db),
+):
+    """Decrement product quantity and save the scan log in one request/transaction"""
 
-    # Threshold email
-    if product.quantity <= product.threshold:
-        recipients = email_service.get_admin_emails(db)
-        for recipient in recipients:
-            background_tasks.add_task(
-                email_service.send_threshold_email,
-                recipient,
-                product.name,
-                product.quantity,
-                product.threshold,
-                product.quantity_to_order
-            )
+    if scan.decrement_by <= 0:
+        raise HTTPException(status_code=400, detail="Decrement must be greater than 0")
 
-    return _with_status(product)
+    db_log = crud.scan_product_with_log(db, barcode_value, scan)
+    if not db_log:
+        _reject_scan(db, barcode_value, scan.decrement_by)
+    product_cache.invalidate(barcode_value)
 
+    return db_log
 
 
 @router.put("/{barcode_value}/quantity/{new_quantity}", response_model=schemas.ProductOut)
 def update_quantity(
     barcode_value: str,
     new_quantity: int,
-    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
 ):
     """Manually update quantity of a product (e.g. correction), trigger email if threshold crossed"""
@@ -204,34 +347,129 @@ def update_quantity(
         raise HTTPException(status_code=404, detail="Product not found")
 
     product.quantity = new_quantity
+    db.flush()
+    # Email alert if threshold crossed
+    crud.record_threshold_edges(db, [product.id])
     db.commit()
+    product_cache.invalidate(barcode_value)
     db.refresh(product)
 
-    # Email alert if threshold crossed
-    if product.quantity <= product.threshold:
-        recipients = email_service.get_admin_emails(db)
-        for recipient in recipients:
-            background_tasks.add_task(
-                email_service.send_threshold_email,
-                recipient,
-                product.name,
-                product.quantity,
-                product.threshold,
-                product.quantity_to_order
-            )
-
     return _with_status(product)
 
+@router.post("/{barcode_value}/restock", response_model=schemas.ProductOut)
+def restock_product(
+    barcode_value: str,
+    restock: schemas.ProductRestock,
+    db: Session = Depends(get_db),
+):
+    """Add received stock (recorded in the stock ledger as a restock)"""
+    if restock.quantity <= 0:
+        raise HTTPException(status_code=400, detail="Quantity must be greater than 0")
 
-def _with_status(product: models.ProductDB) -> schemas.ProductOut:
-    """Attach a status string to product based on threshold comparison"""
-    if product.quantity > product.threshold:
-        status = "High"
-    elif product.quantity == product.threshold:
-        status = "Warning"
+    product = crud.get_product_by_barcode(db, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    stock_ledger.restock(db, product, restock.quantity)
+    crud.record_threshold_edges(db, [product.id])
+    out = _with_status(product)
+    db.commit()
+    product_cache.invalidate(barcode_value)
+    return out
+
+@router.get("/{barcode_value}/stock", response_model=schemas.StockOut)
+def get_stock(barcode_value: str, db: Session = Depends(get_db)):
+    """Exact stock of a product, its ledger quantity and its shards"""
+    product = crud.get_product_by_barcode(db, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    shards = stock_ledger.shard_quantities(db, product.id) if product.stock_shards else []
+    return schemas.StockOut(
+        barcode=product.barcode,
+        quantity=sum(shards) if product.stock_shards else product.quantity,
+        product_quantity=product.quantity,
+        stock_shards=product.stock_shards,
+        shards=shards,
+        ledger=stock_ledger.ledger_quantity(db, product.id),
+    )
+
+@router.put("/{barcode_value}/stock/shards", response_model=schemas.StockOut)
+def set_stock_shards(barcode_value: str, count: int, db: Session = Depends(get_db)):
+    """Split a hot product's stock over `count` counter rows (0 or 1 to merge them back)"""
+    if not 0 <= count <= stock_ledger.MAX_SHARDS:
+        raise HTTPException(status_code=400, detail=f"Count must be between 0 and {stock_ledger.MAX_SHARDS}")
+
+    product = crud.get_product_by_barcode(db, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+
+    stock_ledger.set_shards(db, product, count)
+    product_cache.invalidate(barcode_value)
+    return get_stock(barcode_value, db)
+
+
+def _search(db: Session, q: str, mode: str, classification: str | None, status: str | None, limit: int, offset: int):
+    if not q.strip() or len(q) > 100:
+        raise HTTPException(status_code=400, detail="Query must be 1 to 100 characters")
+    if mode not in product_search.MODES:
+        raise HTTPException(status_code=400, detail=f"Mode must be one of {list(product_search.MODES)}")
+    if status is not None and status not in product_search.STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of {list(product_search.STATUSES)}")
+    if not 0 < limit <= MAX_SEARCH_LIMIT or offset < 0:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_SEARCH_LIMIT}, offset >= 0")
+
+    rows = product_search.search(db, q, mode, classification, status, limit, offset)
+    headers = {"X-Next-Offset": str(offset + limit)} if len(rows) == limit else None
+    return FastJSONResponse(rows, headers=headers)
+
+
+def _low_stock(db: Session, if_none_match: str, classification: str | None, status: str | None, limit: int, offset: int):
+    if status is not None and status not in LOW_STOCK_STATUSES:
+        raise HTTPException(status_code=400, detail=f"Status must be one of {list(LOW_STOCK_STATUSES)}")
+    if not 0 < limit <= MAX_LOW_STOCK_LIMIT or offset < 0:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_LOW_STOCK_LIMIT}, offset >= 0")
+
+    # Every change to a product bumps the catalog version, so the set can't have changed if it hasn't
+    version = catalog_version.read_version(db) if on_replica(db) else catalog_version.current_version(db)
+    headers = {"ETag": f'"low-stock-{version}"', "X-Catalog-Version": str(version)}
+    if headers["ETag"] in if_none_match:
+        return Response(status_code=304, headers=headers)
+
+    rows = crud.get_low_stock_rows(db, classification, status, limit, offset)
+    if len(rows) < limit and (rows or offset == 0):
+        total = offset + len(rows)  # last page
     else:
-        status = "Low"
+        total = crud.count_low_stock(db, classification, status)
+        if len(rows) == limit:
+            headers["X-Next-Offset"] = str(offset + limit)
+    headers["X-Low-Stock-Count"] = str(total)
+    return FastJSONResponse(rows, headers=headers)
+
+
+def _cached_product(db: Session, barcode_value: str) -> schemas.ProductOut | None:
+    """Read-through lookup for the scan hot path (see product_cache.py)"""
+    return product_cache.get_or_load(db, barcode_value, _load_product)
+
+
+def _load_product(db: Session, barcode_value: str) -> schemas.ProductOut | None:
+    product = crud.get_product_by_barcode(db, barcode_value)
+    return _with_status(product) if product else None
+
 
+def _reject_scan(db: Session, barcode_value: str, decrement_by: int):
+    """Raise the right error after a conditional decrement matched no row"""
+    product = crud.get_product_by_barcode(db, barcode_value)
+    if not product:
+        raise HTTPException(status_code=404, detail="Product not found")
+    raise HTTPException(
+        status_code=400,
+        detail=f"Cannot subtract {decrement_by}. Only {stock_ledger.live_quantity(db, product)} left."
+    )
+
+
+def _with_status(product: models.ProductDB) -> schemas.ProductOut:
+    """Attach a status string to product based on threshold comparison"""
     return schemas.ProductOut(
         id=product.id,
         name=product.name,
@@ -241,13 +479,10 @@ def _with_status(product: models.ProductDB) -> schemas.ProductOut:
         classification=product.classification,
         barcode=product.barcode,
         barcode_file=product.barcode_file,
-        status=status,
+        status=product.status,
     )
 
 # @router.get("/barcode/{barcode}", response_model=schemas.ProductOut)
 @router.get("/barcode/{barcode}")
 def get_product_by_barcode(barcode: str, db: Session = Depends(get_db)):
-    product = crud.get_product_by_barcode(db, barcode)
-    if not product:
-        return None
-    return product
+    return _cached_product(db, barcode)
@@ -1,11 +1,20 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from app import schemas, crud
+from typing import List, Optional
+from datetime import date, datetime
+from types import SimpleNamespace
+import base64
+import queue
+from app import schemas, crud, fast_json, metrics, scan_log_archive, scan_log_export, scan_rollups
 from app.database import get_db
+from app.fast_json import FastJSONResponse
+from app.scan_log_writer import SCAN_LOG_WAIT_TIMEOUT, scan_log_writer
 
 router = APIRouter(prefix="/scan_logs", tags=["scan_logs"])
 
+MAX_PAGE_SIZE = 500
+
 @router.post("/", response_model=schemas.ScanLogOut)
 def create_scan_log(scan: schemas.ScanLogCreate, db: Session = Depends(get_db)):
     product = db.query(crud.models.ProductDB).filter(crud.models.ProductDB.id == scan.product_id).first()
@@ -26,16 +35,119 @@ def create_scan_log(scan: schemas.ScanLogCreate, db: Session = Depends(get_db)):
         quantity=product.quantity,
         threshold=product.threshold,
         decremented_by=scan.decremented_by,  # NEW
-        classification=product.classification  # NEW
+        classification=product.classification,  # NEW
+        scanned_at=datetime.now(),
     )
+    if scan_log_writer.running:
+        row = {column: getattr(db_log, column) for column in GROUP_COMMIT_COLUMNS}
+        db.close()  # don't hold a pooled connection while waiting for the group
+        log_id = wait_for_scan_log(submit_scan_log(row))
+        return scan_log_response(row, log_id, product)
     db.add(db_log)
+    scan_rollups.record(db, [db_log])
     db.commit()
     db.refresh(db_log)
     return db_log
 
+GROUP_COMMIT_COLUMNS = (
+    "purpose", "scanned_by", "product_id", "quantity", "threshold", "decremented_by", "classification", "scanned_at",
+)
+
+def submit_scan_log(row: dict):
+    """Queue a scan log on the group commit writer; 503 when too many are already waiting"""
+    try:
+        return scan_log_writer.submit(row)
+    except queue.Full:
+        raise HTTPException(status_code=503, detail="Too many scan logs waiting to be written", headers={"Retry-After": "1"})
+
+def wait_for_scan_log(future) -> int:
+    """Id of the committed scan log; 503 if the writer doesn't get to it within SCAN_LOG_WAIT_TIMEOUT"""
+    try:
+        return future.result(timeout=SCAN_LOG_WAIT_TIMEOUT)
+    except TimeoutError:
+        if future.cancel():  # still queued, so it will never be written
+            raise scan_log_timed_out()
+    try:
+        return future.result(timeout=SCAN_LOG_WAIT_TIMEOUT)  # its group is being written right now
+    except TimeoutError:
+        raise scan_log_timed_out()
+
+def scan_log_timed_out() -> HTTPException:
+    metrics.count_group_commit_rejected(scan_log_writer.name)
+    return HTTPException(status_code=503, detail="Timed out waiting for the scan log to be written", headers={"Retry-After": "1"})
+
+def scan_log_response(row: dict, log_id: int, product):
+    log = SimpleNamespace(**row, id=log_id, product=product)
+    return FastJSONResponse(fast_json.scan_log_dicts([log])[0])
+
 @router.get("/", response_model=List[schemas.ScanLogOut])
-def read_scan_logs(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    return crud.get_scan_logs(db, skip=skip, limit=limit)
+def read_scan_logs(
+    limit: int = 100,
+    cursor: Optional[str] = None,
+    order: str = "asc",
+    product_id: Optional[int] = None,
+    barcode: Optional[str] = None,
+    classification: Optional[str] = None,
+    scanned_by: Optional[str] = None,
+    purpose: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_archived: bool = False,
+    db: Session = Depends(get_db),
+):
+    """Scan logs ordered by (scanned_at, id). Pass the X-Next-Cursor header back as `cursor` for the next page.
+    With include_archived, months moved out by the retention policy are read back from their archive files."""
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise HTTPException(status_code=400, detail=f"Limit must be between 1 and {MAX_PAGE_SIZE}")
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Order must be 'asc' or 'desc'")
+
+    get_scan_logs = scan_log_archive.get_scan_logs if include_archived else crud.get_scan_logs
+    logs = get_scan_logs(
+        db,
+        limit=limit,
+        after=_decode_cursor(cursor) if cursor else None,
+        descending=order == "desc",
+        product_id=product_id,
+        barcode=barcode,
+        classification=classification,
+        scanned_by=scanned_by,
+        purpose=purpose,
+        date_from=date_from,
+        date_to=date_to,
+    )
+    headers = {"X-Next-Cursor": _encode_cursor(logs[-1])} if len(logs) == limit else None
+    return FastJSONResponse(fast_json.scan_log_dicts(logs), headers=headers)
+
+@router.get("/export")
+def export_scan_logs(
+    format: str = "csv",
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    include_archived: bool = False,
+):
+    """Stream every scan log in [date_from, date_to) as CSV, NDJSON, Parquet or Arrow IPC"""
+    if format not in scan_log_export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Format must be one of {list(scan_log_export.FORMATS)}")
+    if format not in scan_log_export.available_formats():
+        raise HTTPException(status_code=400, detail=f"Format '{format}' requires pyarrow to be installed")
+
+    media_type, extension, _ = scan_log_export.FORMATS[format]
+    return StreamingResponse(
+        scan_log_export.export_scan_logs(format, date_from, date_to, include_archived),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="scan_logs.{extension}"'},
+    )
+
+@router.get("/archives", response_model=List[schemas.ScanLogArchiveOut])
+def list_archives(db: Session = Depends(get_db)):
+    """Months moved out of scan_logs by the retention policy"""
+    return scan_log_archive.archives(db)
+
+@router.get("/archives/totals", response_model=List[schemas.ArchivedTotal])
+def archived_totals(product_id: Optional[int] = None, month: Optional[date] = None, db: Session = Depends(get_db)):
+    """Per-product units and scans of the archived months"""
+    return scan_log_archive.archived_totals(db, product_id=product_id, month=month)
 
 @router.delete("/{scan_log_id}")
 def remove_scan_log(scan_log_id: int, db: Session = Depends(get_db)):
@@ -43,3 +155,16 @@ def remove_scan_log(scan_log_id: int, db: Session = Depends(get_db)):
     if not deleted:
         raise HTTPException(status_code=404, detail="Scan log not found")
     return {"detail": "Deleted successfully"}
+
+
+def _encode_cursor(log: crud.models.ScanLog) -> str:
+    raw = f"{log.scanned_at.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        scanned_at, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(scanned_at), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
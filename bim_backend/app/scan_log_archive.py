@@ -0,0 +1,464 @@
+"""
+    Scan log retention: months older than SCAN_LOG_RETENTION_MONTHS are moved out
+    of scan_logs into gzip-compressed NDJSON files in SCAN_LOG_ARCHIVE_DIR.
+
+    Archiving a month writes its file first (atomically, same rows as the NDJSON
+    export), then in one transaction catalogues it in scan_log_archives, adds
+    per-product totals to scan_archive_totals and deletes exactly the archived
+    rows. Daily rollups are kept, so analytics and forecasts are unaffected.
+    Scans that arrive later for an archived month (offline batch scans) go into
+    an extra part file for that month on the next run.
+
+    On Postgres, scan_logs can be converted once into a table partitioned by
+    month of scanned_at (`partition` below). The job then creates partitions
+    ahead of time, and an archived month's partition is detached and dropped
+    instead of deleted row by row. SQLite has no partitioning; there the monthly
+    files are the cold partitions and the hot table only holds the retention
+    window.
+
+    GET /scan_logs and /scan_logs/export read archived months with include_archived=true.
+
+        python -m app.scan_log_archive archive               # apply the policy now
+        python -m app.scan_log_archive archive --months 6
+        python -m app.scan_log_archive partition             # Postgres, one-time
+"""
+import gzip
+import heapq
+import json
+import os
+import threading
+from datetime import date, datetime
+from itertools import groupby, islice
+from types import SimpleNamespace
+from typing import Iterator
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from app import crud, models, scan_rollups
+from app.database import SessionLocal, engine
+from app.scan_log_export import COLUMNS, select_rows
+
+SCAN_LOG_RETENTION_MONTHS = int(os.getenv("SCAN_LOG_RETENTION_MONTHS", 12))  # 0 = keep everything
+SCAN_LOG_ARCHIVE_DIR = os.getenv("SCAN_LOG_ARCHIVE_DIR", "scan_log_archive")
+SCAN_LOG_RETENTION_INTERVAL = float(os.getenv("SCAN_LOG_RETENTION_INTERVAL", 24 * 3600))  # seconds, 0 = no scheduled job
+RETENTION_CHECK_INTERVAL = 300.0
+RETENTION_COUNTER = "scan_log_retention:last_run"
+PARTITIONS_AHEAD = 3  # months
+DELETE_CHUNK = 5000
+
+
+# ---------- Months ----------
+def month_start(value: date) -> date:
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _bounds(month: date) -> tuple[datetime, datetime]:
+    """[start, end) of a month as datetimes"""
+    return datetime(month.year, month.month, 1), datetime.combine(add_months(month, 1), datetime.min.time())
+
+
+def cutoff(retention_months: int = SCAN_LOG_RETENTION_MONTHS, today: date | None = None) -> date:
+    """First day of the oldest month that stays in scan_logs"""
+    return add_months(month_start(today or date.today()), -retention_months)
+
+
+def _row_key(row) -> tuple:
+    """(scanned_at, id) of an export row; rows without scanned_at sort first"""
+    return row[1] or datetime.min, row[0]
+
+
+# ---------- Postgres partitions ----------
+def _partition_name(month: date) -> str:
+    return f"scan_logs_{month:%Y_%m}"
+
+
+def is_partitioned(db) -> bool:
+    if db.get_bind().dialect.name != "postgresql":
+        return False
+    return db.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid"
+        " WHERE c.relname = 'scan_logs' AND pg_table_is_visible(c.oid))"
+    )).scalar()
+
+
+def _partition_exists(db, month: date) -> bool:
+    return db.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": _partition_name(month)}).scalar()
+
+
+def _create_partition(db, month: date):
+    start, end = _bounds(month)
+    db.execute(text(
+        f"CREATE TABLE {_partition_name(month)} PARTITION OF scan_logs"
+        f" FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+
+def ensure_partitions(db: Session, months_ahead: int = PARTITIONS_AHEAD) -> list[str]:
+    """Create the partitions for this month and the next `months_ahead` (no-op unless partitioned)"""
+    if not is_partitioned(db):
+        return []
+    created = []
+    first = month_start(date.today())
+    for offset in range(months_ahead + 1):
+        month = add_months(first, offset)
+        if _partition_exists(db, month):
+            continue
+        try:
+            with db.begin_nested():
+                _create_partition(db, month)
+            created.append(_partition_name(month))
+        except DBAPIError as e:  # e.g. rows for that month already sit in the default partition
+            print(f"Could not create partition {_partition_name(month)}: {e}")
+    db.commit()
+    return created
+
+
+def partition(months_ahead: int = PARTITIONS_AHEAD) -> int:
+    """Convert scan_logs into a table partitioned by month of scanned_at (Postgres, one-time).
+
+    Runs in one transaction under an exclusive lock: on failure (e.g. a row without
+    scanned_at) nothing changes. Returns the number of partitions created.
+    """
+    if engine.dialect.name != "postgresql":
+        raise RuntimeError("Partitioning needs Postgres; on SQLite the archive files act as the cold partitions")
+    with Session(engine) as db, db.begin():
+        if is_partitioned(db):
+            return 0
+        db.execute(text("LOCK TABLE scan_logs IN ACCESS EXCLUSIVE MODE"))
+        months = set(db.execute(text(
+            "SELECT DISTINCT date_trunc('month', scanned_at)::date FROM scan_logs WHERE scanned_at IS NOT NULL"
+        )).scalars())
+        months.update(add_months(month_start(date.today()), offset) for offset in range(months_ahead + 1))
+
+        db.execute(text("ALTER TABLE scan_logs RENAME TO scan_logs_unpartitioned"))
+        db.execute(text(
+            "CREATE TABLE scan_logs (LIKE scan_logs_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (scanned_at)"
+        ))
+        db.execute(text("ALTER TABLE scan_logs ADD PRIMARY KEY (id, scanned_at)"))
+        db.execute(text("ALTER TABLE scan_logs ADD FOREIGN KEY (product_id) REFERENCES products (id)"))
+        sequence = db.execute(text("SELECT pg_get_serial_sequence('scan_logs_unpartitioned', 'id')")).scalar()
+        if sequence:
+            db.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY scan_logs.id"))
+        db.execute(text("CREATE TABLE scan_logs_default PARTITION OF scan_logs DEFAULT"))
+        for month in sorted(months):
+            _create_partition(db, month)
+        db.execute(text("INSERT INTO scan_logs SELECT * FROM scan_logs_unpartitioned"))
+        db.execute(text("DROP TABLE scan_logs_unpartitioned"))
+
+    # Index names are free again now that the old table is gone
+    for index in models.ScanLog.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    return len(months)
+
+
+# ---------- Archiving ----------
+def _remove_rows(db: Session, month: date, ids: list[int]):
+    """Delete the archived rows: the whole partition if it holds nothing else, else by id"""
+    if is_partitioned(db) and _partition_exists(db, month):
+        name = _partition_name(month)
+        db.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        if db.execute(text(f"SELECT count(*) FROM {name}")).scalar() == len(ids):
+            db.execute(text(f"ALTER TABLE scan_logs DETACH PARTITION {name}"))
+            db.execute(text(f"DROP TABLE {name}"))
+            return
+    table = models.ScanLog.__table__
+    for offset in range(0, len(ids), DELETE_CHUNK):
+        db.execute(delete(table).where(table.c.id.in_(ids[offset:offset + DELETE_CHUNK])))
+
+
+def archive_month(month: date) -> dict | None:
+    """Move one month of scan logs into an archive file; returns its summary (None if the month is empty)"""
+    month = month_start(month)
+    start, end = _bounds(month)
+    os.makedirs(SCAN_LOG_ARCHIVE_DIR, exist_ok=True)
+    db = SessionLocal()
+    try:
+        archive = models.ScanLogArchive
+        part = db.execute(select(func.count()).select_from(archive).where(archive.month == month)).scalar() + 1
+        name = f"scan_logs-{month:%Y-%m}.ndjson.gz" if part == 1 else f"scan_logs-{month:%Y-%m}.{part}.ndjson.gz"
+        path = os.path.join(SCAN_LOG_ARCHIVE_DIR, name)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+
+        rows_stmt = select_rows(start, end)
+        if db.get_bind().dialect.name == "sqlite":
+            # SQLite hands out max(id) + 1 as the next id, so deleting the newest row would reuse its id
+            rows_stmt = rows_stmt.where(models.ScanLog.id != select(func.max(models.ScanLog.id)).scalar_subquery())
+
+        ids, totals, units, first, last = [], {}, 0, None, None
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            for batch in db.execute(rows_stmt).partitions():
+                f.write("".join(
+                    json.dumps(dict(zip(COLUMNS, row)), default=datetime.isoformat) + "\n" for row in batch
+                ))
+                for row in batch:
+                    ids.append(row.id)
+                    units += row.decremented_by
+                    if row.product_id is not None:
+                        key = (row.product_id, row.classification or "")
+                        product_units, scans = totals.get(key, (0, 0))
+                        totals[key] = (product_units + row.decremented_by, scans + 1)
+                if first is None:
+                    first = batch[0].scanned_at
+                last = batch[-1].scanned_at
+        if not ids:
+            os.remove(tmp_path)
+            return None
+        os.replace(tmp_path, path)
+
+        try:
+            db.add(archive(
+                month=month, path=name, rows=len(ids), units=units, bytes=os.path.getsize(path),
+                first_scanned_at=first, last_scanned_at=last,
+            ))
+            rows = [
+                {"month": month, "product_id": product_id, "classification": classification, "units": u, "scans": n}
+                for (product_id, classification), (u, n) in sorted(totals.items())
+            ]
+            if rows:
+                scan_rollups.add_totals(db, models.ScanArchiveTotal.__table__, ("month", "product_id", "classification"), rows)
+            _remove_rows(db, month, ids)
+            db.commit()
+        except Exception:
+            db.rollback()
+            os.remove(path)
+            raise
+        return {"month": month, "path": name, "rows": len(ids), "units": units, "bytes": os.path.getsize(path)}
+    finally:
+        db.close()
+
+
+def apply_policy(retention_months: int = SCAN_LOG_RETENTION_MONTHS) -> list[dict]:
+    """Archive every month before the retention cutoff, oldest first; returns the archived months"""
+    if retention_months <= 0:
+        return []
+    horizon = datetime.combine(cutoff(retention_months), datetime.min.time())
+    db = SessionLocal()
+    try:
+        ensure_partitions(db)
+    finally:
+        db.close()
+
+    archived, month = [], None
+    while True:
+        db = SessionLocal()
+        try:
+            stmt = select(func.min(models.ScanLog.scanned_at)).where(models.ScanLog.scanned_at < horizon)
+            if month is not None:
+                stmt = stmt.where(models.ScanLog.scanned_at >= _bounds(month)[1])
+            oldest = db.execute(stmt).scalar()
+        finally:
+            db.close()
+        if oldest is None:
+            return archived
+        month = month_start(oldest.date())
+        summary = archive_month(month)
+        if summary is not None:
+            archived.append(summary)
+
+
+# ---------- Reading archives ----------
+def _read(path: str) -> Iterator[tuple]:
+    with gzip.open(os.path.join(SCAN_LOG_ARCHIVE_DIR, path), "rt", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["scanned_at"] is not None:
+                record["scanned_at"] = datetime.fromisoformat(record["scanned_at"])
+            yield tuple(record[column] for column in COLUMNS)
+
+
+def archived_rows(
+    db: Session,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    descending: bool = False,
+) -> Iterator[tuple]:
+    """Archived rows (export column order) in [date_from, date_to), ordered by (scanned_at, id).
+
+    Files are read one month at a time; a month with several parts, or read
+    descending, is sorted in memory.
+    """
+    archive = models.ScanLogArchive
+    stmt = select(archive.month, archive.path).order_by(archive.month, archive.id)
+    if date_from is not None:
+        stmt = stmt.where(archive.month >= month_start(date_from))
+    if date_to is not None:
+        stmt = stmt.where(archive.month < date_to)
+    months = [(month, [path for _, path in parts]) for month, parts in groupby(db.execute(stmt).all(), key=lambda r: r[0])]
+    if descending:
+        months.reverse()
+
+    for _, paths in months:
+        if len(paths) == 1 and not descending:
+            rows = _read(paths[0])
+        else:
+            rows = sorted((row for path in paths for row in _read(path)), key=_row_key, reverse=descending)
+        for row in rows:
+            if date_from is not None and (row[1] is None or row[1] < date_from):
+                continue
+            if date_to is not None and row[1] is not None and row[1] >= date_to:
+                continue
+            yield row
+
+
+def merged_batches(db: Session, batches, date_from, date_to, batch_size: int) -> Iterator[list]:
+    """Interleave archived rows with export batches from scan_logs, keeping (scanned_at, id) order"""
+    hot = (row for batch in batches for row in batch)
+    rows = heapq.merge(archived_rows(db, date_from, date_to), hot, key=_row_key)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def get_scan_logs(
+    db: Session,
+    limit: int = 100,
+    after: tuple[datetime, int] | None = None,
+    descending: bool = False,
+    product_id: int | None = None,
+    barcode: str | None = None,
+    classification: str | None = None,
+    scanned_by: str | None = None,
+    purpose: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+) -> list:
+    """crud.get_scan_logs over scan_logs and the archives together (same order, same cursor)"""
+    hot = crud.get_scan_logs(
+        db, limit=limit, after=after, descending=descending, product_id=product_id, barcode=barcode,
+        classification=classification, scanned_by=scanned_by, purpose=purpose, date_from=date_from, date_to=date_to,
+    )
+
+    fields = dict(zip(COLUMNS, range(len(COLUMNS))))
+    wanted = {"product_id": product_id, "barcode": barcode, "classification": classification,
+              "scanned_by": scanned_by, "purpose": purpose}
+    wanted = {fields[name]: value for name, value in wanted.items() if value is not None}
+
+    def matches(row) -> bool:
+        if any(row[index] != value for index, value in wanted.items()):
+            return False
+        if after is not None:
+            return _row_key(row) < after if descending else _row_key(row) > after
+        return True
+
+    cold = list(islice(
+        (row for row in archived_rows(db, date_from, date_to, descending) if matches(row)),
+        limit,
+    ))
+    if not cold:
+        return hot
+
+    # Archived logs show the product as it is now, or as it was when archived if it has been deleted
+    product_ids = {row[2] for row in cold if row[2] is not None}
+    products = {
+        product.id: product
+        for product in db.query(models.ProductDB).filter(models.ProductDB.id.in_(product_ids))
+    }
+    logs = []
+    for row in cold:
+        record = dict(zip(COLUMNS, row))
+        product = products.get(record["product_id"]) or SimpleNamespace(
+            id=record["product_id"], name=record["product_name"] or "", barcode=record["barcode"] or "",
+            quantity=record["quantity"], quantity_to_order=0, threshold=record["threshold"],
+            classification=record["classification"], barcode_file=None, status=None,
+        )
+        logs.append(SimpleNamespace(
+            id=record["id"], scanned_at=record["scanned_at"], product_id=record["product_id"],
+            purpose=record["purpose"], scanned_by=record["scanned_by"], quantity=record["quantity"],
+            threshold=record["threshold"], decremented_by=record["decremented_by"],
+            classification=record["classification"], product=product,
+        ))
+
+    key = lambda log: (log.scanned_at or datetime.min, log.id)
+    return list(islice(heapq.merge(hot, logs, key=key, reverse=descending), limit))
+
+
+def archives(db: Session) -> list[models.ScanLogArchive]:
+    return db.query(models.ScanLogArchive).order_by(models.ScanLogArchive.month, models.ScanLogArchive.id).all()
+
+
+def archived_totals(db: Session, product_id: int | None = None, month: date | None = None) -> list[dict]:
+    """Per-product units and scans of archived months"""
+    totals = models.ScanArchiveTotal
+    stmt = select(totals.month, totals.product_id, totals.classification, totals.units, totals.scans).order_by(
+        totals.month, totals.product_id, totals.classification
+    )
+    if product_id is not None:
+        stmt = stmt.where(totals.product_id == product_id)
+    if month is not None:
+        stmt = stmt.where(totals.month == month_start(month))
+    return [{**row, "classification": row["classification"] or None} for row in db.execute(stmt).mappings()]
+
+
+# ---------- Scheduled job ----------
+def _claim_run(interval: float) -> bool:
+    db = SessionLocal()
+    try:
+        return crud.claim_periodic_run(db, RETENTION_COUNTER, interval)
+    finally:
+        db.close()
+
+
+class RetentionJob:
+    """Applies the retention policy on a background thread every `interval` seconds."""
+
+    def __init__(self, interval: float = SCAN_LOG_RETENTION_INTERVAL, retention_months: int = SCAN_LOG_RETENTION_MONTHS):
+        self.interval = interval
+        self.retention_months = retention_months
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0 and self.retention_months > 0:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="scan-log-retention", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                if _claim_run(self.interval):
+                    for summary in apply_policy(self.retention_months):
+                        print(f"Archived {summary['rows']} scan logs of {summary['month']:%Y-%m} to {summary['path']}")
+            except Exception as e:
+                print(f"Scan log retention failed: {e}")
+            self._stopping.wait(timeout=min(self.interval, RETENTION_CHECK_INTERVAL))
+
+
+retention_job = RetentionJob()
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from app.database import Base, upgrade_schema
+
+    parser = argparse.ArgumentParser(description="Scan log retention and archival")
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive_cmd = commands.add_parser("archive", help="archive every month older than the retention window")
+    archive_cmd.add_argument("--months", type=int, default=SCAN_LOG_RETENTION_MONTHS, help="months kept in scan_logs")
+    commands.add_parser("partition", help="convert scan_logs into monthly partitions (Postgres)")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+    start = time.perf_counter()
+    if args.command == "partition":
+        print(f"Partitioned scan_logs into {partition()} monthly partitions in {time.perf_counter() - start:.1f}s")
+    else:
+        archived = apply_policy(args.months)
+        for summary in archived:
+            print(f"{summary['month']:%Y-%m}: {summary['rows']} rows, {summary['bytes']} bytes -> {summary['path']}")
+        print(f"Archived {len(archived)} months in {time.perf_counter() - start:.1f}s")
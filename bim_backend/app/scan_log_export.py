@@ -0,0 +1,174 @@
+"""
+    Streaming scan log export (CSV / NDJSON / Parquet / Arrow IPC).
+
+    Rows are pulled with a server-side cursor (yield_per) and written out one
+    batch at a time, so memory stays bounded and the first bytes go out as soon
+    as the first batch is read. Parquet and Arrow need pyarrow to be installed.
+"""
+import csv
+import io
+import json
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import select
+
+from app import models
+from app.database import read_session
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+EXPORT_BATCH_SIZE = 5000
+
+COLUMNS = [
+    "id", "scanned_at", "product_id", "barcode", "product_name", "classification",
+    "purpose", "scanned_by", "decremented_by", "quantity", "threshold",
+]
+
+# format -> (media type, file extension, needs pyarrow)
+FORMATS = {
+    "csv": ("text/csv", "csv", False),
+    "ndjson": ("application/x-ndjson", "ndjson", False),
+    "parquet": ("application/vnd.apache.parquet", "parquet", True),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows", True),
+}
+
+
+def available_formats() -> list[str]:
+    return [fmt for fmt, (_, _, needs_arrow) in FORMATS.items() if pa is not None or not needs_arrow]
+
+
+def select_rows(date_from: datetime | None, date_to: datetime | None):
+    """Export columns of the scan logs in [date_from, date_to), in (scanned_at, id) order, fetched in batches"""
+    log, product = models.ScanLog, models.ProductDB
+    stmt = (
+        select(
+            log.id, log.scanned_at, log.product_id, product.barcode, product.name.label("product_name"),
+            log.classification, log.purpose, log.scanned_by, log.decremented_by, log.quantity, log.threshold,
+        )
+        .outerjoin(product, log.product_id == product.id)
+        .order_by(log.scanned_at, log.id)
+    )
+    if date_from is not None:
+        stmt = stmt.where(log.scanned_at >= date_from)
+    if date_to is not None:
+        stmt = stmt.where(log.scanned_at < date_to)
+    return stmt.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def _batches(date_from: datetime | None, date_to: datetime | None, include_archived: bool = False) -> Iterator[list]:
+    db = read_session()
+    try:
+        if include_archived:
+            from app import scan_log_archive  # imports this module
+            batches = scan_log_archive.merged_batches(
+                db, db.execute(select_rows(date_from, date_to)).partitions(), date_from, date_to, EXPORT_BATCH_SIZE
+            )
+        else:
+            batches = db.execute(select_rows(date_from, date_to)).partitions()
+        for batch in batches:
+            yield batch
+    finally:
+        db.close()
+
+
+class DrainableSink:
+    """Write-only file object whose buffered bytes can be taken out between batches"""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _arrow_schema():
+    return pa.schema([
+        ("id", pa.int64()), ("scanned_at", pa.timestamp("us")), ("product_id", pa.int64()),
+        ("barcode", pa.string()), ("product_name", pa.string()), ("classification", pa.string()),
+        ("purpose", pa.string()), ("scanned_by", pa.string()), ("decremented_by", pa.int64()),
+        ("quantity", pa.int64()), ("threshold", pa.int64()),
+    ])
+
+
+def _record_batch(schema, rows: list):
+    columns = list(zip(*rows)) if rows else [[] for _ in COLUMNS]
+    return pa.record_batch([pa.array(col, type=field.type) for col, field in zip(columns, schema)], schema=schema)
+
+
+def _csv(batches) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(COLUMNS)
+    yield buf.getvalue().encode()
+    for rows in batches:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+
+
+def _ndjson(batches) -> Iterator[bytes]:
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(COLUMNS, row)), default=datetime.isoformat) + "\n" for row in rows
+        ).encode()
+
+
+def _parquet(batches) -> Iterator[bytes]:
+    schema = _arrow_schema()
+    sink = DrainableSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    for rows in batches:
+        writer.write_batch(_record_batch(schema, rows))
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _arrow(batches) -> Iterator[bytes]:
+    schema = _arrow_schema()
+    sink = DrainableSink()
+    options = pa.ipc.IpcWriteOptions(compression="zstd")
+    with pa.ipc.new_stream(sink, schema, options=options) as writer:
+        for rows in batches:
+            writer.write_batch(_record_batch(schema, rows))
+            yield sink.drain()
+    yield sink.drain()
+
+
+_WRITERS = {"csv": _csv, "ndjson": _ndjson, "parquet": _parquet, "arrow": _arrow}
+
+
+def export_scan_logs(
+    fmt: str, date_from: datetime | None = None, date_to: datetime | None = None, include_archived: bool = False
+) -> Iterator[bytes]:
+    """Yield the encoded export chunk by chunk (archived months too with include_archived)"""
+    for chunk in _WRITERS[fmt](_batches(date_from, date_to, include_archived)):
+        if chunk:
+            yield chunk
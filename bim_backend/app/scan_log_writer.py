@@ -0,0 +1,138 @@
+"""
+    Group commit for POST /scan_logs (opt-in: SCAN_LOG_GROUP_COMMIT=true).
+
+    Requests put their row on an in-process queue and wait on a future. A
+    writer thread takes what is queued, up to SCAN_LOG_GROUP_ROWS rows or
+    SCAN_LOG_GROUP_WAIT_MS after the first one, and writes the group with one
+    multi-row INSERT, its rollups and change feed events in one transaction,
+    so a single fsync covers all of it. A request only gets its response once
+    that transaction has committed, as before.
+
+    Backpressure: when SCAN_LOG_QUEUE_SIZE rows are waiting, submit() blocks up
+    to SCAN_LOG_QUEUE_TIMEOUT seconds and then raises queue.Full (the route
+    answers 503). The route also gives up on a queued row after
+    SCAN_LOG_WAIT_TIMEOUT seconds and cancels its future; the writer skips
+    cancelled rows, so a 503 always means the log was not written. If a group
+    fails, its rows are retried one per transaction, so one bad row doesn't
+    fail the rest.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy import insert
+
+from app import change_feed, metrics, models, scan_rollups
+from app.database import SessionLocal
+
+SCAN_LOG_GROUP_COMMIT = os.getenv("SCAN_LOG_GROUP_COMMIT", "false").lower() == "true"
+SCAN_LOG_GROUP_ROWS = int(os.getenv("SCAN_LOG_GROUP_ROWS", 500))
+SCAN_LOG_GROUP_WAIT_MS = float(os.getenv("SCAN_LOG_GROUP_WAIT_MS", 2))
+SCAN_LOG_QUEUE_SIZE = int(os.getenv("SCAN_LOG_QUEUE_SIZE", 10000))
+SCAN_LOG_QUEUE_TIMEOUT = float(os.getenv("SCAN_LOG_QUEUE_TIMEOUT", 1))
+# How long a request waits for its row to commit: a full queue's worth of backpressure plus one group
+SCAN_LOG_WAIT_TIMEOUT = SCAN_LOG_QUEUE_TIMEOUT + SCAN_LOG_GROUP_WAIT_MS / 1000
+
+
+def write_scan_logs(db, rows: list[dict]) -> list[int]:
+    """Insert scan log rows with their rollups and change feed events; returns the ids. Does not commit."""
+    ids = db.scalars(insert(models.ScanLog).returning(models.ScanLog.id, sort_by_parameter_order=True), rows).all()
+    for row, log_id in zip(rows, ids):
+        change_feed.stage(db, "scan_log.created", **change_feed.scan_log_fields({**row, "id": log_id}))
+    scan_rollups.record(db, rows)
+    return ids
+
+
+class GroupCommitWriter:
+    """Queue of (row, future) drained by one writer thread, a group per transaction."""
+
+    def __init__(
+        self,
+        name: str = "scan_logs",
+        max_rows: int = SCAN_LOG_GROUP_ROWS,
+        max_wait: float = SCAN_LOG_GROUP_WAIT_MS / 1000,
+        queue_size: int = SCAN_LOG_QUEUE_SIZE,
+        enabled: bool = SCAN_LOG_GROUP_COMMIT,
+    ):
+        self.name = name
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.enabled = enabled
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._thread = None
+        metrics.group_commit_queued[(name,)] = self._queue.qsize
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None and self.enabled:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Write what is still queued, then stop"""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def submit(self, row: dict, timeout: float = SCAN_LOG_QUEUE_TIMEOUT) -> Future:
+        """Queue a row; the future resolves to its id once committed. Raises queue.Full under backpressure."""
+        if self._thread is None:
+            raise RuntimeError(f"The {self.name} writer isn't running")
+        future = Future()
+        try:
+            self._queue.put((row, future), timeout=timeout)
+        except queue.Full:
+            metrics.count_group_commit_rejected(self.name)
+            raise
+        return future
+
+    def _run(self):
+        while True:
+            try:
+                group = [self._queue.get(timeout=0.2)]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            deadline = time.monotonic() + self.max_wait
+            while len(group) < self.max_rows:
+                try:
+                    group.append(self._queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            # Rows whose request already gave up (cancelled futures) are dropped; the rest can't be cancelled now
+            group = [(row, future) for row, future in group if future.set_running_or_notify_cancel()]
+            if group:
+                self._write(group)
+
+    def _write(self, group: list):
+        start = time.perf_counter()
+        db = SessionLocal()
+        try:
+            ids = write_scan_logs(db, [row for row, _ in group])
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            if len(group) == 1:
+                group[0][1].set_exception(e)
+            else:
+                print(f"Scan log group of {len(group)} failed ({e}), retrying row by row")
+                for item in group:
+                    self._write([item])
+            return
+        finally:
+            db.close()
+        metrics.observe_group_commit(self.name, len(group), time.perf_counter() - start)
+        for (_, future), log_id in zip(group, ids):
+            future.set_result(log_id)
+
+
+scan_log_writer = GroupCommitWriter()
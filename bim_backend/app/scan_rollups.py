@@ -0,0 +1,189 @@
+"""
+    Daily consumption rollups: units taken out and scans per (product, classification, day).
+
+    Kept up to date in the same transaction as the scan logs themselves (single
+    scans, batch scans, POST /scan_logs, log and product deletes) with one
+    upsert per touched key, so analytics never have to scan scan_logs.
+    rebuild() recomputes the table from scan_logs with one INSERT ... SELECT:
+
+        python -m app.scan_rollups                  # full rebuild / first backfill
+        python -m app.scan_rollups --from 2024-01-01
+"""
+from datetime import date, datetime, timedelta
+from typing import Iterable
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app import models
+
+
+def _fields(log) -> tuple[tuple, int]:
+    """((product_id, classification, day), decremented_by) of an ORM scan log or a row dict"""
+    get = log.get if isinstance(log, dict) else lambda name: getattr(log, name)
+    return (get("product_id"), get("classification") or "", get("scanned_at").date()), get("decremented_by")
+
+
+def record(db: Session, logs: Iterable, sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) scan logs (ORM objects or row dicts) from the rollups"""
+    totals = {}
+    for log in logs:
+        key, decremented_by = _fields(log)
+        units, scans = totals.get(key, (0, 0))
+        totals[key] = (units + sign * decremented_by, scans + sign)
+    if not totals:
+        return
+
+    # Sorted keys give concurrent transactions the same lock order
+    rows = [
+        {"product_id": product_id, "classification": classification, "day": day, "units": units, "scans": scans}
+        for (product_id, classification, day), (units, scans) in sorted(totals.items())
+    ]
+    add_totals(db, models.ScanDailyRollup.__table__, ("product_id", "classification", "day"), rows)
+
+
+def add_totals(db: Session, table, keys: tuple, rows: list[dict]):
+    """Add each row's units and scans to the row of `table` with the same `keys`, inserting it if missing"""
+    key_columns = [table.c[key] for key in keys]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("postgresql", "sqlite"):
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as upsert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as upsert
+        stmt = upsert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=key_columns,
+            set_={"units": table.c.units + stmt.excluded.units, "scans": table.c.scans + stmt.excluded.scans},
+        )
+        db.execute(stmt, rows)
+        return
+
+    # Portable fallback: UPDATE, INSERT on a miss (retry the UPDATE if someone else inserted first)
+    for row in rows:
+        key = [column == row[column.name] for column in key_columns]
+        stmt = update(table).where(*key).values(units=table.c.units + row["units"], scans=table.c.scans + row["scans"])
+        if db.execute(stmt).rowcount:
+            continue
+        try:
+            with db.begin_nested():
+                db.execute(insert(table).values(**row))
+        except IntegrityError:
+            db.execute(stmt)
+
+
+def discard_product(db: Session, product_id: int):
+    """A deleted product takes its scan logs with it, so its rollups go too"""
+    db.execute(delete(models.ScanDailyRollup).where(models.ScanDailyRollup.product_id == product_id))
+
+
+def _archived_through(db: Session) -> date | None:
+    """First day after the last archived month (scan_log_archive.py); earlier days are no longer in scan_logs"""
+    last = db.execute(select(func.max(models.ScanLogArchive.month))).scalar()
+    if last is None:
+        return None
+    return (last.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def rebuild(db: Session, date_from: date | None = None) -> int:
+    """Recompute rollups from scan_logs (all days, or from date_from on); returns the row count.
+    Archived months are left as they are."""
+    rollups, logs = models.ScanDailyRollup, models.ScanLog
+    archived_through = _archived_through(db)
+    if archived_through is not None and (date_from is None or date_from < archived_through):
+        date_from = archived_through
+    day = func.date(logs.scanned_at)
+    source = select(
+        logs.product_id,
+        func.coalesce(logs.classification, ""),
+        day,
+        func.sum(logs.decremented_by),
+        func.count(),
+    ).where(logs.product_id.is_not(None)).group_by(logs.product_id, func.coalesce(logs.classification, ""), day)
+    clear = delete(rollups)
+    if date_from is not None:
+        source = source.where(logs.scanned_at >= datetime.combine(date_from, datetime.min.time()))
+        clear = clear.where(rollups.day >= date_from)
+
+    db.execute(clear)
+    db.execute(insert(rollups).from_select(["product_id", "classification", "day", "units", "scans"], source))
+    count = db.execute(select(func.count()).select_from(rollups)).scalar()
+    db.commit()
+    return count
+
+
+def day_range(date_from: date | None, date_to: date | None, default_days: int = 30) -> tuple[date, date]:
+    """Inclusive [date_from, date_to]; defaults to the last `default_days` days"""
+    date_to = date_to or date.today()
+    date_from = date_from or date_to - timedelta(days=default_days - 1)
+    return date_from, date_to
+
+
+# ---------- Analytics queries ----------
+def usage_series(db: Session, product_id: int, date_from: date, date_to: date) -> list[dict]:
+    """Units and scans per day for one product, zero-filled over [date_from, date_to]"""
+    rollups = models.ScanDailyRollup
+    rows = db.execute(
+        select(rollups.day, func.sum(rollups.units), func.sum(rollups.scans))
+        .where(rollups.product_id == product_id, rollups.day.between(date_from, date_to))
+        .group_by(rollups.day)
+    ).all()
+    by_day = {day: (units, scans) for day, units, scans in rows}
+    days = (date_to - date_from).days + 1
+    series = []
+    for offset in range(max(days, 0)):
+        day = date_from + timedelta(days=offset)
+        units, scans = by_day.get(day, (0, 0))
+        series.append({"day": day, "units": units, "scans": scans})
+    return series
+
+
+def top_movers(db: Session, date_from: date, date_to: date, classification: str | None = None, limit: int = 20) -> list[dict]:
+    """Products with the most units out in the range"""
+    rollups, products = models.ScanDailyRollup, models.ProductDB
+    units = func.sum(rollups.units).label("units")
+    stmt = (
+        select(rollups.product_id, products.barcode, products.name, products.classification, units, func.sum(rollups.scans).label("scans"))
+        .join(products, products.id == rollups.product_id)
+        .where(rollups.day.between(date_from, date_to))
+        .group_by(rollups.product_id, products.barcode, products.name, products.classification)
+        .order_by(units.desc(), rollups.product_id)
+        .limit(limit)
+    )
+    if classification is not None:
+        stmt = stmt.where(rollups.classification == classification)
+    return [dict(row) for row in db.execute(stmt).mappings()]
+
+
+def by_classification(db: Session, date_from: date, date_to: date) -> list[dict]:
+    """Units and scans per classification in the range, largest first"""
+    rollups = models.ScanDailyRollup
+    units = func.sum(rollups.units).label("units")
+    rows = db.execute(
+        select(rollups.classification, units, func.sum(rollups.scans).label("scans"))
+        .where(rollups.day.between(date_from, date_to))
+        .group_by(rollups.classification)
+        .order_by(units.desc())
+    ).mappings()
+    return [{**row, "classification": row["classification"] or None} for row in rows]
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from app.database import Base, SessionLocal, engine
+
+    parser = argparse.ArgumentParser(description="Rebuild the daily scan rollups from scan_logs")
+    parser.add_argument("--from", dest="date_from", type=date.fromisoformat, help="only rebuild days from this date on")
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        rows = rebuild(db, args.date_from)
+        print(f"Rebuilt scan rollups: {rows} rows in {time.perf_counter() - start:.1f}s")
+    finally:
+        db.close()
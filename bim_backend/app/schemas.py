@@ -2,7 +2,7 @@
     Contains validation and response models (Pydantic).
 """
 from pydantic import BaseModel, EmailStr
-from datetime import datetime
+from datetime import date, datetime
 from typing import Optional
 
 # ---------- Product Schemas ----------
@@ -27,6 +27,12 @@ class ProductOut(ProductBase):
     class Config:
         orm_mode = True
 
+# For delta sync (GET /products?since=<version>)
+class ProductDelta(BaseModel):
+    version: int  # pass back as `since` on the next poll
+    changed: list[ProductOut]
+    deleted: list[str]  # barcodes of deleted products
+
 # For partial updates
 class ProductUpdate(BaseModel):
     name: Optional[str] = None
@@ -37,6 +43,29 @@ class ProductUpdate(BaseModel):
     barcode: Optional[str] = None
     barcode_file: Optional[str] = None
 
+class ProductRestock(BaseModel):
+    quantity: int  # units received
+
+# Stock ledger / sharded counters (GET /products/{barcode}/stock)
+class StockOut(BaseModel):
+    barcode: str
+    quantity: int  # exact, including the shards
+    product_quantity: int  # products.quantity; trails the shards by up to STOCK_SYNC_INTERVAL
+    stock_shards: int
+    shards: list[int]
+    ledger: dict  # quantity according to the ledger, see stock_ledger.ledger_quantity
+
+# Printable label sheets (POST /products/labels): the listed barcodes, else every product matching the filters
+class LabelSheetRequest(BaseModel):
+    barcodes: Optional[list[str]] = None  # printed in this order
+    classification: Optional[str] = None
+    status: Optional[str] = None  # High / Warning / Low
+    low_stock: bool = False  # only products at or below their threshold
+    copies: int = 1  # labels per product
+    layout: str = "avery-5160"  # see label_sheets.LAYOUTS
+    format: str = "pdf"  # pdf, or png for a ZIP of PNG pages
+    dpi: int = 300
+
 # ---------- Email Settings Schemas ----------
 class EmailSettingsBase(BaseModel):
     email: EmailStr
@@ -91,3 +120,93 @@ class ScanLogOut(ScanLogBase):
 # ---------- For Product Scan ----------
 class ProductScan(BaseModel):
     decrement_by: int
+
+class ScanSubmit(ProductScan):
+    """Decrement + scan log in a single request"""
+    purpose: str
+    scanned_by: str
+
+# ---------- For Batch Scan ----------
+class ScanBatchItem(ScanSubmit):
+    barcode: str
+    client_timestamp: Optional[datetime] = None  # when the handheld took the scan
+
+class ScanBatchResult(BaseModel):
+    index: int  # position in the submitted array
+    barcode: str
+    status: str  # ok / not_found / insufficient_stock / invalid
+    detail: Optional[str] = None
+    quantity: Optional[int] = None  # remaining quantity after this scan
+    scan_log_id: Optional[int] = None
+
+# ---------- For Analytics (daily rollups) ----------
+class UsagePoint(BaseModel):
+    day: date
+    units: int
+    scans: int
+
+class ProductUsage(BaseModel):
+    product_id: int
+    barcode: str
+    name: str
+    series: list[UsagePoint]
+
+class TopMover(BaseModel):
+    product_id: int
+    barcode: str
+    name: str
+    classification: Optional[str] = None
+    units: int
+    scans: int
+
+class ClassificationConsumption(BaseModel):
+    classification: Optional[str] = None
+    units: int
+    scans: int
+
+# ---------- For Forecasts ----------
+class ProductForecastOut(BaseModel):
+    product_id: int
+    barcode: str
+    name: str
+    classification: Optional[str] = None
+    quantity: int
+    threshold: int
+    quantity_to_order: int
+    daily_rate: float
+    daily_std: float
+    days_until_stockout: Optional[float] = None  # None: no usage in the window
+    stockout_date: Optional[date] = None
+    suggested_threshold: Optional[int] = None
+    suggested_quantity_to_order: Optional[int] = None
+    computed_at: datetime
+
+class ForecastRun(BaseModel):
+    products: int
+    with_usage: int
+    window_days: int
+    computed_at: datetime
+    load_s: float
+    compute_s: float
+    store_s: float
+
+# ---------- Scan log archives ----------
+class ScanLogArchiveOut(BaseModel):
+    month: date
+    path: str
+    rows: int
+    units: int
+    bytes: int
+    first_scanned_at: Optional[datetime] = None
+    last_scanned_at: Optional[datetime] = None
+    archived_at: datetime
+
+    class Config:
+        orm_mode = True
+
+class ArchivedTotal(BaseModel):
+    month: date
+    product_id: int
+    classification: Optional[str] = None
+    units: int
+    scans: int
@@ -0,0 +1,402 @@
+"""
+    Append-only stock ledger and sharded stock counters.
+
+    Every change to a product's quantity appends a stock_movements row in the
+    same transaction: scans, restocks, corrections through PUT/PATCH, and the
+    initial quantity of new products. ORM changes are recorded in after_flush;
+    the Core write paths call append() themselves. The compactor folds the
+    ledger into stock_snapshots periodically, so a product's ledger quantity is
+    its snapshot plus a short tail of movements (ledger_quantity()).
+
+    A hot SKU can be split into N stock_shards rows (set_shards()). A scan then
+    takes its units from one shard with a conditional UPDATE, so concurrent
+    scanners lock different rows instead of queueing on the product row.
+    Every shard stays >= 0, so the total never goes below zero. Only when no
+    single shard has enough does a scan lock all shards and take across them.
+    For sharded products, products.quantity trails the shards: the compactor
+    copies the shard totals back every STOCK_SYNC_INTERVAL seconds and runs
+    threshold alerts for them. Scan responses report the exact total.
+
+        python -m app.stock_ledger backfill   # opening movements for products that predate the ledger
+        python -m app.stock_ledger compact    # fold the ledger into snapshots now
+"""
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, event, func, insert, inspect, literal, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from app import catalog_version, change_feed, crud, models
+from app.database import AppSession, SessionLocal
+
+STOCK_SYNC_INTERVAL = float(os.getenv("STOCK_SYNC_INTERVAL", 1))  # seconds, 0 = no background compactor
+STOCK_SNAPSHOT_INTERVAL = float(os.getenv("STOCK_SNAPSHOT_INTERVAL", 300))
+# Only movements older than this are folded, so a transaction still in flight isn't skipped
+STOCK_SNAPSHOT_LAG = timedelta(seconds=float(os.getenv("STOCK_SNAPSHOT_LAG", 60)))
+MAX_SHARDS = 256
+SYNC_COUNTER = "stock:last_sync"
+SNAPSHOT_COUNTER = "stock:last_snapshot"
+
+
+# ---------- Ledger ----------
+def append(db, product_id: int, delta: int, reason: str, shard: int | None = None):
+    db.execute(insert(models.StockMovement).values(product_id=product_id, delta=delta, reason=reason, shard=shard))
+
+
+@event.listens_for(AppSession, "after_flush")
+def _record_orm_changes(session, flush_context):
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, models.ProductDB) and obj.quantity:
+            rows.append({"product_id": obj.id, "delta": obj.quantity, "reason": "initial"})
+    for obj in session.dirty:
+        if not isinstance(obj, models.ProductDB):
+            continue
+        history = inspect(obj).attrs.quantity.history
+        if not history.added:
+            continue
+        new = history.added[0] or 0
+        if obj.stock_shards:
+            delta = _spread(session, obj.id, obj.stock_shards, new)
+        else:
+            delta = new - ((history.deleted[0] if history.deleted else None) or 0)
+        if delta:
+            rows.append({"product_id": obj.id, "delta": delta, "reason": session.info.get("stock_reason", "correction")})
+    if rows:
+        session.execute(insert(models.StockMovement), rows)
+
+
+def backfill(db: Session) -> int:
+    """Opening movements for products without an initial/opening one, so their ledger adds up; commits"""
+    products, movements = models.ProductDB.__table__, models.StockMovement.__table__
+    earlier = (
+        select(func.coalesce(func.sum(movements.c.delta), 0))
+        .where(movements.c.product_id == products.c.id)
+        .scalar_subquery()
+    )
+    opened = (
+        select(movements.c.id)
+        .where(movements.c.product_id == products.c.id, movements.c.reason.in_(("initial", "opening")))
+        .exists()
+    )
+    shards = models.StockShard.__table__
+    live = case(
+        (products.c.stock_shards > 0, select(func.coalesce(func.sum(shards.c.quantity), 0))
+         .where(shards.c.product_id == products.c.id).scalar_subquery()),
+        else_=func.coalesce(products.c.quantity, 0),
+    )
+    source = select(products.c.id, live - earlier, literal("opening")).where(~opened)
+    count = db.execute(insert(movements).from_select(["product_id", "delta", "reason"], source)).rowcount
+    db.commit()
+    return count
+
+
+def ledger_quantity(db: Session, product_id: int) -> dict:
+    """Quantity according to the ledger: latest snapshot plus the movements after it"""
+    snapshot = db.get(models.StockSnapshot, product_id)
+    after = snapshot.movement_id if snapshot else 0
+    movements = models.StockMovement
+    tail, count = db.execute(
+        select(func.coalesce(func.sum(movements.delta), 0), func.count())
+        .where(movements.product_id == product_id, movements.id > after)
+    ).one()
+    return {
+        "quantity": (snapshot.quantity if snapshot else 0) + tail,
+        "snapshot_quantity": snapshot.quantity if snapshot else None,
+        "snapshot_movement_id": snapshot.movement_id if snapshot else None,
+        "snapshot_taken_at": snapshot.taken_at if snapshot else None,
+        "tail_movements": count,
+    }
+
+
+def snapshot(db: Session) -> int:
+    """Fold movements older than STOCK_SNAPSHOT_LAG into stock_snapshots; returns products updated. Commits."""
+    movements, snapshots = models.StockMovement, models.StockSnapshot
+    upto = db.execute(
+        select(func.max(movements.id)).where(movements.created_at < datetime.now() - STOCK_SNAPSHOT_LAG)
+    ).scalar()
+    if upto is None:
+        return 0
+    rows = db.execute(
+        select(movements.product_id, snapshots.quantity, func.sum(movements.delta))
+        .outerjoin(snapshots, snapshots.product_id == movements.product_id)
+        .where(movements.id <= upto, movements.id > func.coalesce(snapshots.movement_id, 0))
+        .group_by(movements.product_id, snapshots.quantity)
+    ).all()
+    now = datetime.now()
+    for offset in range(0, len(rows), 5000):
+        chunk = rows[offset:offset + 5000]
+        db.execute(delete(snapshots).where(snapshots.product_id.in_([row[0] for row in chunk])))
+        db.execute(insert(snapshots), [
+            {"product_id": product_id, "movement_id": upto, "quantity": (quantity or 0) + tail, "taken_at": now}
+            for product_id, quantity, tail in chunk
+        ])
+    db.commit()
+    return len(rows)
+
+
+def discard_product(db: Session, product_id: int):
+    """A deleted product's ledger, snapshot and shards go with it (SQLite may hand its id out again)"""
+    for model in (models.StockMovement, models.StockSnapshot, models.StockShard):
+        db.execute(delete(model).where(model.product_id == product_id))
+
+
+# ---------- Shards ----------
+def shard_total(db, product_id: int) -> int:
+    shards = models.StockShard
+    return db.execute(select(func.coalesce(func.sum(shards.quantity), 0)).where(shards.product_id == product_id)).scalar()
+
+
+def shard_quantities(db, product_id: int) -> list[int]:
+    shards = models.StockShard
+    return db.execute(select(shards.quantity).where(shards.product_id == product_id).order_by(shards.shard)).scalars().all()
+
+
+def live_quantity(db, product: models.ProductDB) -> int:
+    return shard_total(db, product.id) if product.stock_shards else product.quantity
+
+
+def _split(total: int, count: int) -> list[int]:
+    return [total // count + (1 if shard < total % count else 0) for shard in range(count)]
+
+
+def lock_shards(db, product_id: int) -> list:
+    """(shard, quantity) of every shard of a product, locked FOR UPDATE in shard order"""
+    shards = models.StockShard
+    return db.execute(
+        select(shards.shard, shards.quantity)
+        .where(shards.product_id == product_id)
+        .order_by(shards.shard)
+        .with_for_update()
+    ).all()
+
+
+def _spread(db, product_id: int, count: int, total: int) -> int:
+    """Set a sharded product's stock to `total`, spread evenly; returns the change"""
+    before = sum(quantity for _, quantity in lock_shards(db, product_id))
+    shards = models.StockShard.__table__
+    db.execute(delete(shards).where(shards.c.product_id == product_id))
+    db.execute(insert(shards), [
+        {"product_id": product_id, "shard": shard, "quantity": quantity}
+        for shard, quantity in enumerate(_split(max(total, 0), count))
+    ])
+    return total - before
+
+
+def set_shards(db: Session, product: models.ProductDB, count: int) -> models.ProductDB:
+    """Spread a product's stock over `count` shard rows (count <= 1 folds it back into the product row)"""
+    products = models.ProductDB.__table__
+    db.execute(select(products.c.id).where(products.c.id == product.id).with_for_update())
+    db.refresh(product)
+    total = live_quantity(db, product)
+    count = count if count > 1 else 0
+    if product.stock_shards:
+        db.execute(delete(models.StockShard).where(models.StockShard.product_id == product.id))
+    if count:
+        db.execute(insert(models.StockShard), [
+            {"product_id": product.id, "shard": shard, "quantity": quantity}
+            for shard, quantity in enumerate(_split(total, count))
+        ])
+    # Core UPDATE: the quantity doesn't change, so there is nothing to record in the ledger
+    db.execute(
+        update(products)
+        .where(products.c.id == product.id)
+        .values(stock_shards=count, quantity=total, version=catalog_version.next_version(db))
+    )
+    # products.quantity may have trailed the shards until now; the event carries the live total
+    set_committed_value(product, "quantity", total)
+    change_feed.stage(db, "product.updated", **change_feed.product_fields(product), stock_shards=count)
+    db.commit()
+    db.refresh(product)
+    return product
+
+
+def take_across(db, product_id: int, units: int, locked: list | None = None) -> list[tuple[int, int]] | None:
+    """Take `units` from several shards under lock, largest first; None if they don't add up.
+    Pass `locked` (from lock_shards()) if the caller holds the product row and shard locks already."""
+    if locked is None:
+        products = models.ProductDB.__table__
+        db.execute(select(products.c.id).where(products.c.id == product_id).with_for_update())
+        locked = lock_shards(db, product_id)
+    if sum(quantity for _, quantity in locked) < units:
+        return None
+    shards = models.StockShard.__table__
+    taken, needed = [], units
+    for shard, quantity in sorted(locked, key=lambda row: -row[1]):
+        part = min(quantity, needed)
+        if part:
+            db.execute(
+                update(shards)
+                .where(shards.c.product_id == product_id, shards.c.shard == shard)
+                .values(quantity=shards.c.quantity - part)
+            )
+            taken.append((shard, part))
+            needed -= part
+        if not needed:
+            break
+    return taken
+
+
+def take(db, product_id: int, count: int, units: int) -> models.ProductDB | None:
+    """Decrement a product spread over `count` shards by `units`. Returns the product with its exact
+    remaining quantity, or None if there isn't enough stock. Does not commit."""
+    shards = models.StockShard.__table__
+    conditional = (
+        update(shards)
+        .where(shards.c.product_id == product_id, shards.c.quantity >= units)
+        .values(quantity=shards.c.quantity - units)
+        .returning(shards.c.shard)
+    )
+    # A random shard first; if it runs short, the ones that (last we looked) have enough
+    first = random.randrange(count)
+    taken = None
+    if db.execute(conditional.where(shards.c.shard == first)).first() is not None:
+        taken = [(first, units)]
+    else:
+        others = db.execute(
+            select(shards.c.shard)
+            .where(shards.c.product_id == product_id, shards.c.quantity >= units)
+            .order_by(shards.c.quantity.desc())
+        ).scalars().all()
+        for shard in others:
+            if db.execute(conditional.where(shards.c.shard == shard)).first() is not None:
+                taken = [(shard, units)]
+                break
+    if taken is None:
+        taken = take_across(db, product_id, units)
+        if taken is None:
+            return None
+
+    db.execute(insert(models.StockMovement), [
+        {"product_id": product_id, "delta": -part, "reason": "scan", "shard": shard} for shard, part in taken
+    ])
+    product = db.get(models.ProductDB, product_id)
+    set_committed_value(product, "quantity", shard_total(db, product_id))
+    return product
+
+
+def restock(db: Session, product: models.ProductDB, units: int) -> int:
+    """Add stock (to the emptiest shard of a sharded product); returns the new quantity. Does not commit."""
+    if product.stock_shards:
+        shards = models.StockShard.__table__
+        shard = db.execute(
+            select(shards.c.shard).where(shards.c.product_id == product.id).order_by(shards.c.quantity, shards.c.shard).limit(1)
+        ).scalar()
+        db.execute(
+            update(shards)
+            .where(shards.c.product_id == product.id, shards.c.shard == shard)
+            .values(quantity=shards.c.quantity + units)
+        )
+        append(db, product.id, units, "restock", shard)
+        quantity = shard_total(db, product.id)
+    else:
+        products = models.ProductDB.__table__
+        quantity = db.execute(
+            update(products)
+            .where(products.c.id == product.id)
+            .values(quantity=products.c.quantity + units, version=catalog_version.next_version(db))
+            .returning(products.c.quantity)
+        ).scalar()
+        append(db, product.id, units, "restock")
+    set_committed_value(product, "quantity", quantity)
+    change_feed.stage(db, "restock", **change_feed.product_fields(product), restocked_by=units)
+    return quantity
+
+
+def sync_products(db: Session) -> list[str]:
+    """Copy shard totals into products.quantity where they differ and run threshold alerts; returns the barcodes"""
+    products, shards = models.ProductDB.__table__, models.StockShard.__table__
+    total = select(func.coalesce(func.sum(shards.c.quantity), 0)).where(shards.c.product_id == products.c.id).scalar_subquery()
+    changed = db.execute(
+        select(products.c.id, products.c.barcode).where(products.c.stock_shards > 0, products.c.quantity != total)
+    ).all()
+    if not changed:
+        db.rollback()
+        return []
+    ids = [row.id for row in changed]
+    db.execute(
+        update(products)
+        .where(products.c.id.in_(ids), products.c.stock_shards > 0)
+        .values(quantity=total, version=catalog_version.next_version(db))
+    )
+    crud.record_threshold_edges(db, ids)
+    db.commit()
+    return [row.barcode for row in changed]
+
+
+# ---------- Background compactor ----------
+class StockCompactor:
+    """Syncs sharded products every `interval` seconds and snapshots the ledger every `snapshot_interval`."""
+
+    def __init__(self, interval: float = STOCK_SYNC_INTERVAL, snapshot_interval: float = STOCK_SNAPSHOT_INTERVAL):
+        self.interval = interval
+        self.snapshot_interval = snapshot_interval
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.interval > 0:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="stock-compactor", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _run(self):
+        from app.product_cache import product_cache
+
+        backfilled = False
+        while not self._stopping.is_set():
+            db = SessionLocal()
+            try:
+                if not backfilled:
+                    count = backfill(db)
+                    if count:
+                        print(f"Stock ledger: opening movements for {count} products")
+                    backfilled = True
+                if crud.claim_periodic_run(db, SYNC_COUNTER, self.interval):
+                    barcodes = sync_products(db)
+                    if barcodes:
+                        product_cache.invalidate(*barcodes)
+                if crud.claim_periodic_run(db, SNAPSHOT_COUNTER, self.snapshot_interval):
+                    snapshot(db)
+            except Exception as e:
+                db.rollback()
+                print(f"Stock compactor failed: {e}")
+            finally:
+                db.close()
+            self._stopping.wait(timeout=self.interval)
+
+
+stock_compactor = StockCompactor()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from app.database import Base, engine, upgrade_schema
+
+    parser = argparse.ArgumentParser(description="Stock ledger maintenance")
+    parser.add_argument("command", choices=("backfill", "compact"))
+    args = parser.parse_args()
+
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        if args.command == "backfill":
+            print(f"Added opening movements for {backfill(db)} products in {time.perf_counter() - start:.1f}s")
+        else:
+            backfill(db)
+            print(f"Snapshotted {snapshot(db)} products in {time.perf_counter() - start:.1f}s")
+    finally:
+        db.close()
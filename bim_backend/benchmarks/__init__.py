@@ -0,0 +1,19 @@
+"""
+    Load-test and micro-benchmark suite for the inventory API.
+
+    Run from bim_backend/:
+
+        python -m benchmarks seed --products 100000 --logs 1000000
+        python -m benchmarks run --suite default --products 10000 --logs 200000
+        python -m benchmarks run --suite hot-sku --mode uvicorn --workers 4
+        python -m benchmarks run --suite scanners --mode uvicorn --async-mode
+        python -m benchmarks micro
+        python -m benchmarks compare results/<before>.json results/<after>.json
+
+    Every run seeds a fresh database (a SQLite file in a temp directory, or the
+    Postgres stand-in given by --database-url / BENCH_POSTGRES_URL), then drives
+    each scenario with a closed loop of `concurrency` clients, either in-process
+    through httpx's ASGI transport or against a uvicorn subprocess. Throughput
+    and p50/p95/p99 latency are printed and saved as JSON tagged with the git
+    commit, so runs can be compared between commits.
+"""
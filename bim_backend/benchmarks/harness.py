@@ -0,0 +1,116 @@
+"""
+    Targets (in-process ASGI app or a uvicorn subprocess) and the closed-loop load driver.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+import httpx
+
+from benchmarks.scenarios import Context, new_state
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REQUEST_TIMEOUT = 120.0
+STARTUP_TIMEOUT = 60.0
+
+
+@asynccontextmanager
+async def in_process(concurrency: int):
+    """The app in this process, through httpx's ASGI transport (lifespan included)"""
+    from app.main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=REQUEST_TIMEOUT) as client:
+            yield client
+
+
+@asynccontextmanager
+async def uvicorn_server(concurrency: int, workers: int = 1):
+    """uvicorn in a subprocess sharing this process's environment and working directory"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (BACKEND_DIR, os.environ.get("PYTHONPATH"))))}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        env=env,
+    )
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=REQUEST_TIMEOUT, limits=limits) as client:
+            deadline = time.monotonic() + STARTUP_TIMEOUT
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+                try:
+                    if (await client.get("/metrics")).status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError("uvicorn did not start in time")
+                await asyncio.sleep(0.2)
+            yield client
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def percentile(ordered: list[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def drive(client, scenario, ctx: Context, concurrency: int, duration: float, warmup: float) -> dict:
+    """Run `concurrency` clients back to back for warmup + duration seconds; stats cover `duration` only"""
+    latencies = []
+    statuses = Counter()
+    start = time.perf_counter()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+
+    async def client_loop(client_id: int):
+        state = new_state(ctx, client_id)
+        while True:
+            began = time.perf_counter()
+            if began >= deadline:
+                return
+            try:
+                status = str(await scenario(client, ctx, state))
+            except Exception as e:
+                status = type(e).__name__
+            if began >= measure_from:
+                latencies.append(time.perf_counter() - began)
+                statuses[status] += 1
+
+    await asyncio.gather(*(client_loop(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - measure_from
+    latencies.sort()
+    errors = sum(count for status, count in statuses.items() if not (status.isdigit() and int(status) < 400))
+    return {
+        "ops": len(latencies),
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_ops_s": round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50) * 1000, 2),
+            "p95": round(percentile(latencies, 95) * 1000, 2),
+            "p99": round(percentile(latencies, 99) * 1000, 2),
+            "max": round((latencies[-1] if latencies else 0) * 1000, 2),
+            "mean": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else 0.0,
+        },
+        "statuses": dict(statuses),
+    }
@@ -0,0 +1,543 @@
+"""
+    Micro-benchmarks that don't go through HTTP.
+
+    Barcode allocation throughput at fill levels from 0 to 10M products: the
+    shared counter is moved to each fill level, then a fresh allocator hands
+    out barcodes (counter reservations included). The legacy scheme drew random
+    8-digit values and retried on collisions, one DB lookup per attempt; its
+    expected attempts per barcode at the same fill level are reported next to
+    it (computed, since seeding 10M rows for each level is impractical).
+
+    Forecast job runtime: seeds N products and M scan logs, rebuilds the daily
+    rollups and times one full forecasting.run() (load / compute / store).
+
+    Stock contention: N writer threads scan one hot SKU as fast as they can,
+    unsharded and then split over a few stock shard counts (stock_ledger.py).
+    Reports scans/s and checks that the exact total and the ledger both
+    account for every scan. SQLite serializes all writers, so the difference
+    only shows on Postgres.
+
+    List serialization: GET /products on N products and a 500-row scan log
+    page, through pydantic models + jsonable_encoder (the old path) and
+    through plain rows + fast_json.dumps.
+
+    Search latency: seeds N products with generated hardware names and times
+    type-ahead (prefix) and fuzzy queries of GET /products/search against the
+    database's search index (product_search.py).
+
+    Group commit: N client threads each insert scan logs one at a time as
+    POST /scan_logs does, first with a commit per row and then through the
+    group commit writer (scan_log_writer.py). Reports rows/s, per-row latency
+    and the average group size.
+
+    Label sheets: N distinct products printed as PDF and as PNG pages
+    (label_sheets.py), cold (barcode PNGs rendered first) and warm (reused
+    from BARCODE_DIR). Reports time to first byte, total time and labels/s.
+
+    Low stock: seeds N products with a few hundred to a few thousand of them
+    at or below their threshold, then answers "what is low right now?" by
+    classifying the whole catalogue (the old way) and from the low-stock
+    partial index behind GET /products/low-stock.
+
+    Idempotent scans: N scans, each sent M times at once with the same
+    Idempotency-Key (idempotency.py) as a client retrying over bad Wi-Fi
+    would, through the app in this process or uvicorn workers. Checks that
+    stock went down exactly once per scan and every copy got the same
+    response; reports requests/s and how many copies were replayed.
+"""
+import threading
+import time
+
+from sqlalchemy import update
+
+FILL_LEVELS = (0, 100_000, 1_000_000, 5_000_000, 10_000_000)
+LEGACY_SPACE = 90_000_000  # random.randint(10000000, 99999999)
+
+
+def allocator_throughput(count: int = 20000, fill_levels=FILL_LEVELS) -> list[dict]:
+    from app import crud, models
+    from app.barcode_allocator import BarcodeAllocator
+    from app.database import engine
+
+    results = []
+    for fill in fill_levels:
+        probe = BarcodeAllocator()
+        name = f"barcode:{probe.format}:{probe.prefix}"
+        with engine.begin() as conn:
+            crud.increment_counter(conn, name, 0)  # make sure the row exists
+            conn.execute(update(models.Counter).where(models.Counter.name == name).values(value=fill))
+
+        allocator = BarcodeAllocator()
+        start = time.perf_counter()
+        for _ in range(count):
+            allocator.allocate()
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        allocator.allocate_many(count)
+        bulk = time.perf_counter() - start
+
+        results.append({
+            "fill": fill,
+            "allocate_ops_s": round(count / single, 1),
+            "allocate_many_ops_s": round(count / bulk, 1),
+            "legacy_expected_attempts": round(LEGACY_SPACE / (LEGACY_SPACE - fill), 4),
+        })
+    return results
+
+
+def forecast_runtime(products: int = 100_000, logs: int = 1_000_000, runs: int = 3) -> list[dict]:
+    from app import forecasting, scan_rollups
+    from app.database import SessionLocal
+    from benchmarks.seed import seed
+
+    seed(products, logs, hot=max(products // 100, 1))
+    db = SessionLocal()
+    try:
+        start = time.perf_counter()
+        rollup_rows = scan_rollups.rebuild(db)
+        rebuild_s = time.perf_counter() - start
+    finally:
+        db.close()
+
+    results = []
+    for _ in range(runs):
+        summary = forecasting.run()
+        results.append({
+            "products": summary["products"],
+            "logs": logs,
+            "rollup_rows": rollup_rows,
+            "rollup_rebuild_s": round(rebuild_s, 3),
+            "load_s": summary["load_s"],
+            "compute_s": summary["compute_s"],
+            "store_s": summary["store_s"],
+            "total_s": round(summary["load_s"] + summary["compute_s"] + summary["store_s"], 3),
+        })
+    return results
+
+
+def stock_contention(writers: int = 128, duration: float = 10.0, shard_counts=(0, 8, 32), stock: int = 10_000_000) -> list[dict]:
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app import crud, models, stock_ledger
+    from app.database import AppSession, SessionLocal, engine
+
+    barcode = "BENCH-HOT-SKU"
+    if engine.dialect.name == "sqlite":
+        bench_engine = engine
+    else:  # one connection per writer, so the pool isn't what they queue on
+        bench_engine = create_engine(engine.url, pool_size=writers, max_overflow=0)
+    Session = sessionmaker(bind=bench_engine, class_=AppSession)
+
+    db = SessionLocal()
+    try:
+        product = crud.get_product_by_barcode(db, barcode)
+        if product is None:
+            product = models.ProductDB(
+                name="Benchmark hot SKU", barcode=barcode, barcode_file="", quantity=0,
+                threshold=0, quantity_to_order=0, classification="bench",
+            )
+            db.add(product)
+            db.commit()
+
+        results = []
+        for count in shard_counts:
+            stock_ledger.set_shards(db, product, 0)
+            product.quantity = stock
+            db.commit()
+            stock_ledger.set_shards(db, product, count)
+
+            stopping = threading.Event()
+            ops, errors = [0] * writers, [0] * writers
+
+            def writer(index):
+                while not stopping.is_set():
+                    session = Session()
+                    try:
+                        if crud.decrement_product_quantity(session, barcode, 1) is None:
+                            errors[index] += 1
+                            session.rollback()
+                        else:
+                            session.commit()
+                            ops[index] += 1
+                    except Exception:
+                        session.rollback()
+                        errors[index] += 1
+                    finally:
+                        session.close()
+
+            threads = [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stopping.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+
+            db.expire_all()
+            live = stock_ledger.live_quantity(db, product)
+            ledger = stock_ledger.ledger_quantity(db, product.id)["quantity"]
+            db.rollback()
+            results.append({
+                "shards": count,
+                "writers": writers,
+                "scans": sum(ops),
+                "scans_s": round(sum(ops) / elapsed, 1),
+                "errors": sum(errors),
+                "consistent": live == stock - sum(ops) == ledger,
+            })
+        stock_ledger.set_shards(db, product, 0)
+        return results
+    finally:
+        db.close()
+        if bench_engine is not engine:
+            bench_engine.dispose()
+
+
+def list_serialization(products: int = 50_000, logs: int = 100_000, runs: int = 5) -> list[dict]:
+    import json
+
+    from fastapi.encoders import jsonable_encoder
+
+    from app import crud, fast_json, schemas
+    from app.database import SessionLocal
+    from app.routes.products import _with_status
+    from benchmarks.seed import seed
+
+    seed(products, logs, hot=max(products // 100, 1))
+
+    def product_list_pydantic(db):
+        return json.dumps(jsonable_encoder([_with_status(p) for p in crud.get_products(db)])).encode()
+
+    def product_list_fast(db):
+        return fast_json.dumps(crud.get_product_rows(db))
+
+    try:  # what FastAPI does with response_model=List[ScanLogOut]
+        from pydantic import TypeAdapter
+
+        adapter = TypeAdapter(list[schemas.ScanLogOut])
+        validate_logs = lambda page: adapter.validate_python(page, from_attributes=True)
+    except ImportError:  # pydantic 1
+        validate_logs = lambda page: [schemas.ScanLogOut.from_orm(log) for log in page]
+
+    def log_page_pydantic(db):
+        return json.dumps(jsonable_encoder(validate_logs(crud.get_scan_logs(db, limit=500)))).encode()
+
+    def log_page_fast(db):
+        return fast_json.dumps(fast_json.scan_log_dicts(crud.get_scan_logs(db, limit=500)))
+
+    results = []
+    for name, rows, variants in (
+        ("product_list", products, (("pydantic", product_list_pydantic), (fast_json.BACKEND, product_list_fast))),
+        ("scan_log_page", 500, (("pydantic", log_page_pydantic), (fast_json.BACKEND, log_page_fast))),
+    ):
+        for serializer, build in variants:
+            timings = []
+            for _ in range(runs):
+                db = SessionLocal()
+                try:
+                    start = time.perf_counter()
+                    body = build(db)
+                    timings.append(time.perf_counter() - start)
+                finally:
+                    db.close()
+            results.append({
+                "endpoint": name,
+                "serializer": serializer,
+                "rows": rows,
+                "bytes": len(body),
+                "best_s": round(min(timings), 4),
+                "median_s": round(sorted(timings)[len(timings) // 2], 4),
+            })
+    return results
+
+
+SEARCH_WORDS = (
+    "cordless", "drill", "hammer", "copper", "pipe", "wrench", "socket", "screw", "bolt", "washer",
+    "hinge", "bracket", "cable", "switch", "outlet", "sander", "brush", "roller", "primer", "valve",
+    "fitting", "elbow", "hose", "nozzle", "rake", "shovel", "pliers", "chisel", "clamp", "ladder",
+)
+
+
+def _search_name(i: int, rng) -> str:
+    return f"{rng.choice(SEARCH_WORDS).title()} {rng.choice(SEARCH_WORDS)} {rng.choice(('', 'pro ', 'mini '))}{i}"
+
+
+def search_latency(products: int = 1_000_000, queries: int = 500) -> list[dict]:
+    import random
+    import statistics
+
+    from app import product_search
+    from app.database import SessionLocal
+    from benchmarks.seed import seed
+
+    seed(products, 0, hot=1, product_name=_search_name)
+    start = time.perf_counter()
+    backend = product_search.install()
+    install_s = time.perf_counter() - start
+
+    rng = random.Random(7)
+    typed = []
+    for _ in range(queries):
+        name = _search_name(rng.randrange(products), rng).lower()
+        typed.append(name[:rng.randint(1, min(len(name), 12))])  # someone half way through typing
+    typos = []
+    for _ in range(queries):
+        word = rng.choice(SEARCH_WORDS)
+        cut = rng.randrange(len(word))
+        typos.append(word[:cut] + word[cut + 1:] + " " + rng.choice(SEARCH_WORDS)[:4])
+
+    results = []
+    db = SessionLocal()
+    try:
+        for mode, terms, filters in (
+            ("prefix", typed, {}),
+            ("prefix", typed, {"classification": "Tools", "status": "High"}),
+            ("fuzzy", typos, {}),
+        ):
+            product_search.search(db, terms[0], mode, **filters)  # warm up
+            timings = []
+            for term in terms:
+                begin = time.perf_counter()
+                product_search.search(db, term, mode, limit=20, **filters)
+                timings.append((time.perf_counter() - begin) * 1000)
+            timings.sort()
+            results.append({
+                "search": mode + (" filtered" if filters else ""),
+                "backend": backend,
+                "products": products,
+                "install_s": round(install_s, 2),
+                "p50_ms": round(statistics.median(timings), 3),
+                "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 3),
+                "max_ms": round(timings[-1], 3),
+            })
+    finally:
+        db.close()
+    return results
+
+
+def group_commit_throughput(concurrency=(1, 8, 32, 128), duration: float = 5.0) -> list[dict]:
+    import statistics
+    from datetime import datetime
+
+    from app import crud, metrics, models, scan_rollups
+    from app.database import SessionLocal
+    from app.scan_log_writer import GroupCommitWriter
+
+    barcode = "BENCH-GROUP-COMMIT"
+    db = SessionLocal()
+    try:
+        product = crud.get_product_by_barcode(db, barcode)
+        if product is None:
+            product = models.ProductDB(
+                name="Benchmark group commit", barcode=barcode, barcode_file="", quantity=1000,
+                threshold=0, quantity_to_order=0, classification="bench",
+            )
+            db.add(product)
+            db.commit()
+        product_id = product.id
+    finally:
+        db.close()
+
+    def row():
+        return {
+            "purpose": "bench", "scanned_by": "bench", "product_id": product_id, "quantity": 1000,
+            "threshold": 0, "decremented_by": 1, "classification": "bench", "scanned_at": datetime.now(),
+        }
+
+    def per_row():
+        session = SessionLocal()
+        try:
+            log = models.ScanLog(**row())
+            session.add(log)
+            scan_rollups.record(session, [log])
+            session.commit()
+        finally:
+            session.close()
+
+    results = []
+    for mode in ("per_row", "group"):
+        for clients in concurrency:
+            writer = None
+            if mode == "group":
+                writer = GroupCommitWriter(name="bench", enabled=True)
+                writer.start()
+            stopping = threading.Event()
+            latencies = [[] for _ in range(clients)]
+            errors = [0] * clients
+
+            def client(index):
+                while not stopping.is_set():
+                    begin = time.perf_counter()
+                    try:
+                        if writer is None:
+                            per_row()
+                        else:
+                            writer.submit(row()).result()
+                    except Exception:
+                        errors[index] += 1
+                        continue
+                    latencies[index].append((time.perf_counter() - begin) * 1000)
+
+            threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stopping.set()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            if writer is not None:
+                writer.stop()
+
+            timings = sorted(t for per_client in latencies for t in per_client)
+            groups = metrics.group_commit_rows.pop(("bench",), None)
+            metrics.group_commit_seconds.pop(("bench",), None)
+            results.append({
+                "mode": mode,
+                "clients": clients,
+                "rows": len(timings),
+                "rows_s": round(len(timings) / elapsed, 1),
+                "p50_ms": round(statistics.median(timings), 3) if timings else None,
+                "p99_ms": round(timings[int(len(timings) * 0.99) - 1], 3) if timings else None,
+                "avg_group": round(groups.sum / groups.count, 1) if groups and groups.count else None,
+                "errors": sum(errors),
+            })
+    return results
+
+
+def label_sheets(labels: int = 5000, layout: str = "avery-5160") -> list[dict]:
+    from app import barcode_images, label_sheets as sheets
+
+    products = [(str(90000000 + i), f"Benchmark product {i}") for i in range(labels)]
+    for value, _ in products:  # cold start: nothing rendered yet
+        barcode_images.discard(value)
+
+    results = []
+    for fmt, cache in (("pdf", "cold"), ("pdf", "warm"), ("png", "warm")):
+        start = time.perf_counter()
+        first_byte, size = None, 0
+        for chunk in sheets.render_sheets(products, layout, fmt):
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+            size += len(chunk)
+        elapsed = time.perf_counter() - start
+        results.append({
+            "format": fmt,
+            "barcodes": cache,
+            "labels": labels,
+            "pages": sheets.page_count(labels, layout),
+            "workers": sheets.LABEL_WORKERS,
+            "first_byte_s": round(first_byte, 3),
+            "total_s": round(elapsed, 2),
+            "labels_s": round(labels / elapsed, 1),
+            "bytes": size,
+        })
+    return results
+
+
+def idempotent_scans(scans: int = 200, duplicates: int = 8, workers: int = 0, in_flight: int = 64) -> list[dict]:
+    """workers=0: the app in this process; otherwise that many uvicorn workers. At most
+    `in_flight` requests are out at a time; the copies of a scan go out together."""
+    import asyncio
+    import uuid
+
+    from app import crud, models
+    from app.database import SessionLocal
+    from benchmarks.harness import in_process, uvicorn_server
+
+    barcode = "BENCH-IDEMPOTENT"
+    stock = scans * duplicates * 10
+    db = SessionLocal()
+    try:
+        product = crud.get_product_by_barcode(db, barcode)
+        if product is None:
+            product = models.ProductDB(
+                name="Benchmark idempotent scans", barcode=barcode, barcode_file="", quantity=stock,
+                threshold=0, quantity_to_order=0, classification="bench",
+            )
+            db.add(product)
+        product.quantity = stock
+        db.commit()
+    finally:
+        db.close()
+
+    scan = {"decrement_by": 1, "purpose": "bench", "scanned_by": "bench"}
+    run = uuid.uuid4().hex[:8]  # fresh keys on every run against the same database
+
+    async def flood():
+        target = in_process(in_flight) if not workers else uvicorn_server(in_flight, workers)
+        slots = asyncio.Semaphore(in_flight)
+        async with target as client:
+            async def send(i):
+                async with slots:
+                    headers = {"Idempotency-Key": f"{run}-{i}"}
+                    return i, await client.post(f"/products/scan/{barcode}/log", json=scan, headers=headers)
+
+            start = time.perf_counter()
+            responses = await asyncio.gather(*(send(i) for i in range(scans) for _ in range(duplicates)))
+            elapsed = time.perf_counter() - start
+            quantity = (await client.get(f"/products/{barcode}")).json()["quantity"]
+        return responses, elapsed, quantity
+
+    responses, elapsed, quantity = asyncio.run(flood())
+    bodies = {}
+    for i, r in responses:
+        bodies.setdefault(i, set()).add((r.status_code, r.content))
+    return [{
+        "target": f"uvicorn x{workers}" if workers else "in_process",
+        "scans": scans,
+        "duplicates": duplicates,
+        "in_flight": in_flight,
+        "requests_s": round(len(responses) / elapsed, 1),
+        "replayed": sum(r.headers.get("Idempotent-Replayed") == "true" for _, r in responses),
+        "errors": sum(r.status_code != 200 for _, r in responses),
+        "decremented": stock - quantity,
+        "exactly_once": stock - quantity == scans and all(len(b) == 1 for b in bodies.values()),
+    }]
+
+
+def low_stock_latency(products: int = 1_000_000, low_counts=(100, 1000, 10000), runs: int = 5) -> list[dict]:
+    from sqlalchemy import update
+
+    from app import crud, models
+    from app.database import SessionLocal
+    from benchmarks.seed import seed
+
+    seed(products, 0, hot=1)
+
+    def full_scan(db):
+        return [row for row in crud.get_product_rows(db) if row["status"] != "High"]
+
+    def low_stock_index(db):
+        return crud.get_low_stock_rows(db, limit=1000), crud.count_low_stock(db)
+
+    results = []
+    p = models.ProductDB
+    for low in low_counts:
+        db = SessionLocal()
+        try:
+            every = max(products // low, 1)
+            db.execute(update(p).values(quantity=1_000_000_000))
+            db.execute(update(p).where(p.id % every == 0).values(quantity=p.id % 6))  # 0..5, threshold is 5
+            db.commit()
+            for name, read in (("full_scan", full_scan), ("low_stock_index", low_stock_index)):
+                timings = []
+                for _ in range(runs):
+                    start = time.perf_counter()
+                    read(db)
+                    timings.append(time.perf_counter() - start)
+                results.append({
+                    "endpoint": name,
+                    "products": products,
+                    "low": crud.count_low_stock(db),
+                    "best_s": round(min(timings), 4),
+                    "median_s": round(sorted(timings)[len(timings) // 2], 4),
+                })
+        finally:
+            db.close()
+    return results
@@ -0,0 +1,149 @@
+"""
+    Benchmark scenarios.
+
+    A scenario is an async function (client, ctx, state) -> status code that
+    performs one operation. `ctx` holds the seeded barcodes; `state` is per
+    simulated client (its rng, ETag, cursor, ...). The driver times each call.
+"""
+import random
+
+SCAN = {"decrement_by": 1, "purpose": "sale", "scanned_by": "bench"}
+
+
+class Context:
+    def __init__(self, barcodes: list[str], hot: int):
+        self.barcodes = barcodes
+        self.hot = barcodes[:hot] or barcodes
+
+
+def new_state(ctx: Context, client_id: int) -> dict:
+    return {"rng": random.Random(client_id), "id": client_id}
+
+
+def _hot(ctx: Context, state: dict) -> str:
+    return state["rng"].choice(ctx.hot)
+
+
+def _skewed(ctx: Context, state: dict) -> str:
+    """80% of lookups hit the hot SKUs, like a shop floor"""
+    rng = state["rng"]
+    return rng.choice(ctx.hot) if rng.random() < 0.8 else rng.choice(ctx.barcodes)
+
+
+# ---------- Scans ----------
+async def scan_atomic(client, ctx, state) -> int:
+    """Decrement + scan log in one request (POST /products/scan/{barcode}/log)"""
+    r = await client.post(f"/products/scan/{_hot(ctx, state)}/log", json=SCAN)
+    return r.status_code
+
+async def scan_two_call(client, ctx, state) -> int:
+    """Legacy client flow: decrement, then post the scan log with the returned product"""
+    r = await client.post(f"/products/scan/{_hot(ctx, state)}", json={"decrement_by": 1})
+    if r.status_code != 200:
+        return r.status_code
+    product = r.json()
+    r = await client.post("/scan_logs/", json={
+        "purpose": SCAN["purpose"],
+        "scanned_by": SCAN["scanned_by"],
+        "product_id": product["id"],
+        "quantity": product["quantity"],
+        "threshold": product["threshold"],
+        "classification": product["classification"],
+        "decremented_by": 1,
+    })
+    return r.status_code
+
+async def scan_batch(client, ctx, state) -> int:
+    """An offline scanner flushing a queue of 50 scans"""
+    batch = [{**SCAN, "barcode": _skewed(ctx, state)} for _ in range(50)]
+    r = await client.post("/products/scan/batch", json=batch)
+    return r.status_code
+
+# ---------- Catalogue ----------
+async def lookup(client, ctx, state) -> int:
+    r = await client.get(f"/products/{_skewed(ctx, state)}")
+    return r.status_code
+
+async def catalogue_poll(client, ctx, state) -> int:
+    """Frontend polling the full list with If-None-Match"""
+    headers = {"If-None-Match": state["etag"]} if "etag" in state else {}
+    r = await client.get("/products/", headers=headers)
+    if "etag" in r.headers:
+        state["etag"] = r.headers["etag"]
+    return r.status_code
+
+async def catalogue_delta(client, ctx, state) -> int:
+    """Frontend polling ?since=<version> after one full load"""
+    if "version" not in state:
+        r = await client.get("/products/")
+        state["version"] = int(r.headers.get("x-catalog-version", 0))
+        return r.status_code
+    r = await client.get("/products/", params={"since": state["version"]})
+    if r.status_code == 200:
+        state["version"] = r.json()["version"]
+    return r.status_code
+
+# ---------- Scan logs ----------
+async def log_pagination(client, ctx, state) -> int:
+    """Walk the log 100 rows at a time, newest first, restarting after 20 pages"""
+    params = {"limit": 100, "order": "desc"}
+    if state.get("cursor") and state.get("pages", 0) < 20:
+        params["cursor"] = state["cursor"]
+    else:
+        state["pages"] = 0
+    r = await client.get("/scan_logs/", params=params)
+    state["cursor"] = r.headers.get("x-next-cursor")
+    state["pages"] = state.get("pages", 0) + 1
+    return r.status_code
+
+async def export_csv(client, ctx, state) -> int:
+    async with client.stream("GET", "/scan_logs/export", params={"format": "csv"}) as r:
+        async for _ in r.aiter_bytes():
+            pass
+        return r.status_code
+
+# ---------- Product creation ----------
+async def create_product(client, ctx, state) -> int:
+    """Create a product (barcode allocation + background image rendering)"""
+    state["created"] = state.get("created", 0) + 1
+    r = await client.post("/products/", json={
+        "name": f"Bench {state['id']}-{state['created']}",
+        "quantity": 100,
+        "quantity_to_order": 10,
+        "threshold": 5,
+        "classification": "Tools",
+    })
+    return r.status_code
+
+# ---------- Mixed ----------
+MIX = ((scan_atomic, 0.70), (lookup, 0.20), (catalogue_poll, 0.08), (log_pagination, 0.02))
+
+async def mixed(client, ctx, state) -> int:
+    """Shop-floor mix: mostly scans and lookups, some polling and log browsing"""
+    operations, weights = zip(*MIX)
+    operation = state["rng"].choices(operations, weights)[0]
+    return await operation(client, ctx, state)
+
+
+SCENARIOS = {
+    fn.__name__: fn
+    for fn in (
+        scan_atomic, scan_two_call, scan_batch, lookup, catalogue_poll, catalogue_delta,
+        log_pagination, export_csv, create_product, mixed,
+    )
+}
+
+# (scenario, concurrency) pairs per suite
+SUITES = {
+    "default": [
+        ("scan_atomic", 16), ("scan_two_call", 16), ("scan_batch", 4), ("lookup", 16),
+        ("catalogue_poll", 16), ("catalogue_delta", 16), ("log_pagination", 8),
+        ("export_csv", 2), ("create_product", 4), ("mixed", 32),
+    ],
+    # Two calls vs the atomic endpoint on a handful of hot SKUs
+    "hot-sku": [
+        (name, concurrency) for concurrency in (1, 16, 64) for name in ("scan_atomic", "scan_two_call")
+    ],
+    # 1,000 concurrent handhelds; run with and without --async-mode and compare p99
+    "scanners": [("scan_atomic", 1000)],
+}
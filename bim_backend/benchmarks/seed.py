@@ -0,0 +1,94 @@
+"""
+    Seed a benchmark database with N products and M scan logs.
+
+    Rows go in with executemany INSERTs in chunks. Scan logs are skewed toward
+    the hot SKUs (the first `hot` products) and spread over the last
+    `days` days. The same rng seed gives the same data.
+"""
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+SEED_CHUNK = 10000
+PURPOSES = ("sale", "restock check", "transfer", "damaged")
+CLASSIFICATIONS = ("Tools", "Electrical", "Plumbing", "Paint", "Hardware", "Garden")
+OPERATORS = [f"operator{i}" for i in range(20)]
+
+
+def seed(products: int, logs: int, hot: int = 10, days: int = 90, rng_seed: int = 42, product_name=None) -> dict:
+    """Recreate all tables and fill them; returns timings. product_name(i, rng) overrides "Product <i>"."""
+    from app import catalog_version, models
+    from app.barcode_allocator import allocator
+    from app.barcode_images import BARCODE_DIR
+    from app.database import Base, SessionLocal, engine
+
+    rng = random.Random(rng_seed)
+    timings = {}
+
+    start = time.perf_counter()
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    timings["schema_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db = SessionLocal()
+    try:
+        barcodes = allocator.allocate_many(products) if products else []
+        for offset in range(0, products, SEED_CHUNK):
+            version = catalog_version.next_version(db)
+            db.execute(insert(models.ProductDB), [
+                {
+                    "name": product_name(i, rng) if product_name else f"Product {i}",
+                    "barcode": barcodes[i],
+                    "barcode_file": os.path.join(BARCODE_DIR, barcodes[i]),
+                    "quantity": 1_000_000_000,  # scan storms must never run out of stock
+                    "quantity_to_order": 100,
+                    "threshold": 5,
+                    "classification": CLASSIFICATIONS[i % len(CLASSIFICATIONS)],
+                    "version": version,
+                }
+                for i in range(offset, min(offset + SEED_CHUNK, products))
+            ])
+            db.commit()
+        timings["products_s"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        ids = db.execute(select(models.ProductDB.id).order_by(models.ProductDB.id)).scalars().all()
+        hot_ids = ids[:hot]
+        now = datetime.now()
+        span = days * 86400
+        for offset in range(0, logs if ids else 0, SEED_CHUNK):
+            rows = []
+            for _ in range(min(SEED_CHUNK, logs - offset)):
+                product_id = rng.choice(hot_ids) if rng.random() < 0.5 else rng.choice(ids)
+                rows.append({
+                    "product_id": product_id,
+                    "purpose": rng.choice(PURPOSES),
+                    "scanned_by": rng.choice(OPERATORS),
+                    "scanned_at": now - timedelta(seconds=rng.random() * span),
+                    "quantity": 1_000_000_000,
+                    "threshold": 5,
+                    "decremented_by": rng.randint(1, 5),
+                    "classification": CLASSIFICATIONS[(product_id - 1) % len(CLASSIFICATIONS)],
+                })
+            db.execute(insert(models.ScanLog), rows)
+            db.commit()
+        timings["logs_s"] = time.perf_counter() - start
+    finally:
+        db.close()
+    return timings
+
+
+def load_barcodes() -> list[str]:
+    """Seeded barcodes in id order (the first ones are the hot SKUs)"""
+    from app import models
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        return db.execute(select(models.ProductDB.barcode).order_by(models.ProductDB.id)).scalars().all()
+    finally:
+        db.close()
@@ -0,0 +1,60 @@
+"""
+    Shared test setup: the app runs against a throwaway SQLite database in a
+    temp directory (barcode images land there too), never the one in .env.
+    Set TEST_DATABASE_URL to run the suite against another database.
+"""
+import os
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORKDIR = tempfile.mkdtemp(prefix="bim-tests-")
+
+# Before anything imports app.*: database.py reads these at import time (and load_dotenv doesn't override them)
+os.environ["DATABASE_URL"] = os.getenv("TEST_DATABASE_URL", f"sqlite:///{os.path.join(WORKDIR, 'test.db')}")
+os.environ["SMTP_SERVER"] = "127.0.0.1"
+os.environ["SMTP_PORT"] = "1"  # nothing listens there; tests that send mail start their own server
+os.environ["SMTP_USER"] = ""
+os.environ["SMTP_PASSWORD"] = ""
+os.chdir(WORKDIR)
+sys.path.insert(0, BACKEND_DIR)
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from app.database import engine
+from app.main import app
+
+
+@pytest.fixture(scope="session")
+def client():
+    """The app without its lifespan, so no background job issues queries behind a test's back"""
+    return TestClient(app)
+
+
+@pytest.fixture
+def make_product(client):
+    def make(name="Widget", quantity=100, threshold=5, classification="Tools", quantity_to_order=10):
+        r = client.post("/products/", json={
+            "name": name, "quantity": quantity, "threshold": threshold,
+            "classification": classification, "quantity_to_order": quantity_to_order,
+        })
+        assert r.status_code == 200, r.text
+        return r.json()
+    return make
+
+
+@pytest.fixture
+def queries():
+    """SQL statements executed while the test runs"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
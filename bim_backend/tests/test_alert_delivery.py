@@ -0,0 +1,111 @@
+"""Restock alert digests go out as one message to every recipient, against a local aiosmtpd (no AUTH)."""
+import asyncio
+import email
+import socket
+from datetime import datetime, timedelta
+from email import policy
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import delete, insert, update
+
+from app import email_service, models
+from app.alert_dispatcher import AlertDispatcher
+from app.database import engine
+
+RECIPIENTS = ["manager@example.com", "buyer@example.com", "floor@example.com"]
+
+
+class Inbox:
+    def __init__(self):
+        self.envelopes = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.envelopes.append(envelope)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    inbox = Inbox()
+    controller = Controller(inbox, hostname="127.0.0.1", port=port)
+    controller.start()
+    monkeypatch.setattr(email_service, "SMTP_SERVER", "127.0.0.1")
+    monkeypatch.setattr(email_service, "SMTP_PORT", port)
+    monkeypatch.setattr(email_service, "SMTP_STARTTLS", False)
+    # As in .env: credentials set, but this server offers no AUTH, so there must be no login attempt
+    monkeypatch.setattr(email_service, "SMTP_USER", "alerts@example.com")
+    monkeypatch.setattr(email_service, "SMTP_PASSWORD", "secret")
+    monkeypatch.setattr(email_service, "SMTP_FROM", "alerts@example.com")
+    try:
+        yield inbox
+    finally:
+        email_service.smtp_connection.close()
+        controller.stop()
+
+
+@pytest.fixture
+def due_alerts():
+    """Three pending outbox alerts, old enough for the digest window, and the recipient list"""
+    outbox = models.AlertOutbox.__table__
+    with engine.begin() as conn:
+        conn.execute(update(outbox).where(outbox.c.sent_at.is_(None)).values(sent_at=datetime.now()))
+        conn.execute(delete(models.EmailSettingsDB.__table__))
+        conn.execute(insert(models.EmailSettingsDB.__table__), [{"email": email} for email in RECIPIENTS])
+        ids = conn.execute(insert(outbox).returning(outbox.c.id), [
+            {
+                "product_id": i, "product_name": f"Digest product {i}", "quantity": i, "threshold": 5,
+                "quantity_to_order": 10, "created_at": datetime.now() - timedelta(minutes=1),
+            }
+            for i in range(3)
+        ]).scalars().all()
+    yield ids
+    with engine.begin() as conn:
+        conn.execute(delete(models.EmailSettingsDB.__table__))
+
+
+def sent_ids(ids):
+    outbox = models.AlertOutbox.__table__
+    with engine.connect() as conn:
+        return set(conn.execute(outbox.select().where(outbox.c.id.in_(ids), outbox.c.sent_at.is_not(None))).scalars())
+
+
+def check_digest(inbox, ids):
+    assert len(inbox.envelopes) == 1
+    envelope = inbox.envelopes[0]
+    assert sorted(envelope.rcpt_tos) == sorted(RECIPIENTS)
+    message = email.message_from_bytes(envelope.content, policy=policy.default)
+    assert "Restock Alert: 3 products" in message["Subject"]
+    body = message.get_content()
+    assert all(f"Digest product {i}" in body for i in range(3))
+    assert sent_ids(ids) == set(ids)
+
+
+def test_digest_reaches_all_recipients(smtp_server, due_alerts):
+    assert AlertDispatcher(digest_window=30).run_once() == 3
+    check_digest(smtp_server, due_alerts)
+
+
+def test_digest_reaches_all_recipients_async(smtp_server, due_alerts):
+    async def run():
+        try:
+            return await AlertDispatcher(digest_window=30).run_once_async()
+        finally:
+            await email_service.async_smtp_connection.close()
+
+    assert asyncio.run(run()) == 3
+    check_digest(smtp_server, due_alerts)
+
+
+def test_async_connection_follows_the_event_loop(smtp_server):
+    """The dispatcher may run on a new loop each time (asyncio.run); the pooled session mustn't leak across"""
+    message = email_service.build_threshold_email(RECIPIENTS, [
+        {"product_name": "Loop product", "quantity": 1, "threshold": 5, "quantity_to_order": 10},
+    ])
+    for _ in range(2):
+        asyncio.run(email_service.async_smtp_connection.send(message, RECIPIENTS))
+    asyncio.run(email_service.async_smtp_connection.close())
+    assert len(smtp_server.envelopes) == 2
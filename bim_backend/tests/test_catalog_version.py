@@ -0,0 +1,62 @@
+"""Catalog versions stamped after commit (CATALOG_STAMP=after_commit): writes don't touch the counter, delta sync still sees everything."""
+import pytest
+from sqlalchemy import select, update
+
+from app import catalog_version, crud, models
+from app.database import SessionLocal, engine
+
+
+@pytest.fixture
+def after_commit(monkeypatch):
+    monkeypatch.setattr(catalog_version, "CATALOG_STAMP", "after_commit")
+
+
+def pending_rows():
+    with engine.connect() as conn:
+        return conn.execute(select(models.ProductDB.id).where(models.ProductDB.version == catalog_version.PENDING)).all()
+
+
+def test_write_transaction_leaves_the_counter_alone(after_commit, make_product, queries):
+    product = make_product(name="Stamped after commit")
+    db = SessionLocal()
+    try:
+        before = catalog_version.read_version(db)
+        db.commit()
+        queries.clear()
+        assert crud.decrement_product_quantity(db, product["barcode"], 1) is not None
+        assert not [q for q in queries if "counters" in q], queries
+        db.commit()
+        version = catalog_version.read_version(db)
+        stamped = db.execute(select(models.ProductDB.version).where(models.ProductDB.id == product["id"])).scalar()
+    finally:
+        db.close()
+    assert version == before + 1
+    assert stamped == version
+    assert not pending_rows()
+
+
+def test_delta_sync_sees_changes_and_deletes(after_commit, client, make_product):
+    kept, dropped = make_product(name="Delta kept"), make_product(name="Delta dropped")
+    since = client.get("/products/", params={"since": 0}).json()["version"]
+
+    assert client.post(f"/products/scan/{kept['barcode']}", json={"decrement_by": 2}).status_code == 200
+    assert client.delete(f"/products/{dropped['barcode']}").status_code == 200
+
+    delta = client.get("/products/", params={"since": since}).json()
+    assert [p["barcode"] for p in delta["changed"]] == [kept["barcode"]]
+    assert delta["changed"][0]["quantity"] == kept["quantity"] - 2
+    assert delta["deleted"] == [dropped["barcode"]]
+    assert delta["version"] > since
+    assert client.get("/products/", params={"since": delta["version"]}).json()["changed"] == []
+
+
+def test_rows_left_pending_are_stamped_by_the_next_write(after_commit, client, make_product):
+    orphan, other = make_product(name="Orphaned stamp"), make_product(name="Next writer")
+    with engine.begin() as conn:  # as if the worker died between commit and stamp
+        conn.execute(update(models.ProductDB).where(models.ProductDB.id == orphan["id"]).values(version=catalog_version.PENDING))
+    since = client.get("/products/", params={"since": 0}).json()["version"]
+
+    assert client.post(f"/products/scan/{other['barcode']}", json={"decrement_by": 1}).status_code == 200
+    changed = {p["barcode"] for p in client.get("/products/", params={"since": since}).json()["changed"]}
+    assert changed == {orphan["barcode"], other["barcode"]}
+    assert not pending_rows()
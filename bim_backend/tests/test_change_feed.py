@@ -0,0 +1,43 @@
+"""Stock changes made with Core UPDATEs (restocks, resharding) still reach the change feed."""
+import pytest
+
+from app.change_feed import feed
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Events the broker is asked to publish while the test runs"""
+    events = []
+    publish = feed.broker.publish
+
+    def record(batch):
+        events.extend(batch)
+        publish(batch)
+
+    monkeypatch.setattr(feed.broker, "publish", record)
+    return events
+
+
+@pytest.mark.parametrize("shards", [0, 4])
+def test_restock_publishes(client, make_product, published, shards):
+    product = make_product(name=f"Feed restock {shards}", quantity=10)
+    if shards:
+        assert client.put(f"/products/{product['barcode']}/stock/shards", params={"count": shards}).status_code == 200
+    published.clear()
+
+    r = client.post(f"/products/{product['barcode']}/restock", json={"quantity": 5})
+    assert r.status_code == 200, r.text
+    [event] = [e for e in published if e["type"] == "restock"]
+    assert event["barcode"] == product["barcode"]
+    assert event["quantity"] == 15
+    assert event["restocked_by"] == 5
+
+
+def test_set_shards_publishes(client, make_product, published):
+    product = make_product(name="Feed shards", quantity=12)
+    r = client.put(f"/products/{product['barcode']}/stock/shards", params={"count": 3})
+    assert r.status_code == 200, r.text
+    [event] = [e for e in published if e["type"] == "product.updated"]
+    assert event["barcode"] == product["barcode"]
+    assert event["quantity"] == 12
+    assert event["stock_shards"] == 3
@@ -0,0 +1,53 @@
+"""Concurrent retries of a scan with one Idempotency-Key decrement stock once and replay the first response."""
+import asyncio
+import uuid
+
+import httpx
+from sqlalchemy import func, select
+
+from app import models
+from app.database import engine
+from app.idempotency import store
+from app.main import app
+
+DUPLICATES = 20
+
+
+def send_all(requests):
+    """Send (path, body, headers) requests at once, from one event loop like a single worker"""
+    async def send():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await asyncio.gather(*(client.post(path, json=body, headers=headers) for path, body, headers in requests))
+    return asyncio.run(send())
+
+
+def scan_logs_of(product_id):
+    with engine.connect() as conn:
+        return conn.execute(select(func.count()).where(models.ScanLog.product_id == product_id)).scalar()
+
+
+def test_concurrent_duplicates_decrement_once(client, make_product):
+    product = make_product(name="Idempotent scan", quantity=50)
+    path = f"/products/scan/{product['barcode']}/log"
+    body = {"decrement_by": 3, "purpose": "sale", "scanned_by": "retrying scanner"}
+    headers = {"Idempotency-Key": str(uuid.uuid4())}
+
+    responses = send_all([(path, body, headers)] * DUPLICATES)
+
+    assert [r.status_code for r in responses] == [200] * DUPLICATES, [r.text for r in responses]
+    assert len({r.content for r in responses}) == 1
+    replayed = [r for r in responses if r.headers.get("Idempotent-Replayed") == "true"]
+    assert len(replayed) == DUPLICATES - 1
+    assert client.get(f"/products/{product['barcode']}").json()["quantity"] == 47
+    assert scan_logs_of(product["id"]) == 1
+
+    # A later retry is replayed from the idempotency_keys table too, not just this worker's LRU
+    store._entries.clear()
+    [again] = send_all([(path, body, headers)])
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert again.content == responses[0].content
+
+    [other] = send_all([(path, {**body, "decrement_by": 4}, headers)])
+    assert other.status_code == 422
+    assert client.get(f"/products/{product['barcode']}").json()["quantity"] == 47
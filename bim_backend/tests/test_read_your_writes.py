@@ -0,0 +1,24 @@
+"""A successful write pins the client's reads to the primary, whichever kind of replicas are configured."""
+import pytest
+
+from app import database
+
+
+@pytest.mark.parametrize("configured", ["replicas", "async_replicas"])
+def test_write_sets_read_primary_cookie(client, make_product, monkeypatch, configured):
+    monkeypatch.setattr(database, "replicas", None)
+    monkeypatch.setattr(database, "async_replicas", None)
+    monkeypatch.setattr(database, configured, object())  # a write never routes to it
+    client.cookies.clear()
+
+    make_product(name=f"Read your writes {configured}")
+    assert database.READ_PRIMARY_COOKIE in client.cookies
+    client.cookies.clear()  # the session-wide client would otherwise keep it
+
+
+def test_no_cookie_without_replicas(client, make_product, monkeypatch):
+    monkeypatch.setattr(database, "replicas", None)
+    monkeypatch.setattr(database, "async_replicas", None)
+    client.cookies.clear()
+    make_product(name="Read your writes, no replicas")
+    assert database.READ_PRIMARY_COOKIE not in client.cookies
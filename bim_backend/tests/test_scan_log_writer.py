@@ -0,0 +1,68 @@
+"""Group commit (SCAN_LOG_GROUP_COMMIT): a request that waits too long for the writer gets a 503, and its log is
+written only if the writer had already taken it."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import select
+
+from app import models
+from app.database import engine
+from app.routes import scan_logs
+from app.scan_log_writer import scan_log_writer
+
+
+@pytest.fixture
+def stalled_writer(monkeypatch):
+    """The group commit writer, stuck on its first group until the returned event is set"""
+    release = threading.Event()
+    write = scan_log_writer._write
+
+    def stalled(group):
+        release.wait(10)
+        write(group)
+
+    monkeypatch.setattr(scan_logs, "SCAN_LOG_WAIT_TIMEOUT", 0.3)
+    monkeypatch.setattr(scan_log_writer, "enabled", True)
+    monkeypatch.setattr(scan_log_writer, "_write", stalled)
+    scan_log_writer.start()
+    try:
+        yield release
+    finally:
+        release.set()
+        scan_log_writer.stop()
+
+
+def logged_by(names):
+    with engine.connect() as conn:
+        return set(conn.execute(select(models.ScanLog.scanned_by).where(models.ScanLog.scanned_by.in_(names))).scalars())
+
+
+def test_slow_writer_answers_503(client, make_product, stalled_writer):
+    product = make_product(name="Stalled writer")
+
+    def log(by):
+        return client.post("/scan_logs/", json={
+            "product_id": product["id"], "purpose": "sale", "scanned_by": by, "decremented_by": 1,
+            "quantity": product["quantity"], "threshold": product["threshold"], "classification": product["classification"],
+        })
+
+    with ThreadPoolExecutor(2) as pool:
+        writing = pool.submit(log, "taken by the writer")
+        time.sleep(0.1)  # the writer picks the first row up and stalls on it
+        queued = pool.submit(log, "still queued")
+        responses = [writing.result(), queued.result()]
+
+    for r in responses:
+        assert r.status_code == 503, r.text
+        assert r.headers["Retry-After"] == "1"
+    stalled_writer.set()
+    scan_log_writer.stop()
+    # The queued row was cancelled, the one already being written still commits
+    assert logged_by(["taken by the writer", "still queued"]) == {"taken by the writer"}
+
+    scan_log_writer.start()
+    r = log("after the stall")
+    assert r.status_code == 200, r.text
+    assert r.json()["scanned_by"] == "after the stall"
@@ -0,0 +1,41 @@
+"""GET /scan_logs/ loads a page of logs and their products in one statement, whatever the page size."""
+import pytest
+
+PAGE_QUERIES = 1
+
+
+def scan(client, product, by="tester"):
+    r = client.post(f"/products/scan/{product['barcode']}/log", json={"decrement_by": 1, "purpose": "sale", "scanned_by": by})
+    assert r.status_code == 200, r.text
+
+
+@pytest.mark.parametrize("logs", [1, 25])
+def test_scan_log_page_query_count(client, make_product, queries, logs):
+    product = make_product(name=f"Query count {logs}")
+    for _ in range(logs):
+        scan(client, product)
+
+    queries.clear()
+    r = client.get("/scan_logs/", params={"product_id": product["id"], "limit": 100})
+    assert r.status_code == 200
+    assert len(r.json()) == logs
+    assert all(log["product"]["barcode"] == product["barcode"] for log in r.json())
+    assert len(queries) == PAGE_QUERIES, queries
+
+
+def test_scan_log_page_query_count_across_products(client, make_product, queries):
+    products = [make_product(name=f"Query count mixed {i}", classification="QueryCount") for i in range(10)]
+    for product in products:
+        scan(client, product)
+        scan(client, product)
+
+    queries.clear()
+    r = client.get("/scan_logs/", params={"classification": "QueryCount", "limit": 100})
+    assert r.status_code == 200
+    assert {log["product"]["id"] for log in r.json()} == {p["id"] for p in products}
+    assert len(queries) == PAGE_QUERIES, queries
+
+    queries.clear()
+    r = client.get("/scan_logs/", params={"barcode": products[0]["barcode"]})
+    assert len(r.json()) == 2
+    assert len(queries) == PAGE_QUERIES, queries
@@ -0,0 +1,47 @@
+"""Every quantity in the catalog adds up from the stock ledger, whichever path wrote it."""
+import json
+
+from sqlalchemy import func, select
+
+from app import models
+from app.database import engine
+
+
+def ledger_sums(product_ids):
+    movements = models.StockMovement
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(movements.product_id, func.sum(movements.delta))
+            .where(movements.product_id.in_(product_ids))
+            .group_by(movements.product_id)
+        ).all()
+    return dict(rows)
+
+
+def quantities(product_ids):
+    products = models.ProductDB
+    with engine.connect() as conn:
+        return dict(conn.execute(select(products.id, products.quantity).where(products.id.in_(product_ids))).all())
+
+
+def test_import_writes_initial_movements(client):
+    csv = "name,quantity,threshold,classification,quantity_to_order\n"
+    csv += "".join(f"Ledger import {i},{i * 7},5,LedgerImport,10\n" for i in range(20))
+    r = client.post("/products/import", files={"file": ("products.csv", csv.encode(), "text/csv")})
+    events = [json.loads(line) for line in r.text.splitlines()]
+    assert events[-1] == {"event": "done", "rows": 20, "imported": 20, "failed": 0}
+
+    with engine.connect() as conn:
+        imported = conn.execute(
+            select(models.ProductDB.id, models.ProductDB.barcode).where(models.ProductDB.classification == "LedgerImport")
+        ).all()
+    ids = [product_id for product_id, _ in imported]
+    expected = {product_id: quantity for product_id, quantity in quantities(ids).items() if quantity}
+    assert len(expected) == 19  # quantity 0 gets no movement
+    assert ledger_sums(ids) == expected
+
+    barcode = imported[-1][1]
+    assert client.post(f"/products/scan/{barcode}", json={"decrement_by": 3}).status_code == 200
+    stock = client.get(f"/products/{barcode}/stock").json()
+    assert stock["ledger"]["quantity"] == stock["quantity"]
+    assert ledger_sums(ids) == {product_id: quantity for product_id, quantity in quantities(ids).items() if quantity}
@@ -5,6 +5,19 @@ import axios from "axios";
 import { useColorScheme } from "react-native";
 import API_URL from "@/constants/api";
 
+// Retries of one submission reuse its Idempotency-Key, so the server applies it once
+const SUBMIT_ATTEMPTS = 4;
+const SUBMIT_TIMEOUT_MS = 10000;
+
+const newIdempotencyKey = () =>
+  `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}${Math.random().toString(36).slice(2)}`;
+
+// Network errors, timeouts, 5xx and 409 (the same key still running) are safe to retry
+const isRetryable = (error: any) =>
+  !error?.response || error.response.status >= 500 || error.response.status === 409;
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms));
+
 export default function ScanFormScreen() {
   const params = useLocalSearchParams<{
     barcode: string;
@@ -21,6 +34,7 @@ export default function ScanFormScreen() {
   const [purpose, setPurpose] = useState("");
   const [name, setName] = useState("");
   const [decrementValue, setDecrementValue] = useState("1");
+  const [submitting, setSubmitting] = useState(false);
 
   // const handleSubmit = async () => {
   //   if (!purpose || !name) {
@@ -66,25 +80,25 @@ export default function ScanFormScreen() {
       return;
     }
 
-    try {
-      // 1. Decrement product quantity (send decrement value)
-      const scanResponse = await axios.post(
-        `${API_URL}/products/scan/${barcode}`,
-        {
-          decrement_by: parsedDecrement,
-        },
-      );
+    if (submitting) return;
+    setSubmitting(true);
+    const idempotencyKey = newIdempotencyKey();
 
-      // 2. Save scan log using updated quantity from backend
-      await axios.post(`${API_URL}/scan_logs/`, {
-        purpose,
-        scanned_by: name,
-        product_id: parseInt(product_id, 10),
-        quantity: scanResponse.data.quantity, // real updated quantity
-        threshold: scanResponse.data.threshold, // real threshold
-        decremented_by: parsedDecrement, // NEW
-        classification: product_classification
-      });
+    try {
+      // Decrement product quantity and save the scan log in one request
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await axios.post(
+            `${API_URL}/products/scan/${barcode}/log`,
+            { decrement_by: parsedDecrement, purpose, scanned_by: name },
+            { headers: { "Idempotency-Key": idempotencyKey }, timeout: SUBMIT_TIMEOUT_MS },
+          );
+          break;
+        } catch (error: any) {
+          if (attempt >= SUBMIT_ATTEMPTS || !isRetryable(error)) throw error;
+          await sleep(500 * 2 ** (attempt - 1));
+        }
+      }
 
       Alert.alert("Success", `Exported ${parsedDecrement} products successfully`);
 
@@ -98,6 +112,8 @@ export default function ScanFormScreen() {
           error?.message ||
           "Something went wrong",
       );
+    } finally {
+      setSubmitting(false);
     }
   };
 
@@ -182,7 +198,7 @@ export default function ScanFormScreen() {
       />
 
       <View style={{ marginTop: 20 }}>
-        <Button title="Submit Scan Log" onPress={handleSubmit} />
+        <Button title="Submit Scan Log" onPress={handleSubmit} disabled={submitting} />
       </View>
     </View>
   );